@@ -1,222 +1,216 @@
 # app.py
 
 from flask import Flask, render_template, request, jsonify, url_for
-import joblib
-import pandas as pd
 import numpy as np
 import sys
 import os
+import threading
+import time
 
+import train_model
 from firebase_dal import (
-    get_user_swipes, add_user_swipe, get_user_preferences, 
-    get_user_liked_book_ids, save_user_preferences, get_user_disliked_book_ids,
+    get_user_swipe_state, add_user_swipe, get_user_preferences, save_user_preferences,
     search_users, send_friend_request, answer_friend_request,
-    get_friend_requests, get_friends, get_friends_preferences_data, remove_user_swipe
+    get_friend_requests, get_friend_cards, load_user_context, remove_user_swipe,
+    get_swipe_buffer_metrics, get_cache_metrics, warm_up_user_directory
 )
 
 # --- CONFIGURATION ---
 app = Flask(__name__)
 
+# Cards returned per /api/next_batch (and the cap for batched /api/swipe requests)
+DEFAULT_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 50
+
 # --- LOAD AI MODEL ---
+
 try:
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    sim_matrix_path = os.path.join(base_dir, 'models/similarity_matrix.joblib')
-    book_data_path = os.path.join(base_dir, 'models/book_data_processed.joblib')
+    models_dir = train_model.MODELS_DIR
 
-    if not os.path.exists(sim_matrix_path) or not os.path.exists(book_data_path):
+    if not train_model.model_exists(models_dir):
         print(f"Model files not found. Attempting to train model...")
-        import train_model
         success = train_model.train_model()
         if not success:
             print("FATAL: Model training failed on startup.")
             sys.exit(1)
             
-    COSINE_SIM = joblib.load(sim_matrix_path)
-    BOOK_DATA = joblib.load(book_data_path)
-    
-    # PRE-PROCESS OPTIMIZATION: Convert genres to lowercase string once
-    BOOK_DATA['genres_str'] = BOOK_DATA['genres'].fillna('').astype(str).str.lower()
-    
-    print("AI Model loaded successfully.")
+    # - CATALOG: columnar book store (titles, authors, ...) addressed by integer position
+    # Numeric artifacts are memory-mapped (shared by all workers):
+    # - NEIGHBORS: top-K most similar books per book (sparse graph or ANN index)
+    # - CENTRALITY: row-mean similarity per book, precomputed at training time
+    # - GENRE_INDEX: book x genre matrix
+    MODEL_VERSION = train_model.current_version(models_dir)
+    CATALOG, NEIGHBORS, CENTRALITY, GENRE_INDEX = train_model.load_model(models_dir, version=MODEL_VERSION)
+    
+    print(f"AI Model loaded successfully (version {MODEL_VERSION}).")
 except Exception as e:
     print(f"FATAL: Error loading model files: {e}")
     sys.exit(1)
 
+# Friend search directory: the first export runs in the background while the app serves
+warm_up_user_directory()
+
+# --- MODEL RELOAD ---
+# /api/sync_database saves a new model version, but only the worker that handled it
+# swaps its globals. Every other worker checks the version pointer at most every
+# MODEL_CHECK_INTERVAL seconds (before a request) and loads the new version itself.
+# The four globals are replaced together between requests; with threaded workers a
+# request already running during the swap may still mix old and new artifacts.
+MODEL_CHECK_INTERVAL = float(os.getenv('MODEL_CHECK_INTERVAL', 5.0))  # seconds
+_model_checked_at = time.monotonic()
+_model_lock = threading.Lock()
+
+@app.before_request
+def reload_model_if_changed():
+    global CATALOG, NEIGHBORS, CENTRALITY, GENRE_INDEX, MODEL_VERSION, _model_checked_at
+    
+    now = time.monotonic()
+    if now - _model_checked_at < MODEL_CHECK_INTERVAL or not _model_lock.acquire(blocking=False):
+        return
+    try:
+        _model_checked_at = now
+        version = train_model.current_version(train_model.MODELS_DIR)
+        if version is None or version == MODEL_VERSION:
+            return
+        CATALOG, NEIGHBORS, CENTRALITY, GENRE_INDEX = train_model.load_model(train_model.MODELS_DIR, version=version)
+        MODEL_VERSION = version
+        print(f"Reloaded AI model version {version}.")
+    except Exception as e:
+        # Keep serving the loaded model; the next check retries
+        print(f"Error reloading model: {e}")
+    finally:
+        _model_lock.release()
+
 # --- AI RECOMMENDATION LOGIC ---
 
-def calculate_preference_score(book, user_genres):
+def calculate_preference_score(positions, user_genres):
     """
-    Calculate how well a book matches the user's preferences (0-1).
-    Optimized to use pre-calculated 'genres_str'.
+    Calculate how well the books at `positions` match the user's preferences (0-1).
+    Uses the precomputed GENRE_INDEX; pass positions=None to score the whole catalog.
     """
-    if not user_genres:
-        return 0.0
-    
-    # Access pre-calc lowercase string directly
-    book_genres_str = book.get('genres_str', '')
-    if not book_genres_str:
-         return 0.0
-
-    # Assume user_genres are already lowercased by the caller or do it simply
-    # (Doing it here 100s of times is minor compared to df operations but let's be safe)
-    # We will assume caller passes valid list.
-    
-    # Count matches
-    matches = 0
-    for genre in user_genres:
-        # Assuming user_genres passed in are already normalized or we do it cheaply
-        if genre.lower() in book_genres_str:
-            matches += 1
-    
-    return matches / len(user_genres)
+    return GENRE_INDEX.scores(user_genres, positions)
 
 def get_recommendations_sorted_by_preference(user_genres, history_list, limit=100):
     """
     Get books sorted by compatibility with user preferences.
     Returns a sorted list of (book_id, combined_score) tuples.
     """
-    all_scores = []
+    # Calculate genre preference score (0-1) for the whole catalog
+    genre_scores = calculate_preference_score(None, user_genres)
     
-    for book_id in BOOK_DATA.index:
-        # Skip already swiped books
-        if str(book_id) in history_list:
-            continue
-        
-        book = BOOK_DATA.loc[book_id]
-        
-        # Calculate genre preference score (0-1)
-        genre_score = calculate_preference_score(book, user_genres)
-        
-        # Get the average content similarity to all books (baseline relevance)
-        idx = BOOK_DATA.index.get_loc(book_id)
-        avg_similarity = COSINE_SIM[idx].mean()
-        
-        # Combined score: 70% genre match + 30% content similarity
-        # This ensures books matching user preferences are prioritized
-        combined_score = (genre_score * 0.7) + (avg_similarity * 0.3)
-        
-        all_scores.append((str(book_id), combined_score))
+    # Combined score: 70% genre match + 30% content similarity
+    # (precomputed average similarity to all books as baseline relevance)
+    # This ensures books matching user preferences are prioritized
+    combined_scores = (genre_scores * 0.7) + (CENTRALITY * 0.3)
+    
+    # Skip already swiped books
+    available = np.ones(len(CATALOG), dtype=bool)
+    available[CATALOG.positions(history_list)] = False
+    positions = np.flatnonzero(available)
     
     # Sort by combined score (highest first)
-    all_scores.sort(key=lambda x: x[1], reverse=True)
+    order = positions[np.argsort(-combined_scores[positions], kind='stable')[:limit]]
     
-    return all_scores[:limit]
+    return [(CATALOG.book_ids[pos], combined_scores[pos]) for pos in order]
 
-def get_recommendation_from_model(current_book_id, history_list, user_genres=None, liked_book_ids=None, disliked_book_ids=None, friends_genres=None, friends_likes_map=None):
+def title_match_mask(positions, other_positions):
+    """
+    Series/Title similarity: True where a candidate title contains (or is contained in)
+    one of the titles at `other_positions`. Titles of 5 chars or fewer never match.
+    Looked up in the title index precomputed with the catalog.
     """
-    Finds the next unread book.
-    Returns dict including 'liked_by' if applicable.
+    return CATALOG.title_index.mask(positions, other_positions)
+
+def score_candidates(idx, history_list, user_genres=None, liked_book_ids=None, disliked_book_ids=None, friends_genres=None, friends_likes_map=None):
     """
-    current_book_id = str(current_book_id)
+    Scores the 500 books most similar to the book at row `idx` in one pass of array operations.
+    Returns (candidate_positions, scores), already filtered for history and the current book.
+    """
+    # We want top 500 most similar, highest first (exact graph or approximate IVF index).
+    neighbor_positions, neighbor_sims = NEIGHBORS.neighbors(idx, 500)
+    candidates = neighbor_positions.astype(np.intp)
+    candidate_sims = neighbor_sims.astype(np.float64)
     
-    if current_book_id not in BOOK_DATA.index:
-        current_book_id = BOOK_DATA.index[0]
+    # Skip current book and already swiped books
+    keep = candidates != idx
+    keep &= ~np.isin(candidates, CATALOG.positions(history_list))
+    candidates = candidates[keep]
+    candidate_sims = candidate_sims[keep]
     
-    idx = BOOK_DATA.index.get_loc(current_book_id)
-    sim_scores = list(enumerate(COSINE_SIM[idx]))
+    liked_positions = CATALOG.positions(liked_book_ids)
+    disliked_positions = CATALOG.positions(disliked_book_ids)
     
-    # Pre-process liked data for fast lookup
-    liked_authors = set()
-    liked_titles = []
-    if liked_book_ids:
-        valid_ids = [bid for bid in liked_book_ids if bid in BOOK_DATA.index]
-        if valid_ids:
-            liked_authors = set(BOOK_DATA.loc[valid_ids]['author'].fillna('').str.lower().tolist())
-            liked_titles = BOOK_DATA.loc[valid_ids]['title'].fillna('').str.lower().tolist()
-            
-    # Pre-process disliked data
-    disliked_authors = set()
-    disliked_titles = []
-    if disliked_book_ids:
-        valid_bad_ids = [bid for bid in disliked_book_ids if bid in BOOK_DATA.index]
-        if valid_bad_ids:
-            disliked_authors = set(BOOK_DATA.loc[valid_bad_ids]['author'].fillna('').str.lower().tolist())
-            disliked_titles = BOOK_DATA.loc[valid_bad_ids]['title'].fillna('').str.lower().tolist()
-
-    # Enhanced Scoring Logic
-    enhanced_scores = []
-    
-    # OPTIMIZATION: Use numpy argsort for speed instead of converting to list and sorting
-    # We want top 500 most similar. 
-    # argsort returns indices of sorted array (ascending). We take the last 500 and reverse.
-    top_indices = COSINE_SIM[idx].argsort()[-500:][::-1]
-
-    for rec_idx in top_indices:
-        # Get the actual book ID from the index
-        rec_id = BOOK_DATA.index[rec_idx]
-        content_sim = COSINE_SIM[idx][rec_idx]
-        
-        # Skip current book and already swiped books
-        if str(rec_id) in history_list or rec_idx == idx:
-            continue
-        
-        book = BOOK_DATA.loc[rec_id]
-        
-        # 1. Base Score: Content Similarity (Weight: 40%)
-        score = content_sim * 0.4
-        
-        # 2. Preference Score: Genre Match (Weight: 40%)
-        if user_genres:
-            genre_score = calculate_preference_score(book, user_genres)
-            score += genre_score * 0.4
-        
-        # 3. Boost: Liked Author (+10%)
-        book_author = book.get('author', '').lower()
-        if book_author in liked_authors:
-            score += 0.1
-            
-        # 4. Boost: Series/Title Similarity (+15%)
-        title_lower = book['title'].lower()
-        if len(title_lower) > 5:
-            for l_title in liked_titles:
-                if len(l_title) > 5 and (l_title in title_lower or title_lower in l_title):
-                    score += 0.15
-                    break
-                    
-        # 5. PENALTY: Disliked Author (-15%)
-        if book_author in disliked_authors:
-            score -= 0.15
-            
-        if len(title_lower) > 5:
-            for d_title in disliked_titles:
-                 if len(d_title) > 5 and (d_title in title_lower or title_lower in d_title):
-                    score -= 0.10
-                    break
-        
-        # 7. Boost: Friend Recommendations (+10%)
-        # If a friend liked this book
-        liked_by_list = []
-        if friends_likes_map and str(rec_id) in friends_likes_map:
-             score += 0.15 # Increased boost
-             liked_by_list = friends_likes_map[str(rec_id)]
-             
-        # 8. Boost: Friend Genre Match (+5%)
-        if friends_genres:
-            f_genre_score = calculate_preference_score(book, friends_genres)
-            score += f_genre_score * 0.05
-                    
-        enhanced_scores.append((rec_id, score, liked_by_list))
-    
-    # Sort by final enhanced score
-    enhanced_scores.sort(key=lambda x: x[1], reverse=True)
-    
-    if enhanced_scores:
-        rec_id, score, liked_by_list = enhanced_scores[0]
-        recommended_book = BOOK_DATA.loc[rec_id]
+    # 1. Base Score: Content Similarity (Weight: 40%)
+    scores = candidate_sims * 0.4
+    
+    # 2. Preference Score: Genre Match (Weight: 40%)
+    if user_genres:
+        scores += calculate_preference_score(candidates, user_genres) * 0.4
+    
+    candidate_authors = CATALOG.author_ids[candidates]
+    
+    # 3. Boost: Liked Author (+10%)
+    if len(liked_positions):
+        liked_authors = CATALOG.author_ids[liked_positions]
+        scores += np.isin(candidate_authors, liked_authors) * 0.1
+    
+    # 4. Boost: Series/Title Similarity (+15%)
+    scores += title_match_mask(candidates, liked_positions) * 0.15
+    
+    # 5. PENALTY: Disliked Author (-15%)
+    if len(disliked_positions):
+        disliked_authors = CATALOG.author_ids[disliked_positions]
+        scores -= np.isin(candidate_authors, disliked_authors) * 0.15
+    
+    # 6. PENALTY: Disliked Series/Title (-10%)
+    scores -= title_match_mask(candidates, disliked_positions) * 0.10
+    
+    # 7. Boost: Friend Recommendations (+15%)
+    if friends_likes_map:
+        friend_liked_positions = CATALOG.positions(list(friends_likes_map.keys()))
+        scores += np.isin(candidates, friend_liked_positions) * 0.15
+    
+    # 8. Boost: Friend Genre Match (+5%)
+    if friends_genres:
+        scores += calculate_preference_score(candidates, friends_genres) * 0.05
+    
+    return candidates, scores
+
+# Sentinel card returned when there is nothing left to recommend
+NO_MORE_RECOMMENDATIONS = {'book_id': 'DONE', 'title': 'No More Recommendations!', 'description': 'You have swiped all related books.', 'image_url': '', 'score': 0, 'liked_by': []}
+
+def get_recommendations_from_model(current_book_id, history_list, user_genres=None, liked_book_ids=None, disliked_book_ids=None, friends_genres=None, friends_likes_map=None, limit=1):
+    """
+    Ranks the unread books around the current one and returns up to `limit` book dicts,
+    best first, each including 'liked_by' if applicable.
+    """
+    idx = CATALOG.position(current_book_id)
+    if idx is None:
+        idx = 0
+    
+    candidates, scores = score_candidates(idx, history_list, user_genres, liked_book_ids, disliked_book_ids, friends_genres, friends_likes_map)
+    
+    # Stable sort keeps the most similar candidate first on ties
+    order = np.argsort(-scores, kind='stable')[:limit]
+    
+    books = []
+    for best in order:
+        book = CATALOG.record(candidates[best])
         
-        final_score = max(0.0, min(score * 100, 100.0))
+        final_score = max(0.0, min(float(scores[best]) * 100, 100.0))
+        liked_by_list = friends_likes_map.get(book.book_id, []) if friends_likes_map else []
         
-        return {
-            'book_id': str(rec_id),
-            'title': recommended_book['title'],
-            'description': recommended_book['description'],
-            'image_url': recommended_book['image_url'],
+        books.append({
+            'book_id': book.book_id,
+            'title': book.title,
+            'description': book.description,
+            'image_url': book.image_url,
             'score': final_score,
-            'author': recommended_book.get('author', 'Unknown Author'),
+            'author': book.author or 'Unknown Author',
             'liked_by': liked_by_list
-        }
+        })
     
-    return {'book_id': 'DONE', 'title': 'No More Recommendations!', 'description': 'You have swiped all related books.', 'image_url': '', 'score': 0, 'liked_by': []}
+    return books
 
 def get_initial_book(user_genres, history_list):
     """
@@ -231,28 +225,29 @@ def get_initial_book(user_genres, history_list):
         
         if sorted_recommendations:
             best_book_id, score = sorted_recommendations[0]
-            book = BOOK_DATA.loc[best_book_id]
+            book = CATALOG.record(CATALOG.position(best_book_id))
             
             return {
-                'book_id': str(best_book_id),
-                'title': book['title'],
-                'description': book['description'],
-                'image_url': book['image_url'],
+                'book_id': book.book_id,
+                'title': book.title,
+                'description': book.description,
+                'image_url': book.image_url,
                 'score': f'{score * 100:.1f}% Match',
-                'author': book.get('author', 'Unknown Author')
+                'author': book.author or 'Unknown Author'
             }
     
     # Fallback: Return first book not in history
-    for book_id in BOOK_DATA.index:
-        if str(book_id) not in history_list:
-            book = BOOK_DATA.loc[book_id]
+    history = set(str(bid) for bid in history_list)
+    for position, book_id in enumerate(CATALOG.book_ids):
+        if book_id not in history:
+            book = CATALOG.record(position)
             return {
-                'book_id': str(book_id),
-                'title': book['title'],
-                'description': book['description'],
-                'image_url': book['image_url'],
+                'book_id': book.book_id,
+                'title': book.title,
+                'description': book.description,
+                'image_url': book.image_url,
                 'score': 'Start Swiping',
-                'author': book.get('author', 'Unknown Author')
+                'author': book.author or 'Unknown Author'
             }
     
     return {'book_id': 'DONE', 'title': 'No More Recommendations!', 'description': 'You have swiped all books.', 'image_url': '', 'score': 0}
@@ -297,33 +292,31 @@ def recommendation():
     user_id = request.args.get('user_id')
     
     initial_book = None
+    context = None
     if user_id:
-        history_list = get_user_swipes(user_id)
-        user_prefs = get_user_preferences(user_id)
-        user_genres = user_prefs.get('genres', []) if user_prefs else []
-        initial_book = get_initial_book(user_genres, history_list)
+        # Swipes, preferences and friends data are read concurrently
+        context = load_user_context(user_id)
+        initial_book = get_initial_book(context.genres, context.swipe_state.history)
     else:
         # Fallback if no user_id provided (e.g. direct access without param)
         # We'll just show the first book.
-        initial_book_data = BOOK_DATA.iloc[0]
+        book = CATALOG.record(0)
         initial_book = {
-            'book_id': str(initial_book_data.name),
-            'title': initial_book_data['title'],
-            'description': initial_book_data['description'],
-            'image_url': initial_book_data['image_url'],
+            'book_id': book.book_id,
+            'title': book.title,
+            'description': book.description,
+            'image_url': book.image_url,
             'score': 'Start Swiping',
-            'author': initial_book_data.get('author', 'Unknown Author')
+            'author': book.author or 'Unknown Author'
         }
 
     initial_liked_by_text = ""
-    if user_id and initial_book:
-        # Fetch friend likes for the initial book to display immediately
-        friends_list = get_friends(user_id)
-        if friends_list:
-            friends_genres, friends_likes_map = get_friends_preferences_data(friends_list)
-            if friends_likes_map and initial_book['book_id'] in friends_likes_map:
-                liked_emails = friends_likes_map[initial_book['book_id']]
-                initial_liked_by_text = "Liked by: " + ", ".join(liked_emails)
+    if context and initial_book:
+        # Friend likes for the initial book, to display immediately
+        friends_likes_map = context.friends_likes_map
+        if friends_likes_map and initial_book['book_id'] in friends_likes_map:
+            liked_emails = friends_likes_map[initial_book['book_id']]
+            initial_liked_by_text = "Liked by: " + ", ".join(liked_emails)
 
     return render_template('recommendation.html', 
         initial_book_id=initial_book['book_id'], 
@@ -335,8 +328,37 @@ def recommendation():
         initial_liked_by=initial_liked_by_text
     )
 
+def get_next_books(user_id, current_book_id, limit=1, exclude=()):
+    """
+    Loads the user's swipe history, preferences and friends data and ranks the next
+    `limit` books after `current_book_id`. Books in `exclude` (e.g. cards already
+    queued on the client) are treated as swiped.
+    """
+    # 1. LOAD (concurrent reads): swipe state, preferences and friends data
+    context = load_user_context(user_id)
+    
+    # 2. SWIPE STATE: history (filtering), likes (Author/Series matching), dislikes (Penalties)
+    swipe_state = context.swipe_state
+    history = swipe_state.history.union(str(bid) for bid in exclude)
+
+    # 3. AI: Rank the next books
+    return get_recommendations_from_model(current_book_id, history, context.genres, swipe_state.likes, swipe_state.dislikes, context.friends_genres, context.friends_likes_map, limit)
+
+def parse_batch_size(value):
+    """Number of cards requested by the client, capped at MAX_BATCH_SIZE (0 if absent)."""
+    try:
+        count = int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(count, MAX_BATCH_SIZE))
+
 @app.route('/api/swipe', methods=['POST'])
 def handle_swipe():
+    """
+    Saves a swipe. By default returns the next recommended book; with `count` it returns
+    {'books': [...]} (the next `count` cards, skipping the ids in `exclude`), and with
+    `recommend: false` it only saves the swipe, so the client can keep swiping from its queue.
+    """
     data = request.get_json()
     current_book_id = data.get('book_id')
     user_action = data.get('action') 
@@ -348,28 +370,34 @@ def handle_swipe():
     # 1. PERSISTENCE: Save swipe
     add_user_swipe(user_id, current_book_id, user_action)
 
-    # 2. FILTERING: Get history
-    history_list = get_user_swipes(user_id)
-    
-    # 3. GET USER PREFERENCES
-    user_prefs = get_user_preferences(user_id)
-    user_genres = user_prefs.get('genres', []) if user_prefs else []
-
-    # 4. GET LIKED BOOKS (for Author/Series matching)
-    liked_book_ids = get_user_liked_book_ids(user_id)
-    
-    # 5. GET DISLIKED BOOKS (for Penalties)
-    disliked_book_ids = get_user_disliked_book_ids(user_id)
+    if data.get('recommend') is False:
+        return jsonify({'success': True}), 200
 
-    # 6. GET FRIENDS DATA
-    friends_list = get_friends(user_id)
-    friends_genres, friends_likes_map = get_friends_preferences_data(friends_list) if friends_list else ([], {})
+    # 2. AI: Get next recommendation(s)
+    count = parse_batch_size(data.get('count'))
+    if count:
+        books = get_next_books(user_id, current_book_id, count, data.get('exclude') or [])
+        return jsonify({'books': books}), 200
 
-    # 7. AI: Get next recommendation
-    next_book_data = get_recommendation_from_model(current_book_id, history_list, user_genres, liked_book_ids, disliked_book_ids, friends_genres, friends_likes_map)
+    books = get_next_books(user_id, current_book_id)
+    next_book_data = books[0] if books else dict(NO_MORE_RECOMMENDATIONS)
     
     return jsonify(next_book_data), 200
 
+@app.route('/api/next_batch', methods=['POST'])
+def next_batch():
+    """Ranked list of the next `count` cards after `book_id`, without saving a swipe."""
+    data = request.get_json()
+    current_book_id = data.get('book_id')
+    user_id = data.get('user_id')
+
+    if not user_id:
+        return jsonify({'error': 'User ID required'}), 400
+
+    count = parse_batch_size(data.get('count')) or DEFAULT_BATCH_SIZE
+    books = get_next_books(user_id, current_book_id, count, data.get('exclude') or [])
+    return jsonify({'books': books}), 200
+
 @app.route("/liked")
 def liked():
     return render_template('liked.html')
@@ -389,10 +417,10 @@ def search_users_api():
     query = request.args.get('q', '')
     if not query:
         return jsonify([])
-    # Assuming query is email
-    results = search_users(query)
-    # If no email match, maybe try fallback to username search? 
-    # For now, stick to email as requested.
+    # Exact email/username, or username prefix (with masked emails), from the in-process
+    # user directory. Typeahead requests (typeahead=1) never fall back to remote lookups.
+    typeahead = request.args.get('typeahead') == '1'
+    results = search_users(query, typeahead=typeahead)
     return jsonify(results)
 
 @app.route('/api/friends/request', methods=['POST'])
@@ -428,68 +456,25 @@ def get_friends_data():
     if not user_id:
         return jsonify({'error': 'User ID required'}), 400
         
-    friends = get_friends(user_id)
+    # Friend cards (profile, email, recent likes) come from batched, cached DAL reads
+    friend_cards = get_friend_cards(user_id)
     requests = get_friend_requests(user_id)
     
-    # Enrich friend data with names (we need to fetch them)
-    # Ideally DAL should handle this but we'll do quick enrichment here or DAL
-    # Let's trust DAL gave us IDs, we need names.
-    # Actually, for MVP, we need names. 
-    # Let's assume frontend will fetch details or we update DAL to return objects.
-    # The DAL `get_friends` returns IDs. We should probably update it to return objects or fetch here.
-    # Let's Update DAL or fetch here.
-    # fetching here...
-    
     friend_details = []
-    # This loop is inefficient but fine for MVP (<100 friends)
-    # This loop is inefficient but fine for MVP (<100 friends)
-    from firebase_dal import db, auth # Need DB and Auth access
-    users_ref = db.collection('users')
-    
-    for fid in friends:
-        doc = users_ref.document(fid).get()
-        if doc.exists:
-            d = doc.to_dict()
-            
-            # Fetch friend's liked books
-            liked_ids = get_user_liked_book_ids(fid)
-            top_books = []
-            
-            # Get details for up to 3 liked books
-            valid_ids = [bid for bid in liked_ids if str(bid) in BOOK_DATA.index]
-            recent_likes = valid_ids[:3] if valid_ids else [] 
-            
-            for bid in recent_likes:
-                book = BOOK_DATA.loc[str(bid)]
-                top_books.append({
-                    'title': book['title'],
-                    'image_url': book['image_url']
-                })
-            
-            # Fetch email from Auth
-            email = "Unknown Email"
-            try:
-                ur = auth.get_user(fid)
-                email = ur.email
-            except:
-                pass
-
-            # Determine display name
-            raw_name = d.get('username') or d.get('displayName')
-            display_name = raw_name
-            
-            if not display_name or display_name == 'Unknown':
-                if email and '@' in email:
-                    display_name = email.split('@')[0]
-                else:
-                    display_name = "Friend"
-
-            friend_details.append({
-                'user_id': fid, 
-                'username': display_name,
-                'email': email,
-                'top_books': top_books
-            })
+    for card in friend_cards:
+        # Get details for up to 3 liked books
+        recent_likes = CATALOG.positions(card['recent_likes'])[:3]
+        top_books = [{
+            'title': CATALOG.titles[position],
+            'image_url': CATALOG.image_urls[position]
+        } for position in recent_likes]
+
+        friend_details.append({
+            'user_id': card['user_id'], 
+            'username': card['username'],
+            'email': card['email'],
+            'top_books': top_books
+        })
             
     return jsonify({
         'friends': friend_details,
@@ -511,34 +496,31 @@ def unlike_book():
     else:
         return jsonify({'error': 'Swipe not found'}), 404
 
-def calculate_book_score(book, user_genres, liked_authors=None, liked_titles=None, avg_similarity=0.1):
+def calculate_book_score(book, genre_score=0.0, liked_authors=None, liked_titles=None, avg_similarity=0.1):
     """
     Unified scoring function for both recommendations and liked books display.
+    `genre_score` is the book's calculate_preference_score value (0-1),
+    `liked_authors` a set of CATALOG.author_ids.
     """
     # 1. Base Score (40%)
     score = avg_similarity * 0.4
     
     # 2. Preference Score: Genre Match (40%)
-    if user_genres:
-        genre_score = calculate_preference_score(book, user_genres)
-        score += genre_score * 0.4
+    score += genre_score * 0.4
     
     # 3. Boost: Liked Author (15%)
     # If the book itself is in the liked list (which it is for this page), 
     # it naturally matches its own author, but we validly want to show that high score.
-    book_author = book.get('author', '').lower()
+    book_author = CATALOG.author_ids[book.position]
     if liked_authors and book_author in liked_authors:
         score += 0.15
         
     # 4. Boost: Series/Title Similarity (15%)
-    title_lower = book['title'].lower()
-    if liked_titles and len(title_lower) > 5:
-        for l_title in liked_titles:
-            # Avoid self-match comparison for exact strictness if needed, 
-            # but for "why do I like this", high score is good.
-            if len(l_title) > 5 and (l_title in title_lower or title_lower in l_title):
-                score += 0.15
-                break
+    # `liked_titles` is a title_index.matched_titles() mask. A liked book matches its own
+    # title, but for "why do I like this", high score is good.
+    title_id = CATALOG.title_index.title_ids[book.position]
+    if liked_titles is not None and title_id >= 0 and liked_titles[title_id]:
+        score += 0.15
                 
     return score
 
@@ -553,42 +535,42 @@ def get_liked_books():
     user_genres = user_prefs.get('genres', []) if user_prefs else []
     
     # Get liked book IDs
-    liked_ids = get_user_liked_book_ids(user_id)
+    liked_ids = get_user_swipe_state(user_id).likes
     
     # Pre-process liked data for context
     liked_authors = set()
-    liked_titles = []
+    liked_titles = None
     
     # We first need to check validity of indices
-    valid_ids = [str(bid) for bid in liked_ids if str(bid) in BOOK_DATA.index]
+    valid_positions = CATALOG.positions(liked_ids)
     
-    if valid_ids:
-        liked_authors = set(BOOK_DATA.loc[valid_ids]['author'].fillna('').str.lower().tolist())
-        liked_titles = BOOK_DATA.loc[valid_ids]['title'].fillna('').str.lower().tolist()
+    if len(valid_positions):
+        liked_authors = set(CATALOG.author_ids[valid_positions].tolist())
+        liked_titles = CATALOG.title_index.matched_titles(valid_positions)
+    
+    # Genre match for all liked books in one pass over the genre matrix
+    genre_scores = calculate_preference_score(valid_positions, user_genres)
     
     liked_books = []
-    for book_id in valid_ids:
-        book = BOOK_DATA.loc[book_id]
+    for idx, genre_score in zip(valid_positions, genre_scores):
+        book = CATALOG.record(idx)
         
-        # Calculate score consistent with recommendation engine
-        # We use a default avg_similarity since calculating it per book is expensive O(N^2)
-        # But we can grab the pre-calculated row mean if available, or just estimate.
-        # For accuracy, we'll try to get the row mean.
-        idx = BOOK_DATA.index.get_loc(book_id)
-        avg_sim = COSINE_SIM[idx].mean() if idx < len(COSINE_SIM) else 0.1
+        # Calculate score consistent with recommendation engine,
+        # using the precomputed row mean similarity (centrality) of the book.
+        avg_sim = CENTRALITY[idx] if idx < len(CENTRALITY) else 0.1
         
-        raw_score = calculate_book_score(book, user_genres, liked_authors, liked_titles, avg_sim)
+        raw_score = calculate_book_score(book, genre_score, liked_authors, liked_titles, avg_sim)
         
         # ARTIFICIAL BOOST: Multiply by 2.0 to normalize visualization to a "Match%" scale users expect.
         # Since avg_sim is low (0.1-0.3), raw scores are often 0.3-0.5. This maps them to 60-100%.
         final_score = max(0.0, min(raw_score * 2.0 * 100, 100.0))
         
         liked_books.append({
-            'book_id': str(book_id),
-            'title': book['title'],
-            'author': book.get('author', 'Unknown'),
-            'image_url': book['image_url'],
-            'description': book['description'],
+            'book_id': book.book_id,
+            'title': book.title,
+            'author': book.author or 'Unknown',
+            'image_url': book.image_url,
+            'description': book.description,
             'score': f"{final_score:.1f}% Match"
         })
             
@@ -600,24 +582,24 @@ def search_books():
     if not query:
         return jsonify([])
     
-    # Search in BOOK_DATA
-    # We'll search title and author
+    # Search in CATALOG
+    # We'll search title and author, stopping at the first 20 matches
     results = []
     
-    # Create a mask for search
-    mask = (BOOK_DATA['title'].str.lower().str.contains(query, na=False)) | \
-           (BOOK_DATA['author'].str.lower().str.contains(query, na=False))
-           
-    matches = BOOK_DATA[mask].head(20) # Limit to 20 results
-    
-    for book_id, book in matches.iterrows():
+    for position, (title, author) in enumerate(zip(CATALOG.titles_lower, CATALOG.authors_lower)):
+        if query not in title and query not in author:
+            continue
+        
+        book = CATALOG.record(position)
         results.append({
-            'book_id': str(book_id),
-            'title': book['title'],
-            'author': book.get('author', 'Unknown'),
-            'image_url': book['image_url'],
-            'description': book['description']
+            'book_id': book.book_id,
+            'title': book.title,
+            'author': book.author or 'Unknown',
+            'image_url': book.image_url,
+            'description': book.description
         })
+        if len(results) >= 20: # Limit to 20 results
+            break
         
     return jsonify(results)
 
@@ -630,53 +612,41 @@ def explore_books():
     if not user_id:
         return jsonify([])
         
-    history_list = get_user_swipes(user_id)
+    history = get_user_swipe_state(user_id).history
     user_prefs = get_user_preferences(user_id)
     user_genres = user_prefs.get('genres', []) if user_prefs else []
     
-    # Normalize user genres for exclusion
-    user_genres_lower = set(g.lower() for g in user_genres)
-    
-    explore_results = []
+    # Check which books intersect with ANY user genre (one pass over the genre matrix)
+    has_overlap = calculate_preference_score(None, user_genres) > 0
     
     # We want high quality books (likely popular or high similarity to avg) 
     # but strictly NOT in the user's genre list.
+    available = ~has_overlap
+    available[CATALOG.positions(history)] = False
+    positions = np.flatnonzero(available)
     
-    for book_id in BOOK_DATA.index:
-        if str(book_id) in history_list:
-            continue
-            
-        book = BOOK_DATA.loc[book_id]
-        book_genres_str = str(book.get('genres', '')).lower()
-        
-        # Check if book intersects with ANY user genre
-        has_overlap = any(ug in book_genres_str for ug in user_genres_lower)
-        
-        if not has_overlap:
-             # This book is "Different". 
-             # We rank by general content popularity/similarity to ensure quality.
-             idx = BOOK_DATA.index.get_loc(book_id)
-             score = COSINE_SIM[idx].mean() # Use average similarity as a proxy for "centrality/quality"
-             
-             explore_results.append((book_id, score, book))
-             
-    # Sort by score descending
-    explore_results.sort(key=lambda x: x[1], reverse=True)
+    # These books are "Different". 
+    # We rank by general content popularity/similarity to ensure quality,
+    # using average similarity (CENTRALITY) as a proxy for "centrality/quality".
+    top_positions = positions[np.argsort(-CENTRALITY[positions], kind='stable')[:3]]
     
     # Return top 3
     final_output = []
-    for book_id, score, book in explore_results[:3]:
+    for idx in top_positions:
+        book = CATALOG.record(idx)
+        score = CENTRALITY[idx]
+        
         # Normalize score for display (similar to other endpoints)
         # Explore scores are just raw cosine mean (0.0-1.0 typically low 0.1-0.3)
         # We'll apply a visual boost for the user "Match" feeling.
         display_score = f"{min(score * 3.0 * 100, 98.0):.1f}% Match" 
         
         final_output.append({
-            'book_id': str(book_id),
-            'title': book['title'],
-            'author': book.get('author', 'Unknown'),
-            'image_url': book['image_url'],
-            'description': book['description'],
+            'book_id': book.book_id,
+            'title': book.title,
+            'author': book.author or 'Unknown',
+            'image_url': book.image_url,
+            'description': book.description,
             'score': display_score
         })
         
@@ -703,10 +673,10 @@ def save_preferences():
 @app.route('/api/sync_database', methods=['POST'])
 def sync_database():
     """
-    Sync Firebase data to in-memory BOOK_DATA.
+    Sync Firebase data to the in-memory CATALOG and model.
     This endpoint should be called after adding/updating/deleting books in the admin interface.
     """
-    global BOOK_DATA, COSINE_SIM
+    global CATALOG, NEIGHBORS, CENTRALITY, GENRE_INDEX, MODEL_VERSION
     
     try:
         from firebase_dal import get_all_books_from_db
@@ -719,59 +689,29 @@ def sync_database():
         if not raw_data:
             return jsonify({'error': 'No book data found in Firebase'}), 400
         
-        # 2. Convert to DataFrame
-        df = pd.DataFrame(raw_data)
+        # 2. Data Cleaning and Feature Engineering (same as train_model.py)
+        df = train_model.prepare_book_data(raw_data)
         print(f"Loaded {len(df)} records from Firebase.")
         
-        # 3. Data Cleaning (same as train_model.py)
-        required_cols = ['book_id', 'description', 'genres', 'title', 'image_url', 'author']
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = ''
-        
-        df.dropna(subset=['book_id'], inplace=True)
-        df['description'] = df['description'].fillna('')
-        df['genres'] = df['genres'].fillna('')
-        df['title'] = df['title'].fillna('Unknown Title')
-        df['author'] = df['author'].fillna('Unknown')
-        
-        # Ensure book_id is the index
-        df['book_id'] = df['book_id'].astype(str)
-        df.set_index('book_id', inplace=True)
+        # 3. Regenerate catalog, neighbor graph, centrality and genre matrix
+        catalog, neighbors, centrality, genre_index = train_model.build_model(df)
         
-        # 4. Feature Engineering
-        df['soup'] = df['title'] + ' ' + df['description'] + ' ' + df['genres']
+        # 4. Save to disk as a new version (the other workers pick it up on their next check)
+        version = train_model.save_model(catalog, neighbors, centrality, genre_index)
         
-        # 5. Regenerate similarity matrix
-        from sklearn.feature_extraction.text import TfidfVectorizer
-        from sklearn.metrics.pairwise import linear_kernel
+        # 5. Update global variables
+        CATALOG = catalog
+        NEIGHBORS = neighbors
+        CENTRALITY = centrality
+        GENRE_INDEX = genre_index
+        MODEL_VERSION = version
         
-        tfidf = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(df['soup'])
-        cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
-        
-        # 6. Update global variables
-        BOOK_DATA = df
-        COSINE_SIM = cosine_sim
-        
-        # 7. Re-process optimization field
-        BOOK_DATA['genres_str'] = BOOK_DATA['genres'].fillna('').astype(str).str.lower()
-        
-        # 8. Save to disk for persistence
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        models_dir = os.path.join(base_dir, 'models')
-        if not os.path.exists(models_dir):
-            os.makedirs(models_dir)
-            
-        joblib.dump(COSINE_SIM, os.path.join(models_dir, 'similarity_matrix.joblib'))
-        joblib.dump(BOOK_DATA, os.path.join(models_dir, 'book_data_processed.joblib'))
-        
-        print(f"Database synced successfully! {len(BOOK_DATA)} books now available.")
+        print(f"Database synced successfully! {len(CATALOG)} books now available.")
         
         return jsonify({
             'success': True, 
-            'message': f'Database synced successfully. {len(BOOK_DATA)} books loaded.',
-            'book_count': len(BOOK_DATA)
+            'message': f'Database synced successfully. {len(CATALOG)} books loaded.',
+            'book_count': len(CATALOG)
         }), 200
         
     except Exception as e:
@@ -780,5 +720,10 @@ def sync_database():
         traceback.print_exc()
         return jsonify({'error': f'Failed to sync database: {str(e)}'}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Operational counters: the write-behind swipe queue and the user data cache."""
+    return jsonify({'swipe_buffer': get_swipe_buffer_metrics(), 'cache': get_cache_metrics()}), 200
+
 if __name__ == "__main__":
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,202 @@
+# benchmark_model.py
+"""
+Offline benchmarks for the recommendation model artifacts.
+Builds synthetic catalogs of several sizes (no Firebase needed) and reports:
+- build time and memory of the top-K neighbor graph against the dense N x N matrix
+- build time, query latency and recall@K of the IVF (ANN) index against exact cosine (--ann)
+- worker startup time and RSS of memory-mapped .npy artifacts vs joblib.load (--load)
+
+Usage: python benchmark_model.py [--sizes 1000 5000 20000] [--k 500] [--ann | --load]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+
+import train_model
+from train_model import prepare_book_data, vectorize_books, NEIGHBOR_K
+from neighbor_index import build_neighbor_graph, build_ivf_index, load_index
+
+GENRES = ['Fantasy', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'Self-Help', 'Non-Fiction',
+          'Fiction', 'History', 'Biography', 'Horror', 'Poetry', 'Young Adult', 'Classics']
+
+# Dense similarity matrices above this size are only estimated, not built
+DENSE_BUILD_LIMIT = 10000
+
+# ANN settings swept by --ann
+ANN_DIMS = [64, 128]
+ANN_NPROBES = [1, 4, 8, 16, 32]
+RECALL_QUERIES = 200
+
+
+def synthetic_books(n, seed=0, vocab_size=20000, n_topics=200):
+    """
+    Generates `n` raw book dicts shaped like get_all_books_from_db() output.
+    Each book mixes a few latent topics (each with its own Zipf-weighted word list)
+    with common filler words, so the catalog has neighbor structure like real blurbs.
+    """
+    rnd = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    topic_size = 200
+    topics = [rnd.sample(vocab, topic_size) for _ in range(n_topics)]
+    topic_weights = [1.0 / (i + 1) for i in range(topic_size)]
+    common_weights = [1.0 / (i + 1) for i in range(vocab_size)]
+    authors = [f"Author {i}" for i in range(max(1, n // 8))]
+
+    books = []
+    for i in range(n):
+        book_topics = rnd.sample(topics, rnd.randint(1, 3))
+        words = []
+        for topic in book_topics:
+            words += rnd.choices(topic, topic_weights, k=rnd.randint(15, 40))
+        words += rnd.choices(vocab, common_weights, k=rnd.randint(10, 40))
+        rnd.shuffle(words)
+
+        books.append({
+            'book_id': str(9780000000000 + i),
+            'title': ' '.join(rnd.choices(book_topics[0], topic_weights, k=rnd.randint(1, 5))).title(),
+            'description': ' '.join(words),
+            'genres': ', '.join(rnd.sample(GENRES, rnd.randint(1, 3))),
+            'author': rnd.choice(authors),
+            'image_url': f"https://covers.example/{i}.jpg",
+        })
+    return books
+
+
+def measure(fn):
+    """Runs fn() and returns (result, seconds, peak traced MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def bench_neighbor_graph(sizes, k):
+    from sklearn.metrics.pairwise import linear_kernel
+
+    print(f"{'books':>8} {'dense MB':>10} {'dense s':>8} {'top-K MB':>9} {'top-K s':>8} {'peak MB':>8}")
+    for n in sizes:
+        tfidf_matrix = vectorize_books(prepare_book_data(synthetic_books(n)))
+
+        dense_mb = n * n * 8 / 1e6
+        dense_s = float('nan')
+        if n <= DENSE_BUILD_LIMIT:
+            _, dense_s, _ = measure(lambda: linear_kernel(tfidf_matrix, tfidf_matrix))
+
+        (graph, _), graph_s, peak_mb = measure(lambda: build_neighbor_graph(tfidf_matrix, k))
+        print(f"{n:>8} {dense_mb:>10.1f} {dense_s:>8.2f} {graph.nbytes / 1e6:>9.1f} {graph_s:>8.2f} {peak_mb:>8.1f}")
+
+
+def exact_top_k(tfidf_matrix, queries, k):
+    """Exact cosine top-k positions for each query row (as sets)."""
+    sims = (tfidf_matrix[queries] @ tfidf_matrix.T).toarray()
+    k = min(k, sims.shape[1])
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def bench_ann(sizes, k):
+    print(f"{'books':>8} {'dim':>4} {'build s':>8} {'index MB':>9} {'nprobe':>6} {'query ms':>9} {f'recall@{k}':>10}")
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        tfidf_matrix = vectorize_books(prepare_book_data(synthetic_books(n)))
+        queries = rng.choice(n, min(RECALL_QUERIES, n), replace=False)
+        exact = exact_top_k(tfidf_matrix, queries, k)
+
+        for dim in ANN_DIMS:
+            (index, _), build_s, _ = measure(lambda: build_ivf_index(tfidf_matrix, k, dim=dim))
+            for nprobe in ANN_NPROBES:
+                index.nprobe = nprobe
+                start = time.perf_counter()
+                found = [index.neighbors(q)[0] for q in queries]
+                query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+                recall = np.mean([len(exact_set.intersection(f)) / len(exact_set) for exact_set, f in zip(exact, found)])
+                print(f"{n:>8} {dim:>4} {build_s:>8.2f} {index.nbytes / 1e6:>9.1f} {nprobe:>6} {query_ms:>9.2f} {recall:>10.3f}")
+
+
+def read_rss_mb():
+    """(private, shared file-backed) resident memory of this process in MB (Linux only)."""
+    fields = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('RssAnon:', 'RssFile:')):
+                name, value, _ = line.split()
+                fields[name] = int(value) / 1024
+    return fields.get('RssAnon:', 0.0), fields.get('RssFile:', 0.0)
+
+
+def load_child(models_dir, mode):
+    """Runs in a fresh interpreter: loads the artifacts like a worker boot and prints JSON stats."""
+    base_anon, base_file = read_rss_mb()
+    start = time.perf_counter()
+    if mode == 'joblib':
+        neighbors = load_index(joblib.load(os.path.join(models_dir, 'neighbors.joblib')))
+        centrality = joblib.load(os.path.join(models_dir, 'centrality.joblib'))
+        genres = joblib.load(os.path.join(models_dir, 'genres.joblib'))
+    else:
+        path = train_model.version_dir(models_dir)
+        neighbors = load_index(train_model.load_arrays(os.path.join(path, train_model.NEIGHBORS_DIR)))
+        centrality = np.load(os.path.join(path, train_model.CENTRALITY_FILE), mmap_mode='r')
+        genres = train_model.load_arrays(os.path.join(path, train_model.GENRES_DIR))
+    load_s = time.perf_counter() - start
+
+    # Touch every neighbor row once, as a busy worker eventually would
+    for idx in range(len(neighbors)):
+        neighbors.neighbors(idx)[1].sum()
+    anon, file_backed = read_rss_mb()
+    print(json.dumps({'load_s': load_s, 'anon_mb': anon - base_anon, 'file_mb': file_backed - base_file}))
+
+
+def bench_load(sizes, k):
+    print(f"{'books':>8} {'mode':>7} {'load ms':>8} {'private MB':>11} {'shared MB':>10}")
+    for n in sizes:
+        df = prepare_book_data(synthetic_books(n))
+        catalog, neighbors, centrality, genre_index = train_model.build_model(df, k, 'graph')
+        with tempfile.TemporaryDirectory() as models_dir:
+            train_model.save_model(catalog, neighbors, centrality, genre_index, models_dir)
+            joblib.dump(neighbors.to_dict(), os.path.join(models_dir, 'neighbors.joblib'))
+            joblib.dump(centrality, os.path.join(models_dir, 'centrality.joblib'))
+            joblib.dump(genre_index.to_dict(), os.path.join(models_dir, 'genres.joblib'))
+
+            for mode in ('joblib', 'mmap'):
+                out = subprocess.run(
+                    [sys.executable, __file__, '--load-child', models_dir, mode],
+                    capture_output=True, text=True, check=True
+                ).stdout
+                stats = json.loads(out.strip().splitlines()[-1])
+                print(f"{n:>8} {mode:>7} {stats['load_s'] * 1000:>8.1f} {stats['anon_mb']:>11.1f} {stats['file_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--k', type=int, default=NEIGHBOR_K)
+    parser.add_argument('--ann', action='store_true', help='benchmark the IVF index instead of the neighbor graph')
+    parser.add_argument('--load', action='store_true', help='benchmark artifact loading (mmap vs joblib)')
+    parser.add_argument('--load-child', nargs=2, metavar=('MODELS_DIR', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load_child:
+        load_child(*args.load_child)
+    elif args.load:
+        bench_load(args.sizes, args.k)
+    elif args.ann:
+        bench_ann(args.sizes, args.k)
+    else:
+        bench_neighbor_graph(args.sizes, args.k)
+
+
+if __name__ == "__main__":
+    main()
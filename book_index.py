@@ -0,0 +1,315 @@
+# book_index.py
+"""
+Book catalog storage and precomputed lookup structures over it.
+Built at training/sync time and loaded with the model, so the request handlers
+can score the whole catalog with array operations instead of string work
+and never touch a DataFrame.
+"""
+
+import re
+import numpy as np
+from scipy import sparse
+
+# Genre fields are either lists (['Fantasy', 'Fiction']) or delimited strings ("Fantasy, Fiction"),
+# sometimes a stringified list ("['Fantasy', 'Fiction']"), whose brackets and quotes are stripped per term
+GENRE_SPLIT_RE = re.compile(r'\s*(?:[,;|]|--)\s*')
+GENRE_STRIP_CHARS = ' \t\r\n.[]\'"'
+WORD_SPLIT_RE = re.compile(r'[\s/&]+')
+
+
+def normalize_genre(genre):
+    """Lowercases a single genre term and strips surrounding whitespace/punctuation, brackets and quotes."""
+    return str(genre).strip(GENRE_STRIP_CHARS).lower()
+
+
+def split_genres(value):
+    """Parses one book's raw 'genres' value into a list of normalized genre terms."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        parts = [str(v) for v in value]
+    else:
+        if isinstance(value, float) and np.isnan(value):
+            return []
+        parts = GENRE_SPLIT_RE.split(str(value))
+
+    terms = []
+    for part in parts:
+        term = normalize_genre(part)
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def genre_words(term):
+    """Splits a genre term into words. Hyphenated words stay whole, so 'non-fiction' != 'fiction'."""
+    return tuple(w for w in WORD_SPLIT_RE.split(term) if w)
+
+
+class GenreIndex:
+    """
+    Normalized genre vocabulary plus a sparse (books x genres) 0/1 matrix.
+
+    A user genre matches a book when it appears as a whole word sequence in one of
+    the book's genre terms ('fantasy' matches 'fantasy fiction', 'fiction' does not
+    match 'non-fiction').
+    """
+
+    def __init__(self, genres_column=()):
+        self.vocabulary = []
+        self.term_ids = {}
+
+        rows, cols = [], []
+        for row, value in enumerate(genres_column):
+            for term in split_genres(value):
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    term_id = len(self.vocabulary)
+                    self.term_ids[term] = term_id
+                    self.vocabulary.append(term)
+                rows.append(row)
+                cols.append(term_id)
+
+        self.n_books = len(genres_column)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(self.n_books, len(self.vocabulary))
+        )
+        self.vocabulary_words = [genre_words(term) for term in self.vocabulary]
+        self._genre_cache = {}
+
+    def to_dict(self):
+        return {
+            'vocabulary': self.vocabulary, 'shape': self.matrix.shape,
+            'data': self.matrix.data, 'indices': self.matrix.indices, 'indptr': self.matrix.indptr
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds the index from to_dict() output without re-parsing the genres column."""
+        index = cls()
+        index.vocabulary = list(data['vocabulary'])
+        index.term_ids = {term: i for i, term in enumerate(index.vocabulary)}
+        index.matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+        index.n_books = index.matrix.shape[0]
+        index.vocabulary_words = [genre_words(term) for term in index.vocabulary]
+        return index
+
+    def genre_term_ids(self, genre):
+        """Returns the vocabulary ids matched by a single user genre (memoized)."""
+        key = normalize_genre(genre)
+        cached = self._genre_cache.get(key)
+        if cached is not None:
+            return cached
+
+        words = genre_words(key)
+        n = len(words)
+        ids = []
+        if n:
+            for term_id, term_words in enumerate(self.vocabulary_words):
+                for start in range(len(term_words) - n + 1):
+                    if term_words[start:start + n] == words:
+                        ids.append(term_id)
+                        break
+
+        result = np.array(ids, dtype=np.int32)
+        self._genre_cache[key] = result
+        return result
+
+    def query_matrix(self, user_genres):
+        """Builds the (genres x user_genres) indicator matrix for a list of user genres."""
+        rows, cols = [], []
+        for col, genre in enumerate(user_genres):
+            ids = self.genre_term_ids(genre)
+            rows.extend(ids)
+            cols.extend([col] * len(ids))
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(self.vocabulary), len(user_genres))
+        )
+
+    def scores(self, user_genres, positions=None):
+        """
+        Fraction of `user_genres` matched by each book (0-1).
+        Scores the whole catalog, or only the rows at `positions` if given.
+        """
+        n = self.n_books if positions is None else len(positions)
+        if not user_genres or n == 0:
+            return np.zeros(n)
+
+        matrix = self.matrix if positions is None else self.matrix[positions]
+        hits = (matrix @ self.query_matrix(user_genres)).toarray() > 0
+        return hits.sum(axis=1) / len(user_genres)
+
+
+class TitleMatchIndex:
+    """
+    Series/title matches precomputed over the lowercase catalog titles.
+    Two titles match when one contains the other ('dune' matches 'children of dune');
+    titles of MIN_LENGTH chars or fewer never match. The build looks up, at every
+    position of a title, the titles starting with the next MIN_LENGTH + 1 chars, and
+    only tries the lengths those titles have, so it never enumerates all substrings.
+    Books share a title id when their titles are identical, and `indptr`/`indices` list,
+    for each title id, the ids of the titles it matches (itself included), so a user's
+    title boosts are a gather over their liked positions.
+    """
+
+    MIN_LENGTH = 5
+
+    def __init__(self, titles=()):
+        keys = {}
+        title_ids = np.full(len(titles), -1, dtype=np.int32)
+        for position, title in enumerate(titles):
+            if len(title) > self.MIN_LENGTH:
+                title_ids[position] = keys.setdefault(title, len(keys))
+
+        # Titles by their first MIN_LENGTH + 1 chars: prefix -> sorted distinct lengths
+        prefix_length = self.MIN_LENGTH + 1
+        lengths = {}
+        for title in keys:
+            lengths.setdefault(title[:prefix_length], set()).add(len(title))
+        lengths = {prefix: sorted(group) for prefix, group in lengths.items()}
+
+        # Every substring of a title that is itself a title is a match
+        pairs = set()
+        for title, title_id in keys.items():
+            for start in range(len(title) - self.MIN_LENGTH):
+                group = lengths.get(title[start:start + prefix_length])
+                if group is None:
+                    continue
+                for length in group:
+                    if start + length > len(title):
+                        break
+                    other_id = keys.get(title[start:start + length])
+                    if other_id is not None:
+                        pairs.add((title_id, other_id))
+                        pairs.add((other_id, title_id))
+
+        rows = np.array([a for a, _ in pairs], dtype=np.int32)
+        cols = np.array([b for _, b in pairs], dtype=np.int32)
+        order = np.lexsort((cols, rows))
+        self.title_ids = title_ids
+        self.indices = cols[order]
+        self.indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(keys)), out=self.indptr[1:])
+
+    def to_dict(self):
+        return {'title_ids': self.title_ids, 'indptr': self.indptr, 'indices': self.indices}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.title_ids = np.asarray(data['title_ids'], dtype=np.int32)
+        index.indptr = np.asarray(data['indptr'], dtype=np.int64)
+        index.indices = np.asarray(data['indices'], dtype=np.int32)
+        return index
+
+    @property
+    def n_titles(self):
+        return len(self.indptr) - 1
+
+    def matched_titles(self, positions):
+        """Boolean mask over title ids matched by any of the books at `positions`."""
+        matched = np.zeros(self.n_titles, dtype=bool)
+        title_ids = self.title_ids[positions]
+        title_ids = title_ids[title_ids >= 0]
+        if len(title_ids) == 0:
+            return matched
+
+        # Concatenate the CSR rows of all the titles in one gather
+        starts, ends = self.indptr[title_ids], self.indptr[title_ids + 1]
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        matched[self.indices[offsets + np.arange(lengths.sum())]] = True
+        return matched
+
+    def mask(self, positions, other_positions):
+        """True where the title at `positions` matches one of the titles at `other_positions`."""
+        if len(positions) == 0 or len(other_positions) == 0:
+            return np.zeros(len(positions), dtype=bool)
+        title_ids = self.title_ids[positions]
+        return (title_ids >= 0) & self.matched_titles(other_positions)[title_ids]
+
+
+class BookRecord:
+    """Lightweight view of one catalog row, used to build API responses."""
+
+    __slots__ = ('position', 'book_id', 'title', 'author', 'image_url', 'description')
+
+    def __init__(self, position, book_id, title, author, image_url, description):
+        self.position = position
+        self.book_id = book_id
+        self.title = title
+        self.author = author
+        self.image_url = image_url
+        self.description = description
+
+
+class BookCatalog:
+    """
+    Columnar book store: one contiguous array per field, addressed by integer
+    position (the same row order as the model artifacts), plus a book_id -> position dict.
+    """
+
+    def __init__(self, book_ids, titles, authors, image_urls, descriptions, title_index=None):
+        self.book_ids = np.asarray(book_ids, dtype=object)
+        self.titles = np.asarray(titles, dtype=object)
+        self.authors = np.asarray(authors, dtype=object)
+        self.image_urls = np.asarray(image_urls, dtype=object)
+        self.descriptions = np.asarray(descriptions, dtype=object)
+
+        self.positions_by_id = {book_id: i for i, book_id in enumerate(self.book_ids)}
+        # Lowercase copies for matching/search
+        self.titles_lower = np.array([t.lower() for t in self.titles], dtype=object)
+        self.authors_lower = np.array([a.lower() for a in self.authors], dtype=object)
+        # Integer author ids (one per distinct lowercase name) so author boosts are np.isin over ints
+        self.author_names, author_ids = np.unique(self.authors_lower.astype(str), return_inverse=True)
+        self.author_ids = author_ids.astype(np.int32).ravel()
+        self.title_index = title_index if title_index is not None else TitleMatchIndex(self.titles_lower)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds the catalog from the cleaned, book_id-indexed training DataFrame."""
+        def column(name):
+            return df[name].fillna('').astype(str).tolist()
+        return cls(df.index.astype(str).tolist(), column('title'), column('author'),
+                   column('image_url'), column('description'))
+
+    def to_dict(self):
+        return {
+            'book_ids': self.book_ids.tolist(), 'titles': self.titles.tolist(), 'authors': self.authors.tolist(),
+            'image_urls': self.image_urls.tolist(), 'descriptions': self.descriptions.tolist(),
+            'title_index': self.title_index.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # Catalogs saved before the title index existed rebuild it here
+        title_index = TitleMatchIndex.from_dict(data['title_index']) if 'title_index' in data else None
+        return cls(data['book_ids'], data['titles'], data['authors'], data['image_urls'], data['descriptions'],
+                   title_index)
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    def __contains__(self, book_id):
+        return str(book_id) in self.positions_by_id
+
+    def position(self, book_id):
+        """Integer position of a book_id, or None if it is not in the catalog."""
+        return self.positions_by_id.get(str(book_id))
+
+    def positions(self, book_ids):
+        """Positions of the known book_ids (unknown ids are dropped), in input order."""
+        if not book_ids:
+            return np.empty(0, dtype=np.intp)
+        get = self.positions_by_id.get
+        return np.fromiter(
+            (p for p in (get(str(book_id)) for book_id in book_ids) if p is not None), dtype=np.intp
+        )
+
+    def record(self, position):
+        return BookRecord(
+            position, self.book_ids[position], self.titles[position], self.authors[position],
+            self.image_urls[position], self.descriptions[position]
+        )
@@ -2,63 +2,418 @@
 """
 Simple in-memory cache to reduce Firebase Firestore reads.
 Caches user data, preferences, and friends data with TTL (time-to-live).
+The cache is bounded: once it holds more than `max_entries` entries (or, with
+`max_bytes`, more than that many approximate bytes) the least recently used entries
+are evicted, and every set() also drops a few expired entries, so a long-running
+worker's memory stays flat.
+Keys are spread over shards with their own locks, so request threads rarely wait on
+each other. All 'user:{user_id}:...' keys of a user live in one shard, which indexes
+them by user_id, so clearing a user's entries doesn't scan the cache.
+With CACHE_SHARED_PATH set, a SharedCache (shared_cache.py) is a second level behind
+the in-process shards, shared by all worker processes on the host.
+get_or_load() coalesces concurrent misses of one key into a single load, caches
+None results (negative caching) and, past an entry's soft TTL, keeps serving it while
+a background thread reloads it (stale-while-revalidate).
 """
 
-from datetime import datetime, timedelta
-from threading import Lock
+import heapq
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
 
-class CacheManager:
-    def __init__(self):
-        self.cache = {}
+from shared_cache import SharedCache
+
+MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 20000))
+MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 0))  # 0 = no size accounting
+SHARDS = int(os.getenv('CACHE_SHARDS', 16))
+# Cross-process second level, e.g. /dev/shm/arbour-cache.sqlite (empty = off)
+SHARED_PATH = os.getenv('CACHE_SHARED_PATH', '')
+SHARED_POLL = float(os.getenv('CACHE_SHARED_POLL', 0.1))  # seconds between invalidation polls
+# Seconds invalidation records are kept; at least the longest TTL cached
+SHARED_LOG_RETENTION = float(os.getenv('CACHE_SHARED_LOG_RETENTION', 3600))
+# Expired entries removed per set()
+SWEEP_BUDGET = 16
+# Threads for stale-while-revalidate reloads
+REFRESH_WORKERS = int(os.getenv('CACHE_REFRESH_WORKERS', 4))
+
+def approximate_size(value, depth=4):
+    """Rough deep size in bytes of a cached value (containers and object attributes, `depth` levels down)."""
+    size = sys.getsizeof(value)
+    if depth == 0:
+        return size
+    if isinstance(value, dict):
+        size += sum(approximate_size(k, depth - 1) + approximate_size(v, depth - 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(v, depth - 1) for v in value)
+    elif hasattr(value, '__dict__'):
+        size += approximate_size(vars(value), depth - 1)
+    return size
+
+def user_of(key):
+    """The user_id of a 'user:{user_id}:...' key, else None."""
+    parts = key.split(':', 2)
+    return parts[1] if len(parts) == 3 and parts[0] == 'user' else None
+
+class _CacheShard:
+    """One lock's worth of the cache: LRU entries, expiry heap and per-user key index."""
+
+    def __init__(self, max_entries, max_bytes):
+        # key -> (value, expiry, size, stale_at), least recently used first
+        self.entries = OrderedDict()
+        # Heap of (expiry, key); entries for keys that were set again or deleted are skipped
+        self.expiries = []
+        # user_id -> set of that user's keys
+        self.users = {}
         self.lock = Lock()
-        self.default_ttl = 300  # 5 minutes default TTL
-    
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
     def get(self, key):
-        """Get value from cache if not expired."""
+        """(value, stale) for a live entry, else None."""
         with self.lock:
-            if key in self.cache:
-                value, expiry = self.cache[key]
-                if datetime.now() < expiry:
-                    return value
-                else:
-                    # Expired, remove it
-                    del self.cache[key]
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expiry, _, stale_at = entry
+                now = time.monotonic()
+                if now < expiry:
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return value, now >= stale_at
+                # Expired, remove it
+                self._remove(key)
+                self.stats['expirations'] += 1
+            self.stats['misses'] += 1
             return None
-    
-    def set(self, key, value, ttl=None):
-        """Set value in cache with TTL in seconds."""
-        if ttl is None:
-            ttl = self.default_ttl
-        
+
+    def set(self, key, value, ttl, size, stale_after):
         with self.lock:
-            expiry = datetime.now() + timedelta(seconds=ttl)
-            self.cache[key] = (value, expiry)
-    
+            if key in self.entries:
+                self._remove(key)
+            if self.max_bytes and size > self.max_bytes:
+                # Would evict everything else and still not fit
+                return
+            now = time.monotonic()
+            expiry = now + ttl
+            self.entries[key] = (value, expiry, size, now + stale_after)
+            self.bytes += size
+            user_id = user_of(key)
+            if user_id is not None:
+                self.users.setdefault(user_id, set()).add(key)
+            heapq.heappush(self.expiries, (expiry, key))
+            self._sweep(SWEEP_BUDGET)
+            self._evict()
+
     def delete(self, key):
-        """Delete a specific key from cache."""
         with self.lock:
-            if key in self.cache:
-                del self.cache[key]
-    
+            if key in self.entries:
+                self._remove(key)
+
+    def clear_user(self, user_id):
+        with self.lock:
+            for key in list(self.users.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.expiries = []
+            self.users = {}
+            self.bytes = 0
+
+    def cleanup_expired(self):
+        with self.lock:
+            now = time.monotonic()
+            expired_keys = [k for k, (_, expiry, _, _) in self.entries.items() if now >= expiry]
+            for key in expired_keys:
+                self._remove(key)
+            self.stats['expirations'] += len(expired_keys)
+            self._rebuild_expiries()
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.bytes)
+
+    # --- Internals (called with the lock held) ---
+
+    def _remove(self, key):
+        _, _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+        user_id = user_of(key)
+        if user_id is not None:
+            keys = self.users[user_id]
+            keys.discard(key)
+            if not keys:
+                del self.users[user_id]
+
+    def _sweep(self, budget):
+        """Removes up to `budget` expired entries, soonest expiry first."""
+        now = time.monotonic()
+        while budget and self.expiries and self.expiries[0][0] <= now:
+            expiry, key = heapq.heappop(self.expiries)
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] == expiry:
+                self._remove(key)
+                self.stats['expirations'] += 1
+                budget -= 1
+        # Superseded heap entries pile up when keys are rewritten before they expire
+        if len(self.expiries) > 2 * len(self.entries) + 64:
+            self._rebuild_expiries()
+
+    def _rebuild_expiries(self):
+        self.expiries = [(expiry, key) for key, (_, expiry, _, _) in self.entries.items()]
+        heapq.heapify(self.expiries)
+
+    def _evict(self):
+        """Evicts least recently used entries until the shard is within its limits."""
+        while self.entries and (len(self.entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)):
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.stats['evictions'] += 1
+
+class _Flight:
+    """A call in progress in single_flight(); other callers wait on `done` for its outcome."""
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error = None
+        # Set when the key is written while a get_or_load() load runs
+        self.stale = False
+
+class CacheManager:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, sizeof=approximate_size, shards=SHARDS,
+                 shared=None):
+        # Limits are split evenly, so LRU order is per shard
+        self.shards = [
+            _CacheShard(-(-max_entries // shards), -(-max_bytes // shards))
+            for _ in range(shards)
+        ]
+        self.default_ttl = 300  # 5 minutes default TTL
+        self.sizeof = sizeof if max_bytes else None
+        # Optional SharedCache; every write goes to both levels
+        self.shared = shared
+        # key -> _Flight of the single_flight() call in progress
+        self.flights = {}
+        self.flights_lock = Lock()
+        self.refresher = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+
+    def _shard(self, key):
+        # A user's keys share a shard (and its user index)
+        user_id = user_of(key)
+        return self.shards[hash(key if user_id is None else user_id) % len(self.shards)]
+
+    def _user_shard(self, user_id):
+        return self.shards[hash(user_id) % len(self.shards)]
+
+    def _size(self, value):
+        return self.sizeof(value) if self.sizeof else 0
+
+    def _sync(self):
+        """Drops local entries, and marks loads stale, that other processes have changed since the last poll."""
+        for kind, target in self.shared.poll():
+            if kind == 'key':
+                self._shard(target).delete(target)
+                self._mark_stale(target)
+            elif kind == 'user':
+                self._user_shard(target).clear_user(target)
+                self._mark_stale_where(lambda key: user_of(key) == target)
+            else:
+                for shard in self.shards:
+                    shard.clear()
+                self._mark_stale_where(lambda key: True)
+
+    def get(self, key, default=None):
+        """Get value from cache if not expired (`default` if there is none)."""
+        found = self._lookup(key)
+        return default if found is None else found[0]
+
+    def _lookup(self, key):
+        """(value, stale) of a live entry - the value may be a cached None - else None."""
+        if self.shared is None:
+            return self._shard(key).get(key)
+
+        self._sync()
+        shard = self._shard(key)
+        found = shard.get(key)
+        if found is None:
+            # Loaded by another worker? Keep it locally for the rest of its TTL
+            shared = self.shared.get(key)
+            if shared is not None:
+                value, ttl, stale_after = shared
+                shard.set(key, value, ttl, self._size(value), stale_after)
+                found = (value, stale_after <= 0)
+        return found
+
+    def set(self, key, value, ttl=None, stale_after=None):
+        """
+        Set value in cache with TTL in seconds. With `stale_after` (a soft TTL, in seconds),
+        get_or_load() reloads the entry in the background once it is that old.
+        """
+        self._mark_stale(key)
+        self._store(key, value, ttl, stale_after)
+
+    def delete(self, key):
+        """Delete a specific key from cache."""
+        self._mark_stale(key)
+        self._drop(key)
+
+    def _store(self, key, value, ttl, stale_after=None, since=None):
+        """False if `since` is given and the shared tier skipped the write (see SharedCache.set)."""
+        if ttl is None:
+            ttl = self.default_ttl
+        if stale_after is None or stale_after > ttl:
+            stale_after = ttl
+        self._shard(key).set(key, value, ttl, self._size(value), stale_after)
+        if self.shared is not None:
+            return self.shared.set(key, value, ttl, stale_after, since=since) is not False
+        return True
+
+    def _drop(self, key):
+        self._shard(key).delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    # --- Request coalescing ---
+
+    def single_flight(self, key, fn):
+        """
+        Runs fn() for at most one caller per key at a time: callers that arrive while it
+        runs wait and get the same result (or exception) instead of running fn themselves.
+        """
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fn()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.flights_lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def get_or_load(self, key, loader, ttl=None, stale_after=None, negative_ttl=None):
+        """
+        Cached value of `key`; on a miss, loader() runs once however many threads miss
+        together, and its result is cached for `ttl` seconds (hard TTL). A None result is
+        cached too, for `negative_ttl` seconds if given.
+        Once the entry is `stale_after` seconds old (soft TTL), it is still returned, and
+        loader() runs on a background thread to replace it.
+        If the key is set or deleted while the loader runs (a write the load may have
+        missed), the result is returned but not kept - with a shared tier, also when the
+        write came from another process.
+        """
+        def load():
+            # Invalidations logged after this make the shared write a no-op
+            since = self.shared.current_seq() if self.shared is not None else None
+            value = loader()
+            flight = self.flights[key]
+            if value is None and negative_ttl is not None:
+                kept = self._store(key, value, negative_ttl, since=since)
+            else:
+                kept = self._store(key, value, ttl, stale_after, since=since)
+            if not kept:
+                # The key was written (here or by another process) during the load; the shared entry is newer
+                self._shard(key).delete(key)
+            elif flight.stale:
+                # Checked after storing: a write that marks the flight later also deletes after us
+                self._drop(key)
+            return value
+
+        found = self._lookup(key)
+        if found is None:
+            return self.single_flight(key, load)
+        value, stale = found
+        if stale:
+            self._refresh_in_background(key, load)
+        return value
+
+    def _refresh_in_background(self, key, load):
+        with self.flights_lock:
+            if key in self.flights:
+                # Already loading
+                return
+        try:
+            self.refresher.submit(self._refresh, key, load)
+        except RuntimeError:
+            # Interpreter shutting down
+            pass
+
+    def _refresh(self, key, load):
+        found = self._lookup(key)
+        if found is not None and not found[1]:
+            # Refreshed (or rewritten) since this refresh was queued
+            return
+        try:
+            self.single_flight(key, load)
+        except Exception as e:
+            print(f"Background refresh of cache key '{key}' failed: {e}")
+
+    def discard_loads(self, key):
+        """Makes a get_or_load() load of `key` in progress (if any) return its result without caching it."""
+        self._mark_stale(key)
+
+    def _mark_stale(self, key):
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.stale = True
+
+    def _mark_stale_where(self, matches):
+        with self.flights_lock:
+            for key, flight in self.flights.items():
+                if matches(key):
+                    flight.stale = True
+
     def clear_user_cache(self, user_id):
         """Clear all cache entries for a specific user."""
-        with self.lock:
-            keys_to_delete = [k for k in self.cache.keys() if k.startswith(f"user:{user_id}:")]
-            for key in keys_to_delete:
-                del self.cache[key]
-    
+        self._mark_stale_where(lambda key: user_of(key) == user_id)
+        self._user_shard(user_id).clear_user(user_id)
+        if self.shared is not None:
+            self.shared.clear_user(user_id)
+
     def clear_all(self):
         """Clear entire cache."""
-        with self.lock:
-            self.cache.clear()
-    
+        self._mark_stale_where(lambda key: True)
+        for shard in self.shards:
+            shard.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
     def cleanup_expired(self):
         """Remove all expired entries."""
-        with self.lock:
-            now = datetime.now()
-            expired_keys = [k for k, (_, expiry) in self.cache.items() if now >= expiry]
-            for key in expired_keys:
-                del self.cache[key]
+        for shard in self.shards:
+            shard.cleanup_expired()
+
+    def metrics(self):
+        """
+        Hit/miss/eviction counters plus the current entry count and bytes, summed over shards
+        (and the shared level's counters under 'shared').
+        """
+        total = {}
+        for shard in self.shards:
+            for name, value in shard.metrics().items():
+                total[name] = total.get(name, 0) + value
+        if self.shared is not None:
+            total['shared'] = self.shared.metrics()
+        return total
 
 # Global cache instance
-cache = CacheManager()
+cache = CacheManager(shared=SharedCache(SHARED_PATH, SHARED_POLL, retention=SHARED_LOG_RETENTION) if SHARED_PATH else None)
@@ -3,13 +3,23 @@
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 from datetime import datetime, timezone
-import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from cache_manager import cache
+from write_buffer import WriteBehindBuffer
+from user_directory import UserDirectory
 
 
-# --- INITIALIZE FIREBASE ---
-try:
+# --- STORAGE BACKEND ---
+# STORAGE_BACKEND=firestore (default) uses Firebase. STORAGE_BACKEND=local uses the SQLite
+# stand-in from local_store.py (same client API, artificial latency), so the app can be
+# benchmarked and load tested offline.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firestore').lower()
+
+def _connect_firestore():
+    """Firestore client, with credentials from the environment or serviceAccountKey.json."""
     # Try to load from environment variable first (for Render deployment)
     firebase_creds = os.getenv('FIREBASE_CREDENTIALS_JSON')
     
@@ -29,14 +39,111 @@ try:
     # Check if app is already initialized to avoid re-initialization error
     if not firebase_admin._apps:
         firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    print("Firebase connected successfully.")
-except Exception as e:
-    print(f"FATAL ERROR: Failed to connect to Firebase. Error: {e}")
-    print("Ensure either:")
-    print("  1. Environment variable FIREBASE_CREDENTIALS_JSON is set, OR")
-    print("  2. File 'serviceAccountKey.json' exists in the project directory")
-    sys.exit(1) 
+    return firestore.client()
+
+def _connect_local():
+    """(LocalStore, LocalAuth); an empty store is first filled with synthetic data."""
+    from local_store import LocalStore, LocalAuth, generate_synthetic_data
+    
+    store = LocalStore(
+        os.getenv('LOCAL_STORE_PATH', ':memory:'),
+        latency=float(os.getenv('LOCAL_STORE_LATENCY_MS', 0)) / 1000,
+        jitter=float(os.getenv('LOCAL_STORE_JITTER', 0.5))
+    )
+    if not store.collection('books').limit(1).get():
+        generate_synthetic_data(
+            store,
+            n_users=int(os.getenv('LOCAL_STORE_USERS', 200)),
+            n_books=int(os.getenv('LOCAL_STORE_BOOKS', 2000))
+        )
+    return store, LocalAuth(store)
+
+if STORAGE_BACKEND == 'local':
+    db, auth = _connect_local()
+    print(f"Using local storage backend ({db.path}, {db.latency * 1000:.0f} ms simulated latency).")
+else:
+    try:
+        db = _connect_firestore()
+        print("Firebase connected successfully.")
+    except Exception as e:
+        print(f"FATAL ERROR: Failed to connect to Firebase. Error: {e}")
+        print("Ensure either:")
+        print("  1. Environment variable FIREBASE_CREDENTIALS_JSON is set, OR")
+        print("  2. File 'serviceAccountKey.json' exists in the project directory")
+        print("  (or set STORAGE_BACKEND=local to run against the local stand-in)")
+        # Raised rather than exiting, so importers (scripts, benchmarks) can handle it
+        raise RuntimeError("Failed to connect to Firebase") from e
+
+# --- CONCURRENT READS ---
+# Independent Firestore reads of one request run in parallel on this shared pool.
+# Only request threads submit to it (pool tasks never wait on other pool tasks).
+READ_WORKERS = int(os.getenv('FIRESTORE_READ_WORKERS', 16))
+READ_TIMEOUT = float(os.getenv('FIRESTORE_READ_TIMEOUT', 5.0))  # seconds per call
+
+_read_pool = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix='firestore-read')
+
+def submit_reads(calls):
+    """Starts reads concurrently. `calls` maps a name to (function, *args); returns {name: future}."""
+    return {name: _read_pool.submit(fn, *args) for name, (fn, *args) in calls.items()}
+
+def collect_reads(futures, timeout=READ_TIMEOUT, fallbacks=None):
+    """
+    Waits for futures from submit_reads, each for at most `timeout` seconds.
+    A read that fails or times out raises, unless `fallbacks` has a value for its name.
+    """
+    deadline = time.monotonic() + timeout
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            if fallbacks is None or name not in fallbacks:
+                raise
+            print(f"Firestore read '{name}' failed or timed out, using fallback: {e!r}")
+            results[name] = fallbacks[name]
+    return results
+
+def fetch_parallel(calls, timeout=READ_TIMEOUT, fallbacks=None):
+    """submit_reads + collect_reads."""
+    return collect_reads(submit_reads(calls), timeout, fallbacks)
+
+# --- WRITE-BEHIND SWIPES (optional) ---
+# With SWIPE_WRITE_BEHIND=1, swipes update the in-process state right away and are
+# committed to Firestore in background batches instead of one add() per request.
+SWIPE_WRITE_BEHIND = os.getenv('SWIPE_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+
+swipe_buffer = None
+if SWIPE_WRITE_BEHIND:
+    swipe_buffer = WriteBehindBuffer(
+        db,
+        max_size=int(os.getenv('SWIPE_BUFFER_SIZE', 10000)),
+        flush_interval=float(os.getenv('SWIPE_FLUSH_INTERVAL', 0.5))
+    )
+    swipe_buffer.install_shutdown_hooks()
+
+def get_swipe_buffer_metrics():
+    """Queue depth and commit counters of the write-behind buffer (None when disabled)."""
+    return swipe_buffer.metrics() if swipe_buffer else None
+
+def get_cache_metrics():
+    """Entry count, approximate bytes and hit/miss/eviction counters of the user data cache."""
+    return cache.metrics()
+
+# --- CACHE TTLS ---
+# Swipe state, preferences and friends are fresh for CACHE_TTL seconds. After that they
+# are still served (and reloaded in the background) until CACHE_HARD_TTL. A missing user
+# doc is cached for CACHE_NEGATIVE_TTL only, since the client creates it directly in Firestore.
+CACHE_TTL = int(os.getenv('CACHE_TTL', 300))
+CACHE_HARD_TTL = int(os.getenv('CACHE_HARD_TTL', 900))
+CACHE_NEGATIVE_TTL = int(os.getenv('CACHE_NEGATIVE_TTL', 30))
+if cache.shared is not None and CACHE_HARD_TTL > cache.shared.retention:
+    # A process that polls late would miss invalidations of entries it still serves
+    raise ValueError(f"CACHE_HARD_TTL ({CACHE_HARD_TTL}s) is longer than the shared cache's invalidation log "
+                     f"retention ({cache.shared.retention:g}s); raise CACHE_SHARED_LOG_RETENTION")
+# Pending friend requests are invalidated on send/answer, but only in the process that
+# handled it (or, with the shared tier, on its host). Without the shared tier a request
+# sent through another worker must still show up quickly, so they are only kept briefly.
+FRIEND_REQUESTS_TTL = int(os.getenv('FRIEND_REQUESTS_TTL', 300 if cache.shared is not None else 5))
 
 # --- FIREBASE DATA FUNCTIONS ---
 
@@ -75,95 +182,189 @@ def get_all_books_from_db():
         
     return book_list
 
-def get_user_swipes(user_id):
-    """Fetches a list of book_ids (ISBNS) the user has already swiped."""
-    cache_key = f"user:{user_id}:swipes"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return cached
+def _timestamp_sort_key(d):
+    """
+    Safe sort key for swipe timestamps that handles:
+    - Missing timestamps (None)
+    - Naive datetimes (no timezone)
+    - Aware datetimes (with timezone)
+    """
+    ts = d.get('timestamp')
+    if ts is None:
+        # Treat missing timestamps as very old
+        return datetime.min.replace(tzinfo=timezone.utc)
+    if hasattr(ts, 'tzinfo') and ts.tzinfo is None:
+        # Make naive timestamps aware (assume UTC for sorting comparison compliance)
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+class UserSwipeState:
+    """
+    Everything the recommender needs from one user's swipes, built from a single query:
+    - history: set of every swiped book_id
+    - likes: liked book_ids, most recent first
+    - dislikes: disliked book_ids
+    """
+
+    def __init__(self, swipes=()):
+        # Only the latest swipe of each book counts (older data may hold several per book)
+        latest = {}
+        for d in sorted(swipes, key=_timestamp_sort_key):
+            latest[d['book_id']] = d
+        swipes = list(latest.values())
+        self.history = {d['book_id'] for d in swipes}
+        liked = [d for d in swipes if d.get('action') == 'like']
+        liked.sort(key=_timestamp_sort_key, reverse=True)
+        self.likes = [d['book_id'] for d in liked]
+        self.dislikes = [d['book_id'] for d in swipes if d.get('action') == 'dislike']
+
+    def _copy(self, history, likes, dislikes):
+        state = UserSwipeState()
+        state.history, state.likes, state.dislikes = history, likes, dislikes
+        return state
+
+    def with_swipe(self, book_id, action):
+        """
+        New state with `action` as the newest swipe of `book_id`, replacing any earlier one.
+        States are never mutated, since readers may hold them.
+        """
+        likes = [b for b in self.likes if b != book_id]
+        dislikes = [b for b in self.dislikes if b != book_id]
+        if action == 'like':
+            likes.insert(0, book_id)
+        elif action == 'dislike':
+            dislikes.append(book_id)
+        return self._copy(self.history | {book_id}, likes, dislikes)
+
+    def without_book(self, book_id):
+        """New state with every swipe of `book_id` removed."""
+        return self._copy(
+            self.history - {book_id},
+            [b for b in self.likes if b != book_id],
+            [b for b in self.dislikes if b != book_id]
+        )
+
+def swipe_doc_id(user_id, book_id):
+    """Swipes are keyed by user and book, so each user has at most one swipe per book."""
+    return f"{user_id}_{book_id}"
+
+def _swipe_ref(user_id, book_id):
+    return db.collection('swipes').document(swipe_doc_id(user_id, book_id))
+
+# migrate_swipe_ids.py writes this doc when it has finished. Until then a swipe may
+# also exist under auto ids, so unlikes delete those too.
+SWIPE_MIGRATION_MARKER = ('migrations', 'swipe_ids')
+MIGRATION_CHECK_INTERVAL = 300  # seconds
+_swipe_migration = {'done': False, 'checked_at': None}
+
+def _legacy_swipes_possible():
+    """False once the swipe id migration is known to have run (rechecked every MIGRATION_CHECK_INTERVAL)."""
+    now = time.monotonic()
+    if not _swipe_migration['done'] and (
+            _swipe_migration['checked_at'] is None or now - _swipe_migration['checked_at'] > MIGRATION_CHECK_INTERVAL):
+        collection, doc_id = SWIPE_MIGRATION_MARKER
+        try:
+            _swipe_migration['done'] = db.collection(collection).document(doc_id).get().exists
+        except Exception as e:
+            print(f"Error checking the swipe id migration marker: {e}")
+        _swipe_migration['checked_at'] = now
+    return not _swipe_migration['done']
+
+def _swipe_state_key(user_id):
+    return f"user:{user_id}:swipe_state"
+
+# Serializes read-modify-write updates of cached swipe states
+_swipe_state_lock = Lock()
+
+def _update_cached_swipe_state(user_id, update):
+    """
+    Write-through: applies `update` to the cached UserSwipeState, if there is one,
+    so the next read doesn't have to requery the user's swipes.
+    """
+    cache_key = _swipe_state_key(user_id)
+    with _swipe_state_lock:
+        state = cache.get(cache_key)
+        if state is not None:
+            cache.set(cache_key, update(state), ttl=CACHE_HARD_TTL, stale_after=CACHE_TTL)
+        else:
+            # Not cached: make sure a load running right now (which may have missed this write) isn't kept
+            cache.delete(cache_key)
+
+def get_user_swipe_state(user_id):
+    """Streams the user's swipes once and returns their (cached) UserSwipeState."""
+    return cache.get_or_load(
+        _swipe_state_key(user_id), lambda: _load_swipe_state(user_id),
+        ttl=CACHE_HARD_TTL, stale_after=CACHE_TTL
+    )
+
+def _load_swipe_state(user_id):
+    # Buffered swipes are read first: one committed in the meantime shows up in both (same doc id)
+    prefix = swipe_doc_id(user_id, '')
+    pending = swipe_buffer.pending_writes(
+        lambda doc_id, data: doc_id.startswith(prefix) and (data is None or data['user_id'] == user_id)
+    ) if swipe_buffer else []
     
     # CRITICAL: Filters swipes based on the real user_id passed from app.py
     swipes_ref = db.collection('swipes').where('user_id', '==', user_id)
-    swipes = swipes_ref.stream()
-    result = [swipe.to_dict()['book_id'] for swipe in swipes]
-    
-    cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
-    return result
+    swipes = {swipe.id: swipe.to_dict() for swipe in swipes_ref.stream()}
+    for doc_id, data in pending:
+        if data is None:
+            swipes.pop(doc_id, None)
+        else:
+            swipes[doc_id] = data
+    return UserSwipeState(swipes.values())
+
+def get_user_swipes(user_id):
+    """Fetches a list of book_ids (ISBNS) the user has already swiped."""
+    return list(get_user_swipe_state(user_id).history)
 
 def add_user_swipe(user_id, book_id, action):
-    """Saves a new swipe record ('like' or 'dislike')."""
+    """Saves the user's swipe of a book ('like' or 'dislike'), replacing any earlier one."""
     # CRITICAL: Stores the swipe using the real user_id passed from app.py
-    db.collection('swipes').add({
+    swipe = {
         'user_id': user_id,
         'book_id': book_id,
         'action': action,
         'timestamp': datetime.now(timezone.utc)
-    })
-    
-    # Invalidate cache for this user
-    cache.clear_user_cache(user_id)
+    }
+    # Idempotent set() on the deterministic doc id; write-behind when enabled,
+    # a full buffer falls back to a direct write
+    swipe_ref = _swipe_ref(user_id, book_id)
+    if swipe_buffer is None or not swipe_buffer.set(swipe_ref, swipe):
+        swipe_ref.set(swipe)
+    
+    # Update the cached swipe state in place; preferences and friends are unaffected
+    _update_cached_swipe_state(user_id, lambda state: state.with_swipe(book_id, action))
+    
+    # Friends who have this user's likes in their social index (a dislike replaces an earlier like)
+    if action == 'like':
+        _update_social_indexes(user_id, lambda index: index.with_like(user_id, str(book_id)))
+    else:
+        _update_social_indexes(user_id, lambda index: index.without_like(user_id, str(book_id)))
 
 def get_user_preferences(user_id):
     """Fetches user preferences from the 'users' collection."""
-    cache_key = f"user:{user_id}:preferences"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    user_ref = db.collection('users').document(user_id)
-    doc = user_ref.get()
-    result = doc.to_dict() if doc.exists else None
-    
-    cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
-    return result
+    def load():
+        doc = db.collection('users').document(user_id).get()
+        if not doc.exists:
+            return None
+        profile = doc.to_dict()
+        # The client writes profiles directly to Firestore; this is where the server sees them
+        _update_user_directory(user_id, profile)
+        return profile
+    
+    return cache.get_or_load(
+        f"user:{user_id}:preferences", load,
+        ttl=CACHE_HARD_TTL, stale_after=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL
+    )
 
 def get_user_liked_book_ids(user_id):
     """Fetches a list of book_ids that the user has LIKED, sorted by most recent."""
-    cache_key = f"user:{user_id}:liked_books"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    swipes_ref = db.collection('swipes').where('user_id', '==', user_id).where('action', '==', 'like')
-    
-    # 1. Fetch all documents
-    docs = list(swipes_ref.stream())
-    data = [doc.to_dict() for doc in docs]
-    
-    # 2. Define a safe sort key that handles:
-    #    - Missing timestamps (None)
-    #    - Naive datetimes (no timezone)
-    #    - Aware datetimes (with timezone)
-    def sort_key(d):
-        ts = d.get('timestamp')
-        if ts is None:
-            # Treat missing timestamps as very old
-            return datetime.min.replace(tzinfo=timezone.utc)
-        if hasattr(ts, 'tzinfo') and ts.tzinfo is None:
-            # Make naive timestamps aware (assume UTC for sorting comparison compliance)
-            return ts.replace(tzinfo=timezone.utc)
-        return ts
-
-    # 3. Sort by timestamp descending (newest first)
-    data.sort(key=sort_key, reverse=True)
-    result = [item['book_id'] for item in data]
-    
-    cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
-    return result
+    return list(get_user_swipe_state(user_id).likes)
 
 def get_user_disliked_book_ids(user_id):
     """Fetches a list of book_ids that the user has DISLIKED."""
-    cache_key = f"user:{user_id}:disliked_books"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    swipes_ref = db.collection('swipes').where('user_id', '==', user_id).where('action', '==', 'dislike')
-    swipes = swipes_ref.stream()
-    result = [swipe.to_dict()['book_id'] for swipe in swipes]
-    
-    cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
-    return result
+    return list(get_user_swipe_state(user_id).dislikes)
 
 def save_user_preferences(user_id, age, genres, frequency):
     """Saves or updates user preferences in the 'users' collection."""
@@ -178,13 +379,92 @@ def save_user_preferences(user_id, age, genres, frequency):
     
     # Invalidate preferences cache
     cache.delete(f"user:{user_id}:preferences")
+    
+    # Reload the profile: warms the cache for the recommendations page and updates the user directory
+    try:
+        get_user_preferences(user_id)
+    except Exception as e:
+        print(f"Error reloading profile of {user_id}: {e}")
     return True
 
 # --- FRIENDS SYSTEM ---
 
-def search_users(query):
+# --- USER DIRECTORY ---
+USER_DIRECTORY_REFRESH = int(os.getenv('USER_DIRECTORY_REFRESH', 600))  # seconds
+
+def _profile_username(profile):
+    """Display name stored in a 'users' profile, or None."""
+    return profile.get('username') or profile.get('displayName')
+
+def _update_user_directory(user_id, profile):
+    """
+    Applies a 'users' profile read or written by the server to the user directory, so new
+    and renamed users are searchable before the next export. (The Auth email isn't known
+    here; the profile's is used if it has one, else the directory keeps what it has.)
+    """
+    email = profile.get('email')
+    username = _profile_username(profile)
+    if username is None and user_id not in user_directory and email:
+        username = email.split('@')[0]
+    if email or username:
+        user_directory.upsert(user_id, email, username)
+
+def _export_users():
     """
-    Search for a user by email or username.
+    Bulk export for the user directory: every Auth user (auth.list_users paging)
+    merged with the 'users' profiles. Returns {uid: {'email', 'username'}}.
+    """
+    def list_auth_users():
+        return {u.uid: (u.email, u.display_name) for u in auth.list_users().iterate_all()}
+    
+    def list_profiles():
+        return {doc.id: doc.to_dict() for doc in db.collection('users').stream()}
+    
+    reads = fetch_parallel({'auth': (list_auth_users,), 'profiles': (list_profiles,)}, timeout=60)
+    
+    records = {}
+    for uid in set(reads['auth']) | set(reads['profiles']):
+        auth_email, auth_name = reads['auth'].get(uid, (None, None))
+        profile = reads['profiles'].get(uid) or {}
+        email = auth_email or profile.get('email')
+        # Same display name rule as search_users: profile name, then Auth name, then email prefix
+        username = _profile_username(profile) or auth_name or (email.split('@')[0] if email else "User")
+        records[uid] = {'email': email, 'username': username}
+    return records
+
+user_directory = UserDirectory(_export_users, refresh_interval=USER_DIRECTORY_REFRESH)
+
+def warm_up_user_directory():
+    """Starts the first user directory export in the background (called at app startup)."""
+    user_directory.ensure_fresh()
+
+def search_users(query, typeahead=False):
+    """
+    Search for users by exact email/username or username prefix in the in-process user directory.
+    Until the directory's first export has loaded, and on a miss (e.g. a user who signed
+    up after the last export), a full search falls back to the exact remote lookups and
+    adds what they find to the directory; typeahead searches never make remote calls.
+    """
+    user_directory.ensure_fresh()
+    if not user_directory.ready:
+        # First export still running (or failed): exact remote lookups, none for typeahead
+        return [] if typeahead else _search_users_remote(query)
+    
+    results = user_directory.search(query)
+    for r in results:
+        r['email'] = r['email'] or 'Private Email'
+    if results or typeahead:
+        return results
+    
+    results = _search_users_remote(query)
+    for r in results:
+        email = r['email'] if r['email'] != 'Private Email' else None
+        user_directory.upsert(r['user_id'], email, r['username'])
+    return results
+
+def _search_users_remote(query):
+    """
+    Exact remote search for a user by email or username (directory misses).
     1. Try Auth by email.
     2. Try Firestore 'users' collection by email field.
     3. Try Firestore 'users' collection by username field.
@@ -265,105 +545,139 @@ def send_friend_request(from_uid, to_uid):
         'status': 'pending',
         'timestamp': datetime.now()
     })
+    cache.delete(_friend_requests_key(to_uid))
     return True, "Request sent."
 
 def answer_friend_request(request_id, status):
     """Accept or reject a friend request. Status should be 'accepted' or 'rejected'."""
     ref = db.collection('friendships').document(request_id)
+    doc = ref.get()
     if status == 'rejected':
         ref.delete()
     else:
         ref.update({'status': 'accepted'})
+    
+    if doc.exists:
+        d = doc.to_dict()
+        # The request leaves the recipient's pending list
+        cache.delete(_friend_requests_key(d.get('to_uid')))
+        if status != 'rejected':
+            # Both users have a new friend
+            _invalidate_friends(d.get('from_uid'), d.get('to_uid'))
     return True
 
+def _friend_requests_key(user_id):
+    return f"user:{user_id}:friend_requests"
+
+def _get_senders(uids):
+    """
+    {uid: (email, username)} for friend request senders: one batched auth.get_users call,
+    then the Firestore 'users' profiles (one get_all) for senders Auth doesn't know.
+    """
+    senders = {}
+    try:
+        for i in range(0, len(uids), 100): # auth.get_users takes at most 100 identifiers
+            identifiers = [auth.UidIdentifier(uid) for uid in uids[i:i + 100]]
+            for user_record in auth.get_users(identifiers).users:
+                senders[user_record.uid] = (user_record.email, user_record.display_name or user_record.email)
+    except Exception as e:
+        print(f"Error batch fetching request senders from Auth: {e}")
+    
+    missing = [uid for uid in uids if uid not in senders]
+    if missing:
+        users_ref = db.collection('users')
+        for doc in db.get_all([users_ref.document(uid) for uid in missing]):
+            if doc.exists:
+                d = doc.to_dict()
+                _update_user_directory(doc.id, d)
+                email = d.get('email') or "Unknown Email"
+                senders[doc.id] = (email, _profile_username(d) or "Unknown User")
+    return senders
+
 def get_friend_requests(user_id):
-    """Get pending incoming requests."""
+    """Get pending incoming requests (cached for FRIEND_REQUESTS_TTL; invalidated by send/answer_friend_request)."""
+    return cache.get_or_load(
+        _friend_requests_key(user_id), lambda: _load_friend_requests(user_id), ttl=FRIEND_REQUESTS_TTL
+    )
+
+def _load_friend_requests(user_id):
     reqs = db.collection('friendships').where('to_uid', '==', user_id).where('status', '==', 'pending').stream()
     results = []
-    
-    # Pre-fetch user emails via auth? Or fetch one by one.
-    # Requests are usually few. One by one is fine for now, but we can handle exceptions.
-    
     for r in reqs:
         d = r.to_dict()
         d['id'] = r.id
-        # Fetch sender info from Auth to ensure we get Email
-        try:
-            user_record = auth.get_user(d['from_uid'])
-            d['sender_email'] = user_record.email
-            d['sender_username'] = user_record.display_name or user_record.email
-        except Exception as e:
-            # Fallback to Firestore if Auth fails (rare) or just handle gracefully
-            d['sender_email'] = "Unknown Email"
-            d['sender_username'] = "Unknown User"
-            
         results.append(d)
+    
+    # Resolve all senders at once
+    senders = _get_senders(list({d['from_uid'] for d in results})) if results else {}
+    for d in results:
+        d['sender_email'], d['sender_username'] = senders.get(d['from_uid'], ("Unknown Email", "Unknown User"))
     return results
 
+def _stream_field(query, field):
+    """Runs a query and returns one field of every matching document."""
+    return [doc.to_dict()[field] for doc in query.stream()]
+
 def get_friends(user_id):
     """Get list of active friends."""
-    cache_key = f"user:{user_id}:friends"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
+    return cache.get_or_load(
+        f"user:{user_id}:friends", lambda: _load_friends(user_id),
+        ttl=CACHE_HARD_TTL, stale_after=CACHE_TTL
+    )
+
+def _load_friends(user_id):
     # Friends can be where user is from_uid OR to_uid, and status is accepted
-    friends = []
-    
-    # Case 1: user sent request
-    sent = db.collection('friendships').where('from_uid', '==', user_id).where('status', '==', 'accepted').stream()
-    for f in sent:
-        other_id = f.to_dict()['to_uid']
-        friends.append(other_id)
-        
-    # Case 2: user received request
-    received = db.collection('friendships').where('to_uid', '==', user_id).where('status', '==', 'accepted').stream()
-    for f in received:
-        other_id = f.to_dict()['from_uid']
-        friends.append(other_id)
-    
-    result = list(set(friends))
-    cache.set(cache_key, result, ttl=300)  # Cache for 5 minutes
-    return result
+    friendships = db.collection('friendships')
+    reads = fetch_parallel({
+        # Case 1: user sent request
+        'sent': (_stream_field, friendships.where('from_uid', '==', user_id).where('status', '==', 'accepted'), 'to_uid'),
+        # Case 2: user received request
+        'received': (_stream_field, friendships.where('to_uid', '==', user_id).where('status', '==', 'accepted'), 'from_uid'),
+    })
+    friends = reads['sent'] + reads['received']
+    return list(set(friends))
 
-def get_friends_preferences_data(friend_ids):
+def _load_friends_social_data(friend_ids):
     """
-    Aggregate preferences and liked books from a list of friend IDs.
-    Returns:
-    1. Set of liked genres
-    2. Dictionary of {book_id: [friend_email1, friend_email2]} for liked books.
+    Batch-loads what the social index needs for a list of friend IDs:
+    1. Dictionary of {friend_id: email}
+    2. Set of liked genres
+    3. List of (book_id, friend_id) likes
     
-    OPTIMIZED: Uses batch fetching.
+    OPTIMIZED: Uses batch fetching, with the Auth, user and swipe reads issued concurrently.
     """
-    all_genres = set()
-    friends_likes_map = {} # book_id -> list of friend emails
-    
-    if not friend_ids:
-        return [], {}
-        
     users_ref = db.collection('users')
+    swipes_ref = db.collection('swipes')
     
-    # 1. Batch Get User Docs (for genres) AND Auth Users (for emails)
+    def chunks(lst, n):
+        for i in range(0, len(lst), n):
+            yield lst[i:i + n]
     
-    # A. Get Emails from Auth (Batch)
-    friend_emails = {}
-    try:
+    def get_emails(uids):
         # auth.get_users takes a list of UidIdentifier
-        identifiers = [auth.UidIdentifier(uid) for uid in friend_ids]
-        get_users_result = auth.get_users(identifiers)
-        
-        for user_record in get_users_result.users:
-            friend_emails[user_record.uid] = user_record.email
-            
-    except Exception as e:
-        print(f"Error batch fetching users from Auth: {e}")
-        # Fallback?
-    
-    # B. Get Genres from Firestore (Batch)
-    refs = [users_ref.document(fid) for fid in friend_ids]
-    user_docs = db.get_all(refs)
+        identifiers = [auth.UidIdentifier(uid) for uid in uids]
+        return {user_record.uid: user_record.email for user_record in auth.get_users(identifiers).users}
+    
+    def get_likes(chunk):
+        # Get all likes from these users
+        q = swipes_ref.where('user_id', 'in', chunk).where('action', '==', 'like')
+        return [s.to_dict() for s in q.stream()]
+    
+    # 1. Start all reads at once:
+    # A. Emails from Auth (Batch)
+    # B. Genres from Firestore (Batch)
+    # C. Swipes (Likes). "IN" query is limited to 30. We must chunk it.
+    calls = {
+        'emails': (get_emails, friend_ids),
+        'user_docs': (lambda refs: list(db.get_all(refs)), [users_ref.document(fid) for fid in friend_ids]),
+    }
+    like_chunks = [f'likes:{i}' for i in range(0, len(friend_ids), 10)]
+    for name, chunk in zip(like_chunks, chunks(friend_ids, 10)): # Safe chunk size 10
+        calls[name] = (get_likes, chunk)
+    reads = fetch_parallel(calls, fallbacks={'emails': {}})
     
-    for doc in user_docs:
+    all_genres = set()
+    for doc in reads['user_docs']:
         if not doc.exists:
             continue
         data = doc.to_dict()
@@ -372,49 +686,283 @@ def get_friends_preferences_data(friend_ids):
         genres = data.get('genres', [])
         for g in genres:
             all_genres.add(g.lower())
+    
+    likes = [(str(d.get('book_id')), d.get('user_id')) for name in like_chunks for d in reads[name]]
+    return reads['emails'], all_genres, likes
+
+class FriendsSocialIndex:
+    """
+    One user's friends' activity, as used by the recommender:
+    - genres: aggregated (lowercase) friend genres
+    - likes_map: {book_id: [friend_email1, friend_email2]} for books liked by friends
+    Maintained incrementally when a friend likes/unlikes (copy-on-write, like UserSwipeState).
+    """
+
+    def __init__(self, friends=(), labels=None, genres=(), likes=()):
+        self.friends = list(friends)
+        # Use email if available, else fallback to something
+        self.labels = {fid: (labels or {}).get(fid, "A Friend") for fid in self.friends}
+        self.genres = list(genres)
+        # book_id -> friend ids, in like order
+        self.likers = {}
+        for book_id, fid in likes:
+            likers = self.likers.setdefault(book_id, [])
+            if fid not in likers:
+                likers.append(fid)
+        self.likes_map = {book_id: self._labels_for(likers) for book_id, likers in self.likers.items()}
+
+    def _labels_for(self, likers):
+        # Avoid duplicates
+        labels = []
+        for fid in likers:
+            label = self.labels.get(fid, "A Friend")
+            if label not in labels:
+                labels.append(label)
+        return labels
+
+    def _with_likers(self, book_id, likers):
+        index = FriendsSocialIndex()
+        index.friends, index.labels, index.genres = self.friends, self.labels, self.genres
+        index.likers = dict(self.likers)
+        index.likes_map = dict(self.likes_map)
+        if likers:
+            index.likers[book_id] = likers
+            index.likes_map[book_id] = self._labels_for(likers)
+        else:
+            index.likers.pop(book_id, None)
+            index.likes_map.pop(book_id, None)
+        return index
+
+    def with_like(self, friend_id, book_id):
+        likers = self.likers.get(book_id, [])
+        if friend_id in likers:
+            return self
+        return self._with_likers(book_id, likers + [friend_id])
+
+    def without_like(self, friend_id, book_id):
+        likers = self.likers.get(book_id, [])
+        if friend_id not in likers:
+            return self
+        return self._with_likers(book_id, [fid for fid in likers if fid != friend_id])
+
+def _social_index_key(user_id):
+    return f"user:{user_id}:social_index"
+
+# Serializes the read-modify-write of cached social indexes in _update_social_indexes
+_social_index_lock = Lock()
+
+def get_friends_social_index(user_id):
+    """Returns the user's (cached) FriendsSocialIndex, rebuilding it after the TTL expires."""
+    def build():
+        friends = get_friends(user_id)
+        if not friends:
+            return FriendsSocialIndex()
+        labels, genres, likes = _load_friends_social_data(friends)
+        return FriendsSocialIndex(friends, labels, genres, likes)
+    
+    # Concurrent misses share one build; a like update during the build discards its result
+    return cache.get_or_load(_social_index_key(user_id), build, ttl=300)  # Cache for 5 minutes
+
+def _update_social_indexes(friend_id, update):
+    """
+    Applies `update` to the cached social index of every user who has `friend_id` as a friend.
+    Friendships are mutual, so those users are friend_id's own (cached) friends list; nothing
+    is kept per follower. The updated index is written through the cache, so with the shared
+    tier (CACHE_SHARED_PATH) other worker processes see it too. Without it, other processes
+    keep their own copy until it expires, and concurrent updates from two processes can
+    overwrite each other; the next rebuild corrects both.
+    """
+    followers = get_friends(friend_id)
+    with _social_index_lock:
+        for user_id in followers:
+            # The friend's card shows their recent likes (cached whether or not the index is)
+            cache.delete(_friend_card_key(user_id))
             
-    # 2. Batch Get Swipes (Likes)
-    # "IN" query is limited to 30. We must chunk it.
+            cache_key = _social_index_key(user_id)
+            index = cache.get(cache_key)
+            if index is None:
+                # Not cached; a build running right now may have missed this like
+                cache.discard_loads(cache_key)
+                continue
+            if friend_id not in index.labels:
+                # Built before the friendship existed
+                continue
+            cache.set(cache_key, update(index), ttl=300)
+
+def _invalidate_friends(*user_ids):
+    """Friendships changed: drop the cached friends list, social index and friend cards of these users."""
+    for user_id in user_ids:
+        cache.delete(f"user:{user_id}:friends")
+        cache.delete(_social_index_key(user_id))
+        cache.delete(_friend_card_key(user_id))
+
+def get_friends_preferences_data(friend_ids):
+    """
+    Aggregate preferences and liked books from a list of friend IDs.
+    Returns:
+    1. Set of liked genres
+    2. Dictionary of {book_id: [friend_email1, friend_email2]} for liked books.
+    """
+    if not friend_ids:
+        return [], {}
     
-    def chunks(lst, n):
-        for i in range(0, len(lst), n):
-            yield lst[i:i + n]
+    index = FriendsSocialIndex(friend_ids, *_load_friends_social_data(friend_ids))
+    return index.genres, index.likes_map
+
+# Recent likes fetched per friend card (the page shows the first few that are in the catalog)
+FRIEND_CARD_LIKES = 10
+
+def _friend_card_key(user_id):
+    return f"user:{user_id}:friend_cards"
+
+def _recent_likes(friend_ids):
+    """
+    {friend_id: [book_id, ...]} with up to FRIEND_CARD_LIKES most recent likes per friend.
+    Uses one ordered `in` query per chunk of 10 friends, limited to 10 * FRIEND_CARD_LIKES docs;
+    friends crowded out of a full chunk get their own limited query.
+    (Needs the swipes (user_id, action, timestamp desc) index from firestore.indexes.json.)
+    """
+    likes = db.collection('swipes').where('action', '==', 'like')
+    
+    def recent(query, limit):
+        q = query.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
+        return [s.to_dict() for s in q.stream()]
+    
+    chunks = [friend_ids[i:i + 10] for i in range(0, len(friend_ids), 10)]
+    reads = fetch_parallel({
+        i: (recent, likes.where('user_id', 'in', chunk), len(chunk) * FRIEND_CARD_LIKES)
+        for i, chunk in enumerate(chunks)
+    })
+    
+    result = {fid: [] for fid in friend_ids}
+    crowded_out = []
+    for i, chunk in enumerate(chunks):
+        for d in reads[i]:
+            book_ids = result.get(d.get('user_id'))
+            if book_ids is not None and len(book_ids) < FRIEND_CARD_LIKES:
+                book_ids.append(str(d.get('book_id')))
+        if len(reads[i]) == len(chunk) * FRIEND_CARD_LIKES:
+            crowded_out += [fid for fid in chunk if len(result[fid]) < FRIEND_CARD_LIKES]
+    
+    if crowded_out:
+        reads = fetch_parallel({
+            fid: (recent, likes.where('user_id', '==', fid), FRIEND_CARD_LIKES) for fid in crowded_out
+        })
+        for fid, docs in reads.items():
+            result[fid] = [str(d.get('book_id')) for d in docs]
+    return result
+
+def get_friend_cards(user_id):
+    """
+    Profile cards for the user's friends: user_id, username, email and recent_likes
+    (book_ids, most recent first). Built from one get_all for the profiles, one
+    auth.get_users call for the emails and chunked likes queries, all issued concurrently.
+    """
+    return cache.get_or_load(_friend_card_key(user_id), lambda: _load_friend_cards(user_id), ttl=300)
+
+def _load_friend_cards(user_id):
+    friends = get_friends(user_id)
+    cards = []
+    if friends:
+        users_ref = db.collection('users')
+        
+        def get_emails(uids):
+            result = {}
+            for i in range(0, len(uids), 100): # auth.get_users takes at most 100 identifiers
+                identifiers = [auth.UidIdentifier(uid) for uid in uids[i:i + 100]]
+                result.update({ur.uid: ur.email for ur in auth.get_users(identifiers).users})
+            return result
+        
+        pending = submit_reads({
+            'profiles': (lambda refs: list(db.get_all(refs)), [users_ref.document(fid) for fid in friends]),
+            'emails': (get_emails, friends),
+        })
+        recent_likes = _recent_likes(friends)
+        reads = collect_reads(pending, fallbacks={'emails': {}})
+        
+        emails = reads['emails']
+        for doc in reads['profiles']:
+            if not doc.exists:
+                continue
+            d = doc.to_dict()
+            fid = doc.id
+            _update_user_directory(fid, d)
+            email = emails.get(fid, "Unknown Email")
             
-    # Only fetch if we have friends
-    if friend_ids:
-        swipes_ref = db.collection('swipes')
-        for chunk in chunks(friend_ids, 10): # Safe chunk size 10
-             # Get all likes from these users
-             q = swipes_ref.where('user_id', 'in', chunk).where('action', '==', 'like')
-             docs = q.stream()
-             
-             for s in docs:
-                 d = s.to_dict()
-                 bid = d.get('book_id')
-                 uid = d.get('user_id')
-                 
-                 # Use email if available, else fallback to something
-                 f_email = friend_emails.get(uid, "A Friend")
-                 
-                 str_bid = str(bid)
-                 if str_bid not in friends_likes_map:
-                     friends_likes_map[str_bid] = []
-                 # Avoid duplicates
-                 if f_email not in friends_likes_map[str_bid]:
-                     friends_likes_map[str_bid].append(f_email)
+            # Determine display name
+            display_name = d.get('username') or d.get('displayName')
+            if not display_name or display_name == 'Unknown':
+                if email and '@' in email:
+                    display_name = email.split('@')[0]
+                else:
+                    display_name = "Friend"
             
-    return list(all_genres), friends_likes_map
+            cards.append({
+                'user_id': fid,
+                'username': display_name,
+                'email': email,
+                'recent_likes': recent_likes.get(fid, [])
+            })
+    return cards
 
-def remove_user_swipe(user_id, book_id):
-    """Removes a swipe (unlike)."""
-    # Find the swipe document
-    swipes = db.collection('swipes').where('user_id', '==', user_id).where('book_id', '==', str(book_id)).stream()
+class UserContext:
+    """Per-request recommender inputs for one user (see load_user_context)."""
+
+    def __init__(self, swipe_state, preferences, friends, friends_genres, friends_likes_map):
+        self.swipe_state = swipe_state
+        self.preferences = preferences
+        self.friends = friends
+        self.friends_genres = friends_genres
+        self.friends_likes_map = friends_likes_map
+
+    @property
+    def genres(self):
+        return self.preferences.get('genres', []) if self.preferences else []
+
+def load_user_context(user_id):
+    """
+    Loads swipe state, preferences, friends and friends' likes/genres for one user.
+    The swipe/preferences reads run concurrently with the friends chain, so the request
+    waits for the slowest path instead of the sum of all reads. Friends data is optional:
+    if it fails or times out the user just gets no friend boosts.
+    """
+    pending = submit_reads({
+        'swipe_state': (get_user_swipe_state, user_id),
+        'preferences': (get_user_preferences, user_id),
+    })
     
-    deleted = False
-    for swipe in swipes:
-        swipe.reference.delete()
-        deleted = True
+    try:
+        social = get_friends_social_index(user_id)
+    except Exception as e:
+        print(f"Error loading friends data for {user_id}: {e!r}")
+        social = FriendsSocialIndex()
     
-    # Invalidate cache for this user
-    cache.clear_user_cache(user_id)
+    reads = collect_reads(pending)
+    return UserContext(reads['swipe_state'], reads['preferences'], social.friends, social.genres, social.likes_map)
+
+def remove_user_swipe(user_id, book_id):
+    """Removes a swipe (unlike)."""
+    # 1. Does the swipe exist? A buffered write for it is newer than what Firestore has
+    swipe_ref = _swipe_ref(user_id, book_id)
+    pending = swipe_buffer.pending_writes(lambda doc_id, data: doc_id == swipe_ref.id) if swipe_buffer else []
+    deleted = pending[-1][1] is not None if pending else swipe_ref.get().exists
+    
+    # 2. Single delete of the deterministic doc
+    if deleted:
+        if swipe_buffer is None or not swipe_buffer.delete(swipe_ref):
+            swipe_ref.delete()
+    
+    # 3. Swipes saved with auto ids, which can coexist with the deterministic doc until
+    # migrate_swipe_ids.py has run
+    if _legacy_swipes_possible():
+        swipes = db.collection('swipes').where('user_id', '==', user_id).where('book_id', '==', str(book_id)).stream()
+        for swipe in swipes:
+            if swipe.id != swipe_ref.id:
+                swipe.reference.delete()
+                deleted = True
+    
+    # Update the cached swipe state in place; preferences and friends are unaffected
+    if deleted:
+        _update_cached_swipe_state(user_id, lambda state: state.without_book(str(book_id)))
+        _update_social_indexes(user_id, lambda index: index.without_like(user_id, str(book_id)))
     return deleted
\ No newline at end of file
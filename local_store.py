@@ -0,0 +1,498 @@
+# local_store.py
+"""
+Local stand-in for Firestore and Firebase Auth, for offline benchmarks and load tests
+(STORAGE_BACKEND=local in firebase_dal).
+- LocalStore implements the part of the Firestore client API the DAL uses
+  (collection/document/where/order_by/limit/start_after/stream/get_all/batch) on SQLite:
+  in memory by default, or in a file that several gunicorn workers can share.
+- LocalAuth does the same for the Auth user calls.
+Every call sleeps for an artificial round-trip latency, so a request costs roughly
+what it would against Firestore, and `stats` counts calls, reads and writes.
+generate_synthetic_data() fills a store with books, users, swipes and friendships.
+
+Usage: python local_store.py PATH [--users 200] [--books 2000] [--seed 0]
+"""
+
+import argparse
+import json
+import operator
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from write_buffer import MAX_BATCH_WRITES
+
+# Firestore's limit on the values of an 'in' filter, and Auth's on get_users identifiers
+MAX_IN_VALUES = 30
+MAX_GET_USERS = 100
+LIST_USERS_PAGE = 1000
+
+# Fields filtered with '==' / 'in' get an expression index, like Firestore's single-field indexes
+INDEXED_FIELDS = ['user_id', 'action', 'from_uid', 'to_uid', 'username']
+
+DOCUMENT_ID = '__name__'
+ASCENDING = 'ASCENDING'
+DESCENDING = 'DESCENDING'
+
+_OPS = {
+    '==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+    'in': lambda value, values: value in values,
+    'not-in': lambda value, values: value not in values,
+    'array_contains': lambda value, item: isinstance(value, list) and item in value,
+}
+
+
+class NotFound(Exception):
+    """update() of a missing document."""
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Unsupported field value: {value!r}")
+
+
+def _decode(d):
+    if len(d) == 1 and '__datetime__' in d:
+        return datetime.fromisoformat(d['__datetime__'])
+    return d
+
+
+def _dumps(data):
+    return json.dumps(data, default=_encode)
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode) if text is not None else None
+
+
+# --- FIRESTORE ---
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+
+class DocumentReference:
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self.collection}/{self.id}"
+
+    def get(self):
+        self.store._rpc(reads=1)
+        return DocumentSnapshot(self, self.store._read(self.collection, self.id))
+
+    def set(self, data, merge=False):
+        self.store._rpc(writes=1)
+        self.store._commit([('set', self, data, merge)])
+
+    def update(self, data):
+        self.store._rpc(writes=1)
+        self.store._commit([('update', self, data, False)])
+
+    def delete(self):
+        self.store._rpc(writes=1)
+        self.store._commit([('delete', self, None, False)])
+
+
+class Query:
+    def __init__(self, store, collection, filters=(), orders=(), limit=None, cursor=None):
+        self.store = store
+        self.collection = collection
+        self.filters = tuple(filters)
+        self.orders = tuple(orders)
+        self._limit = limit
+        self.cursor = cursor
+
+    def _copy(self, **changes):
+        args = dict(filters=self.filters, orders=self.orders, limit=self._limit, cursor=self.cursor)
+        args.update(changes)
+        return Query(self.store, self.collection, **args)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPS:
+            raise ValueError(f"Unsupported operator: {op_string}")
+        if op_string in ('in', 'not-in') and len(value) > MAX_IN_VALUES:
+            raise ValueError(f"'{op_string}' filters support at most {MAX_IN_VALUES} values")
+        return self._copy(filters=self.filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self.orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(cursor=snapshot)
+
+    def _sort_key(self, doc_id, data):
+        return [doc_id if field == DOCUMENT_ID else data.get(field) for field, _ in self.orders]
+
+    def _matches(self, data):
+        for field, op, value in self.filters:
+            # Like Firestore, a document without the field never matches
+            if field not in data:
+                return False
+            try:
+                if not _OPS[op](data[field], value):
+                    return False
+            except TypeError:
+                return False
+        return all(field == DOCUMENT_ID or field in data for field, _ in self.orders)
+
+    def _after_cursor(self, doc_id, data, cursor_key, cursor_id):
+        for value, cursor_value, (_, direction) in zip(self._sort_key(doc_id, data), cursor_key, self.orders):
+            if value != cursor_value:
+                return value > cursor_value if direction == ASCENDING else value < cursor_value
+        return doc_id > cursor_id
+
+    def stream(self):
+        docs = [(doc_id, data) for doc_id, data in self.store._select(self.collection, self.filters)
+                if self._matches(data)]
+
+        # Ordered by the order_by fields, then by document id (Firestore's default order)
+        docs.sort(key=lambda doc: doc[0])
+        for field, direction in reversed(self.orders):
+            if field == DOCUMENT_ID:
+                docs.sort(key=lambda doc: doc[0], reverse=direction == DESCENDING)
+            else:
+                docs.sort(key=lambda doc: doc[1][field], reverse=direction == DESCENDING)
+
+        if self.cursor is not None:
+            cursor_data = self.cursor.to_dict() or {}
+            cursor_key = self._sort_key(self.cursor.id, cursor_data)
+            docs = [doc for doc in docs if self._after_cursor(doc[0], doc[1], cursor_key, self.cursor.id)]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+
+        # Queries are billed at least one read
+        self.store._rpc(reads=max(1, len(docs)))
+        return iter([DocumentSnapshot(DocumentReference(self.store, self.collection, doc_id), data)
+                     for doc_id, data in docs])
+
+    def get(self):
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, store, collection):
+        super().__init__(store, collection)
+
+    def document(self, document_id=None):
+        return DocumentReference(self.store, self.collection, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class WriteBatch:
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, reference, data, merge=False):
+        self.writes.append(('set', reference, data, merge))
+
+    def update(self, reference, data):
+        self.writes.append(('update', reference, data, False))
+
+    def delete(self, reference):
+        self.writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        if len(self.writes) > MAX_BATCH_WRITES:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_WRITES} writes")
+        self.store._rpc(writes=len(self.writes))
+        self.store._commit(self.writes)
+        self.writes = []
+
+
+class LocalStore:
+    """
+    Firestore client stand-in. `path` is ':memory:' or a SQLite file; `latency` is the
+    mean seconds slept per call, spread uniformly by +/- `jitter` (a fraction).
+    """
+
+    def __init__(self, path=':memory:', latency=0.0, jitter=0.5):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            if path != ':memory:':
+                # Readers in other workers don't block on writers
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute('PRAGMA busy_timeout=5000')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS docs ('
+                              'collection TEXT, id TEXT, data TEXT, PRIMARY KEY (collection, id))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS auth_users ('
+                              'uid TEXT PRIMARY KEY, email TEXT UNIQUE, display_name TEXT)')
+            for field in INDEXED_FIELDS:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS docs_{field} "
+                                  f"ON docs (collection, json_extract(data, '$.{field}'))")
+
+        self.stats_lock = threading.Lock()
+        self.stats = {'calls': 0, 'reads': 0, 'writes': 0}
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def _rpc(self, reads=0, writes=0):
+        """Counts one round trip and sleeps for its latency (outside any lock, so calls overlap)."""
+        with self.stats_lock:
+            self.stats['calls'] += 1
+            self.stats['reads'] += reads
+            self.stats['writes'] += writes
+        if self.latency:
+            time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    # --- Client API ---
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references):
+        references = list(references)
+        self._rpc(reads=len(references))
+        return [DocumentSnapshot(ref, self._read(ref.collection, ref.id)) for ref in references]
+
+    # --- SQLite ---
+
+    def _read(self, collection, doc_id):
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM docs WHERE collection = ? AND id = ?',
+                                    (collection, doc_id)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def _select(self, collection, filters):
+        """Candidate (id, data) rows; '==' and 'in' filters on scalars are done in SQL."""
+        sql = 'SELECT id, data FROM docs WHERE collection = ?'
+        params = [collection]
+        for field, op, value in filters:
+            values = [value] if op == '==' else list(value) if op == 'in' else None
+            if values and field != DOCUMENT_ID and all(isinstance(v, (str, int, float)) for v in values):
+                sql += f" AND json_extract(data, ?) IN ({', '.join('?' * len(values))})"
+                params += [f'$.{field}'] + values
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [(doc_id, _loads(data)) for doc_id, data in rows]
+
+    def _commit(self, writes):
+        """Applies (op, ref, data, merge) writes in one transaction."""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for op, ref, data, merge in writes:
+                    key = (ref.collection, ref.id)
+                    if op == 'delete':
+                        self.conn.execute('DELETE FROM docs WHERE collection = ? AND id = ?', key)
+                        continue
+                    if op == 'update' or merge:
+                        row = self.conn.execute('SELECT data FROM docs WHERE collection = ? AND id = ?', key).fetchone()
+                        if row is None and op == 'update':
+                            raise NotFound(f"No document to update: {ref.path}")
+                        data = dict(_loads(row[0]) if row else {}, **data)
+                    self.conn.execute('INSERT OR REPLACE INTO docs (collection, id, data) VALUES (?, ?, ?)',
+                                      key + (_dumps(data),))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+
+# --- AUTH ---
+
+class UserNotFoundError(Exception):
+    pass
+
+
+class UidIdentifier:
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class UserRecord:
+    def __init__(self, uid, email, display_name):
+        self.uid = uid
+        self.email = email
+        self.display_name = display_name
+
+
+class GetUsersResult:
+    def __init__(self, users, not_found):
+        self.users = users
+        self.not_found = not_found
+
+
+class ListUsersPage:
+    def __init__(self, users):
+        self.users = users
+
+    def iterate_all(self):
+        return iter(self.users)
+
+
+class LocalAuth:
+    """Firebase Auth stand-in over the store's 'auth_users' table (same latency and stats)."""
+
+    UidIdentifier = UidIdentifier
+    UserNotFoundError = UserNotFoundError
+
+    def __init__(self, store):
+        self.store = store
+
+    def _query(self, sql, params=()):
+        with self.store.lock:
+            return [UserRecord(*row) for row in self.store.conn.execute(sql, params).fetchall()]
+
+    def create_user(self, uid=None, email=None, display_name=None):
+        uid = uid or uuid.uuid4().hex[:28]
+        self.store._rpc(writes=1)
+        with self.store.lock:
+            self.store.conn.execute('INSERT INTO auth_users (uid, email, display_name) VALUES (?, ?, ?)',
+                                    (uid, email, display_name))
+        return UserRecord(uid, email, display_name)
+
+    def get_user(self, uid):
+        self.store._rpc(reads=1)
+        users = self._query('SELECT uid, email, display_name FROM auth_users WHERE uid = ?', (uid,))
+        if not users:
+            raise UserNotFoundError(f"No user record found for uid: {uid}")
+        return users[0]
+
+    def get_user_by_email(self, email):
+        self.store._rpc(reads=1)
+        users = self._query('SELECT uid, email, display_name FROM auth_users WHERE email = ?', (email,))
+        if not users:
+            raise UserNotFoundError(f"No user record found for email: {email}")
+        return users[0]
+
+    def get_users(self, identifiers):
+        if len(identifiers) > MAX_GET_USERS:
+            raise ValueError(f"get_users takes at most {MAX_GET_USERS} identifiers")
+        uids = [identifier.uid for identifier in identifiers]
+        self.store._rpc(reads=len(uids))
+        users = self._query(f"SELECT uid, email, display_name FROM auth_users WHERE uid IN ({', '.join('?' * len(uids))})",
+                            uids) if uids else []
+        found = {user.uid for user in users}
+        return GetUsersResult(users, [identifier for identifier in identifiers if identifier.uid not in found])
+
+    def list_users(self):
+        """All users at once; paged like the Admin SDK for the latency/stats accounting."""
+        users = self._query('SELECT uid, email, display_name FROM auth_users ORDER BY uid')
+        for _ in range(max(1, -(-len(users) // LIST_USERS_PAGE))):
+            self.store._rpc(reads=LIST_USERS_PAGE)
+        return ListUsersPage(users)
+
+
+# --- SYNTHETIC DATA ---
+
+def generate_synthetic_data(store, n_users=200, n_books=2000, swipes_per_user=40,
+                            friends_per_user=5, seed=0):
+    """
+    Fills the store with `n_books` synthetic books, `n_users` users (Auth records plus
+    'users' profiles with genre preferences), Zipf-distributed swipes and a random
+    friendship graph (mostly accepted, some pending). User ids are 'user0', 'user1', ...
+    """
+    # Reuses the benchmark's catalog generator (books with neighbor structure)
+    from benchmark_model import synthetic_books, GENRES
+
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    writes = []
+
+    # 1. Books, stored like the real 'books' documents (ISBN ids, 'synopsis', 'coverImage')
+    books = synthetic_books(n_books, seed=seed)
+    for book in books:
+        data = {'title': book['title'], 'author': book['author'], 'genres': book['genres'],
+                'synopsis': book['description'], 'coverImage': book['image_url']}
+        writes.append(('set', DocumentReference(store, 'books', book['book_id']), data, False))
+
+    # 2. Users
+    uids = [f"user{i}" for i in range(n_users)]
+    auth_users = []
+    for uid in uids:
+        username = f"reader{uid[len('user'):]}"
+        auth_users.append((uid, f"{uid}@example.com", username))
+        profile = {'username': username, 'email': f"{uid}@example.com", 'age': rnd.randint(16, 70),
+                   'genres': rnd.sample(GENRES, rnd.randint(1, 4)), 'frequency': 'weekly',
+                   'preferencesDone': True}
+        writes.append(('set', DocumentReference(store, 'users', uid), profile, False))
+
+    # 3. Swipes: popular books are swiped far more often
+    book_ids = [book['book_id'] for book in books]
+    weights = [1.0 / (i + 1) for i in range(len(book_ids))]
+    for uid in uids:
+        swiped = set(rnd.choices(book_ids, weights, k=swipes_per_user))
+        for book_id in swiped:
+            swipe = {'user_id': uid, 'book_id': book_id, 'action': rnd.choice(['like', 'like', 'dislike']),
+                     'timestamp': now - timedelta(minutes=rnd.randint(0, 60 * 24 * 90))}
+            writes.append(('set', DocumentReference(store, 'swipes', f"{uid}_{book_id}"), swipe, False))
+
+    # 4. Friendships
+    pairs = set()
+    for uid in uids:
+        for other in rnd.sample(uids, min(friends_per_user, len(uids))):
+            if other != uid and (other, uid) not in pairs:
+                pairs.add((uid, other))
+    for from_uid, to_uid in sorted(pairs):
+        friendship = {'from_uid': from_uid, 'to_uid': to_uid,
+                      'status': 'accepted' if rnd.random() < 0.8 else 'pending',
+                      'timestamp': now - timedelta(days=rnd.randint(0, 90))}
+        doc_id = f"{rnd.getrandbits(80):020x}"
+        writes.append(('set', DocumentReference(store, 'friendships', doc_id), friendship, False))
+
+    # Written directly, without the per-call latency
+    store._commit(writes)
+    with store.lock:
+        store.conn.executemany('INSERT OR REPLACE INTO auth_users (uid, email, display_name) VALUES (?, ?, ?)',
+                               auth_users)
+    print(f"Generated {n_books} books, {n_users} users, "
+          f"{sum(1 for w in writes if w[1].collection == 'swipes')} swipes and {len(pairs)} friendships.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="SQLite file to create (use it with LOCAL_STORE_PATH)")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--swipes-per-user', type=int, default=40)
+    parser.add_argument('--friends-per-user', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    store = LocalStore(args.path)
+    generate_synthetic_data(store, args.users, args.books, args.swipes_per_user,
+                            args.friends_per_user, args.seed)
+
+
+if __name__ == "__main__":
+    main()
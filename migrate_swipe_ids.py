@@ -0,0 +1,166 @@
+# migrate_swipe_ids.py
+"""
+One-off migration of the 'swipes' collection to deterministic document ids.
+Swipes used to be saved with add() (auto ids, possibly several per user and book);
+they are now keyed '{user_id}_{book_id}'. This pages through the collection by
+document id and, for every auto-id swipe, writes its data under the deterministic
+id (keeping only the newest swipe per user and book) and deletes the old document,
+in WriteBatch commits of up to 500 operations. The writes carry preconditions - the
+deterministic doc is created, or updated only if unchanged since it was read, and
+old docs are deleted only if unchanged - so a swipe saved or removed by the app
+meanwhile fails the batch instead of being overwritten; the affected swipes are
+then read again and retried. Safe to re-run; documents that already have their
+deterministic id are left alone. When it has finished, it writes the
+SWIPE_MIGRATION_MARKER doc, after which the app stops looking for auto-id
+duplicates on unlike.
+
+Usage: python migrate_swipe_ids.py [--dry-run] [--page-size 1000]
+"""
+
+import argparse
+import sys
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+
+from write_buffer import MAX_BATCH_WRITES
+
+PAGE_SIZE = 1000
+# Commits of one group of swipes before giving up; each conflict means the app wrote one of them
+MAX_ATTEMPTS = 5
+# Raised by a commit whose preconditions no longer hold
+CONFLICTS = (google_exceptions.Conflict, google_exceptions.FailedPrecondition, google_exceptions.NotFound)
+
+
+def _chunks(groups):
+    """Splits {target_id: [legacy snapshots]} so each chunk's writes fit in one WriteBatch."""
+    chunk, writes = {}, 0
+    for target_id, legacy in groups.items():
+        if chunk and writes + len(legacy) + 1 > MAX_BATCH_WRITES:
+            yield chunk
+            chunk, writes = {}, 0
+        chunk[target_id] = legacy
+        writes += len(legacy) + 1
+    if chunk:
+        yield chunk
+
+
+def _migrate_group(db, swipes, groups, dry_run, stats, planned):
+    """
+    Moves the newest legacy swipe of each target into place and deletes the legacy docs,
+    in one WriteBatch with preconditions; on a conflict the swipes are read again and the
+    batch retried. `planned` stands in for the targets a dry run would have written.
+    """
+    from firebase_dal import _timestamp_sort_key
+
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            # Legacy docs may have been removed (unlike) since they were read
+            current = {s.id: s for s in db.get_all([s.reference for legacy in groups.values() for s in legacy])
+                       if s.exists}
+            groups = {t: [current[s.id] for s in legacy if s.id in current] for t, legacy in groups.items()}
+            groups = {t: legacy for t, legacy in groups.items() if legacy}
+        targets = {s.id: s for s in db.get_all([swipes.document(t) for t in groups])}
+
+        batch = db.batch()
+        migrated = duplicates = 0
+        for target_id, legacy in groups.items():
+            target = targets[target_id]
+            newest = max(legacy, key=lambda s: _timestamp_sort_key(s.to_dict()))
+            key = _timestamp_sort_key(newest.to_dict())
+            duplicates += len(legacy) - 1
+            if target_id in planned:
+                current_key = planned[target_id]
+            else:
+                current_key = _timestamp_sort_key(target.to_dict()) if target.exists else None
+
+            if current_key is not None and key <= current_key:
+                duplicates += 1
+            elif target.exists:
+                batch.update(target.reference, newest.to_dict(),
+                             option=db.write_option(last_update_time=target.update_time))
+            else:
+                batch.create(target.reference, newest.to_dict())
+            if dry_run:
+                planned[target_id] = max(key, current_key) if current_key is not None else key
+            for snapshot in legacy:
+                batch.delete(snapshot.reference, option=db.write_option(last_update_time=snapshot.update_time))
+            migrated += len(legacy)
+
+        if not dry_run:
+            try:
+                batch.commit()
+            except CONFLICTS as e:
+                print(f"Swipes changed while migrating ({e}); reading them again.")
+                continue
+            stats['batches'] += 1
+        stats['migrated'] += migrated
+        stats['duplicates'] += duplicates
+        return
+    raise RuntimeError(f"Swipes kept changing while migrating; gave up after {MAX_ATTEMPTS} attempts.")
+
+
+def migrate_swipes(db, dry_run=False, page_size=PAGE_SIZE):
+    """Rewrites auto-id swipes to deterministic ids. Returns the counters."""
+    from firebase_dal import swipe_doc_id, SWIPE_MIGRATION_MARKER
+
+    swipes = db.collection('swipes')
+    stats = {'scanned': 0, 'migrated': 0, 'duplicates': 0, 'batches': 0}
+    # Dry run only: deterministic id -> sort key of the swipe that would be stored under it
+    planned = {}
+    last = None
+
+    while True:
+        # 1. Next page in document id order (deleted documents still work as cursors)
+        query = swipes.order_by(firestore.FieldPath.document_id()).limit(page_size)
+        if last is not None:
+            query = query.start_after(last)
+        page = list(query.stream())
+        if not page:
+            break
+        last = page[-1]
+        stats['scanned'] += len(page)
+
+        # 2. Auto-id swipes, grouped by the deterministic id they belong under
+        groups = {}
+        for snapshot in page:
+            data = snapshot.to_dict()
+            target_id = swipe_doc_id(data.get('user_id'), data.get('book_id'))
+            if snapshot.id != target_id:
+                groups.setdefault(target_id, []).append(snapshot)
+
+        # 3. Newest swipe per target wins (against the target doc too); every auto-id doc is deleted
+        for chunk in _chunks(groups):
+            _migrate_group(db, swipes, chunk, dry_run, stats, planned)
+        print(f"Scanned {stats['scanned']} swipes, migrated {stats['migrated']} ({stats['duplicates']} duplicates).")
+
+    # 4. Tell the app there are no auto-id swipes left
+    if not dry_run:
+        collection, doc_id = SWIPE_MIGRATION_MARKER
+        db.collection(collection).document(doc_id).set({'completed_at': datetime.now(timezone.utc), **stats})
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    # Imported here so --help works without Firebase credentials
+    from firebase_dal import db
+
+    print(f"--- Migrating swipe ids{' (dry run)' if args.dry_run else ''} ---")
+    try:
+        stats = migrate_swipes(db, args.dry_run, args.page_size)
+    except Exception as e:
+        print(f"FATAL ERROR during migration: {e}")
+        return False
+    print(f"Migration complete: {stats}")
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
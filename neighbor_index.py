@@ -0,0 +1,272 @@
+# neighbor_index.py
+"""
+Nearest neighbor indexes over the book TF-IDF vectors.
+
+- NeighborGraph: exact top-K neighbors per book. Replaces the dense N x N cosine
+  similarity matrix: only the K most similar books of each row are kept
+  (CSR layout: indptr / int32 indices / float32 scores).
+- IVFIndex: approximate search for large catalogs. TF-IDF vectors are reduced to
+  dense embeddings (truncated SVD) and bucketed by k-means (inverted file), so
+  building never needs an all-pairs pass. Candidates are re-ranked with exact
+  TF-IDF cosine.
+
+Both expose neighbors(idx, k) -> (positions, similarities), most similar first.
+"""
+
+import numpy as np
+from scipy import sparse
+
+DEFAULT_K = 500
+# Upper bound on the size of one dense similarity block (rows x books) while building
+BLOCK_CELLS = 1 << 22
+
+# IVF defaults
+DEFAULT_DIM = 128
+DEFAULT_NPROBE = 16
+# Embedding matches fetched per requested neighbor before the exact re-rank
+DEFAULT_RERANK = 4
+KMEANS_ITERATIONS = 15
+KMEANS_SAMPLE = 50000
+
+
+class NeighborGraph:
+    """Top-K neighbors per book, sorted by descending similarity."""
+
+    kind = 'graph'
+
+    def __init__(self, indptr, indices, scores, k):
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self.k = k
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbors(self, idx, k=None):
+        """Returns (positions, similarities) of the neighbors of row `idx`, most similar first."""
+        start, end = self.indptr[idx], self.indptr[idx + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return self.indices[start:end], self.scores[start:end]
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.scores.nbytes
+
+    def to_dict(self):
+        return {'kind': self.kind, 'indptr': self.indptr, 'indices': self.indices, 'scores': self.scores, 'k': self.k}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['indptr'], data['indices'], data['scores'], data['k'])
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized embeddings.
+    A query scans only the `nprobe` k-means lists whose centroids are closest to it,
+    takes the `rerank` * k best embedding matches and, when the TF-IDF vectors are
+    stored (CSR arrays), re-scores those with exact cosine similarity.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, embeddings, centroids, list_offsets, list_ids, vectors=None,
+                 k=DEFAULT_K, nprobe=DEFAULT_NPROBE, rerank=DEFAULT_RERANK):
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.vectors = vectors
+        self.k = k
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def search(self, query, k=None, nprobe=None):
+        """Returns (positions, similarities) of the approximate top-k matches for an embedding."""
+        k = self.k if k is None else k
+        nprobe = min(self.nprobe if nprobe is None else nprobe, len(self.centroids))
+
+        centroid_sims = self.centroids @ query
+        probe = np.argpartition(-centroid_sims, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe
+        ])
+
+        sims = self.embeddings[candidates] @ query
+        return _top_k(candidates, sims, k)
+
+    def neighbors(self, idx, k=None):
+        """Returns (positions, similarities) of the approximate neighbors of row `idx`, most similar first."""
+        k = self.k if k is None else k
+        if self.vectors is None:
+            return self.search(self.embeddings[idx], k)
+
+        candidates, _ = self.search(self.embeddings[idx], k * self.rerank)
+        sims = (self.vectors[candidates] @ self.vectors[idx].T).toarray().ravel()
+        return _top_k(candidates, sims.astype(np.float32), k)
+
+    @property
+    def nbytes(self):
+        total = self.embeddings.nbytes + self.centroids.nbytes + self.list_offsets.nbytes + self.list_ids.nbytes
+        if self.vectors is not None:
+            total += self.vectors.data.nbytes + self.vectors.indices.nbytes + self.vectors.indptr.nbytes
+        return total
+
+    def to_dict(self):
+        data = {
+            'kind': self.kind, 'embeddings': self.embeddings, 'centroids': self.centroids,
+            'list_offsets': self.list_offsets, 'list_ids': self.list_ids,
+            'k': self.k, 'nprobe': self.nprobe, 'rerank': self.rerank
+        }
+        if self.vectors is not None:
+            data.update({
+                'vectors_data': self.vectors.data, 'vectors_indices': self.vectors.indices,
+                'vectors_indptr': self.vectors.indptr, 'vectors_shape': self.vectors.shape
+            })
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        vectors = None
+        if 'vectors_data' in data:
+            vectors = sparse.csr_matrix(
+                (data['vectors_data'], data['vectors_indices'], data['vectors_indptr']),
+                shape=tuple(data['vectors_shape'])
+            )
+        return cls(data['embeddings'], data['centroids'], data['list_offsets'], data['list_ids'], vectors,
+                   data['k'], data['nprobe'], data['rerank'])
+
+
+def _top_k(candidates, sims, k):
+    """Top-k (candidates, sims) sorted by descending similarity."""
+    if len(candidates) > k:
+        top = np.argpartition(-sims, k - 1)[:k]
+        candidates, sims = candidates[top], sims[top]
+    order = np.argsort(-sims, kind='stable')
+    return candidates[order], sims[order]
+
+
+def load_index(data):
+    """Rebuilds a NeighborGraph or IVFIndex from its to_dict() form."""
+    if data.get('kind', NeighborGraph.kind) == IVFIndex.kind:
+        return IVFIndex.from_dict(data)
+    return NeighborGraph.from_dict(data)
+
+
+def compute_centrality(tfidf_matrix):
+    """
+    Mean cosine similarity of each row to all rows. For L2-normalized vectors
+    mean_j(v_i . v_j) == v_i . mean_j(v_j), so this needs no all-pairs pass.
+    """
+    mean_vector = np.asarray(tfidf_matrix.mean(axis=0)).ravel()
+    return np.asarray(tfidf_matrix @ mean_vector).ravel()
+
+
+def build_neighbor_graph(tfidf_matrix, k=DEFAULT_K):
+    """
+    Computes the top-K cosine neighbors of every row of an L2-normalized TF-IDF matrix,
+    plus each row's mean similarity to the whole catalog (centrality).
+
+    Similarities are computed one block of rows at a time, so peak memory is bounded
+    by BLOCK_CELLS instead of growing with N^2.
+    Returns (NeighborGraph, centrality).
+    """
+    n = tfidf_matrix.shape[0]
+    k = max(1, min(k, n))
+    block_rows = max(1, BLOCK_CELLS // max(n, 1))
+
+    tfidf_t = tfidf_matrix.T.tocsc()
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    centrality = np.empty(n, dtype=np.float64)
+
+    for start in range(0, n, block_rows):
+        end = min(start + block_rows, n)
+        block = (tfidf_matrix[start:end] @ tfidf_t).toarray()
+
+        centrality[start:end] = block.mean(axis=1)
+
+        # Unordered top-K per row, then sort just those K descending
+        if k < n:
+            top = np.argpartition(block, n - k, axis=1)[:, n - k:]
+        else:
+            top = np.tile(np.arange(n), (end - start, 1))
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+
+        indices[start:end] = np.take_along_axis(top, order, axis=1)
+        scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+
+    indptr = np.arange(0, n * k + 1, k, dtype=np.int64)
+    graph = NeighborGraph(indptr, indices.ravel(), scores.ravel(), k)
+    return graph, centrality
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _spherical_kmeans(vectors, n_clusters, seed=0):
+    """k-means on unit vectors using cosine similarity. Returns unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > KMEANS_SAMPLE:
+        sample = vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters with random points
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+def _assign(vectors, centroids):
+    """Closest centroid per vector, computed in blocks to bound memory."""
+    block_rows = max(1, BLOCK_CELLS // max(len(centroids), 1))
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        assignment[start:start + block_rows] = np.argmax(vectors[start:start + block_rows] @ centroids.T, axis=1)
+    return assignment
+
+
+def build_ivf_index(tfidf_matrix, k=DEFAULT_K, dim=DEFAULT_DIM, n_lists=None, nprobe=DEFAULT_NPROBE,
+                    rerank=DEFAULT_RERANK, seed=0):
+    """
+    Reduces TF-IDF vectors to `dim`-dimensional unit embeddings with truncated SVD and
+    builds an IVF index over them with `n_lists` k-means lists (default ~sqrt(N)).
+    The TF-IDF vectors are kept (float32 CSR) for the exact re-rank; pass rerank=0 to skip it.
+    Returns (IVFIndex, centrality); centrality is exact (see compute_centrality).
+    """
+    from sklearn.decomposition import TruncatedSVD
+
+    n = tfidf_matrix.shape[0]
+    dim = max(1, min(dim, n - 1, tfidf_matrix.shape[1] - 1))
+    svd = TruncatedSVD(n_components=dim, random_state=seed)
+    embeddings = _normalize_rows(svd.fit_transform(tfidf_matrix)).astype(np.float32)
+
+    if n_lists is None:
+        n_lists = int(np.sqrt(n))
+    n_lists = max(1, min(n_lists, n))
+
+    centroids = _spherical_kmeans(embeddings, n_lists, seed).astype(np.float32)
+    assignment = _assign(embeddings, centroids)
+
+    list_ids = np.argsort(assignment, kind='stable').astype(np.int32)
+    list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=n_lists), out=list_offsets[1:])
+
+    vectors = sparse.csr_matrix(tfidf_matrix, dtype=np.float32) if rerank else None
+    index = IVFIndex(embeddings, centroids, list_offsets, list_ids, vectors, k, nprobe, max(rerank, 1))
+    return index, compute_centrality(tfidf_matrix)
@@ -0,0 +1,222 @@
+# shared_cache.py
+"""
+Second-level cache shared by every worker process on one host (CACHE_SHARED_PATH).
+Entries are pickled into a SQLite file in WAL mode - put it on /dev/shm to keep it in
+memory - so a value loaded by one gunicorn worker is a hit for the others.
+Every set/delete is also appended to an invalidation log; each process polls the log
+(at most every `poll_interval` seconds) and drops the listed keys from its in-process
+cache, so a swipe handled by worker A doesn't leave worker B serving stale history.
+A load result is written with set(..., since=seq) and skipped if the key was
+invalidated after `seq` (current_seq() when the load started), so a slow load in
+one worker can't overwrite a newer write from another.
+Invalidation records are kept for `retention` seconds, which must be at least the
+longest TTL cached; a process that polls after records it hadn't read were deleted
+gets an 'all' invalidation instead of a partial log.
+No server (Redis etc.) needed.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# Expired entries deleted, and how long invalidation records are kept, per cleanup
+CLEANUP_INTERVAL = 30.0  # seconds
+CLEANUP_BATCH = 500
+LOG_RETENTION = 3600.0  # seconds
+# Bumped when the tables change; an older file is reset on connect
+SCHEMA_VERSION = 2
+
+
+class SharedCache:
+    def __init__(self, path, poll_interval=0.1, timeout=1.0, retention=LOG_RETENTION):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.retention = retention
+
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+        self.last_seq = 0
+        self.last_poll = 0.0
+        self.last_cleanup = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'errors': 0}
+
+    def _connect(self):
+        """Opens this process's connection; a forked child (e.g. gunicorn --preload) reconnects."""
+        if self.conn is not None and self.pid == os.getpid():
+            return self.conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            with conn:
+                conn.execute('DROP TABLE IF EXISTS entries')
+                conn.execute('DROP TABLE IF EXISTS invalidations')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        # stale_at: soft TTL (see CacheManager.get_or_load); expiry: hard TTL
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, stale_at REAL, expiry REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_expiry ON entries (expiry)')
+        # kind is 'key' (target = key), 'user' (target = user_id) or 'all'
+        conn.execute('CREATE TABLE IF NOT EXISTS invalidations ('
+                     'seq INTEGER PRIMARY KEY AUTOINCREMENT, origin INTEGER, kind TEXT, target TEXT, at REAL)')
+        self.conn, self.pid = conn, os.getpid()
+        # Earlier invalidations don't concern a fresh process
+        self.last_seq = self._issued_seq(conn)
+        return conn
+
+    def _run(self, fn, default=None):
+        """Runs fn(conn) under the lock; SQLite errors are logged and return `default` (a miss)."""
+        with self.lock:
+            try:
+                return fn(self._connect())
+            except sqlite3.Error as e:
+                self.stats['errors'] += 1
+                print(f"Shared cache error: {e}")
+                return default
+
+    # --- Entries ---
+
+    def get(self, key):
+        """(value, seconds until expiry, seconds until stale) or None. The value itself may be None."""
+        def read(conn):
+            return conn.execute('SELECT value, stale_at, expiry FROM entries WHERE key = ? AND expiry > ?',
+                                (key, time.time())).fetchone()
+        row = self._run(read)
+        if row is not None:
+            try:
+                value = pickle.loads(row[0])
+            except Exception as e:
+                # e.g. pickled by an older deploy whose classes have changed since
+                print(f"Shared cache can't load '{key}': {e}")
+                row = None
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        now = time.time()
+        return value, row[2] - now, row[1] - now
+
+    def set(self, key, value, ttl, stale_after, since=None):
+        """
+        Stores the entry. With `since` (an invalidation log seq), nothing is written if the key
+        has been invalidated after it; returns False then, else True (None on an SQLite error).
+        """
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            # Still invalidate other processes' copies
+            print(f"Shared cache can't store '{key}': {e}")
+            self.delete(key)
+            return None
+        def write(conn):
+            with conn:
+                # Write lock first, so no invalidation lands between the check and the insert
+                conn.execute('BEGIN IMMEDIATE')
+                if since is not None and self._invalidated_since(conn, key, since):
+                    return False
+                now = time.time()
+                conn.execute('INSERT OR REPLACE INTO entries (key, value, stale_at, expiry) VALUES (?, ?, ?, ?)',
+                             (key, data, now + stale_after, now + ttl))
+                self._log(conn, 'key', key)
+                return True
+        return self._run(write)
+
+    def delete(self, key):
+        def write(conn):
+            with conn:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._log(conn, 'key', key)
+        self._run(write)
+
+    def clear_user(self, user_id):
+        """Deletes every 'user:{user_id}:...' key (an index range scan, ':' + 1 == ';')."""
+        def write(conn):
+            with conn:
+                conn.execute('DELETE FROM entries WHERE key >= ? AND key < ?', (f"user:{user_id}:", f"user:{user_id};"))
+                self._log(conn, 'user', user_id)
+        self._run(write)
+
+    def clear(self):
+        def write(conn):
+            with conn:
+                conn.execute('DELETE FROM entries')
+                self._log(conn, 'all', None)
+        self._run(write)
+
+    # --- Invalidation ---
+
+    def current_seq(self):
+        """Latest invalidation log seq (0 if unavailable), for set(..., since=...)."""
+        return self._run(self._issued_seq, default=0)
+
+    def _issued_seq(self, conn):
+        # AUTOINCREMENT keeps the highest seq ever issued, even once cleanup deleted its row
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'invalidations'").fetchone()
+        return row[0] if row is not None else 0
+
+    def _missed_since(self, conn, seq):
+        """True if records after `seq` were deleted by cleanup before being read."""
+        oldest = conn.execute('SELECT MIN(seq) FROM invalidations').fetchone()[0]
+        if oldest is None:
+            return self._issued_seq(conn) > seq
+        return oldest > seq + 1
+
+    def _invalidated_since(self, conn, key, seq):
+        if self._missed_since(conn, seq):
+            return True
+        parts = key.split(':', 2)
+        user_id = parts[1] if len(parts) == 3 and parts[0] == 'user' else None
+        row = conn.execute(
+            "SELECT 1 FROM invalidations WHERE seq > ? AND "
+            "((kind = 'key' AND target = ?) OR (kind = 'user' AND target = ?) OR kind = 'all') LIMIT 1",
+            (seq, key, user_id)
+        ).fetchone()
+        return row is not None
+
+    def _log(self, conn, kind, target):
+        conn.execute('INSERT INTO invalidations (origin, kind, target, at) VALUES (?, ?, ?, ?)',
+                     (self.pid, kind, target, time.time()))
+
+    def poll(self):
+        """
+        Invalidations from other processes since the last poll, as (kind, target) pairs.
+        Returns [] without touching SQLite when polled again within `poll_interval`, and
+        [('all', None)] if records since the last poll were deleted before being read.
+        """
+        now = time.monotonic()
+        if now - self.last_poll < self.poll_interval:
+            return []
+
+        def read(conn):
+            self.last_poll = now
+            # Read before the rows: anything logged later has a higher seq
+            issued = self._issued_seq(conn)
+            missed = self._missed_since(conn, self.last_seq)
+            rows = conn.execute('SELECT seq, origin, kind, target FROM invalidations WHERE seq > ? ORDER BY seq',
+                                (self.last_seq,)).fetchall()
+            if missed:
+                print(f"Shared cache invalidations after seq {self.last_seq} were cleaned up unread; clearing local cache")
+                invalidations = [('all', None)]
+            else:
+                invalidations = [(kind, target) for _, origin, kind, target in rows if origin != self.pid]
+            self.last_seq = max([issued] + [row[0] for row in rows[-1:]])
+            if now - self.last_cleanup > CLEANUP_INTERVAL:
+                self.last_cleanup = now
+                self._cleanup(conn)
+            return invalidations
+        invalidations = self._run(read, default=[])
+        self.stats['invalidations'] += len(invalidations)
+        return invalidations
+
+    def _cleanup(self, conn):
+        wall = time.time()
+        with conn:
+            conn.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries WHERE expiry <= ? LIMIT ?)',
+                         (wall, CLEANUP_BATCH))
+            conn.execute('DELETE FROM invalidations WHERE at < ?', (wall - self.retention,))
+
+    def metrics(self):
+        return dict(self.stats)
@@ -29,23 +29,35 @@ document.getElementById("logoutBtn").addEventListener("click", () => {
 });
 
 // SEARCH USERS
-document.getElementById("userSearchInput").placeholder = "Search by full email address..."; // Added this line
-document.getElementById("searchBtn").addEventListener("click", async () => {
+const TYPEAHEAD_MIN_CHARS = 3;
+const TYPEAHEAD_DELAY = 150; // ms of no typing before searching
+let typeaheadTimer = null;
+let searchSeq = 0; // Ignore responses to older queries
+
+document.getElementById("userSearchInput").placeholder = "Search by email or username...";
+document.getElementById("searchBtn").addEventListener("click", () => {
     const query = document.getElementById("userSearchInput").value.trim();
     if (!query) return;
+    searchUsers(query, false);
+});
 
-    // Check if it looks like an email - REMOVED to allow name search
-    // if (!query.includes('@')) {
-    //     alert("Please enter a valid email address.");
-    //     return;
-    // }
+// Typeahead: prefix search served from the server's in-memory user directory
+document.getElementById("userSearchInput").addEventListener("input", (e) => {
+    clearTimeout(typeaheadTimer);
+    const query = e.target.value.trim();
+    if (query.length < TYPEAHEAD_MIN_CHARS) return;
+    typeaheadTimer = setTimeout(() => searchUsers(query, true), TYPEAHEAD_DELAY);
+});
 
+async function searchUsers(query, typeahead) {
+    const seq = ++searchSeq;
     const resultsContainer = document.getElementById("searchResults");
-    resultsContainer.innerHTML = "Searching...";
+    if (!typeahead) resultsContainer.innerHTML = "Searching...";
 
     try {
-        const res = await fetch(`/api/users/search?q=${encodeURIComponent(query)}`);
+        const res = await fetch(`/api/users/search?q=${encodeURIComponent(query)}${typeahead ? '&typeahead=1' : ''}`);
         const users = await res.json();
+        if (seq !== searchSeq) return;
 
         if (users.length === 0) {
             resultsContainer.innerHTML = "No users found.";
@@ -67,9 +79,9 @@ document.getElementById("searchBtn").addEventListener("click", async () => {
 
     } catch (e) {
         console.error(e);
-        resultsContainer.innerHTML = "Error searching users.";
+        if (seq === searchSeq) resultsContainer.innerHTML = "Error searching users.";
     }
-});
+}
 
 // SEND REQUEST
 window.sendRequest = async (toUid) => {
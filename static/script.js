@@ -34,11 +34,22 @@ const likedByEl = document.getElementById("likedByContainer");
 const moveDistance = 500; // Move further off-screen for a clear swipe
 const animationDuration = 500; // 0.5 seconds
 
+// --- Card queue configuration ---
+const BATCH_SIZE = 10; // Cards fetched per rerank
+const LOW_WATER = 3; // Rerank when this few cards are left in the queue
+
 // --- State Management ---
 let isSwiping = false; // Prevent rapid key presses from crashing the script
 let touchStartX = 0;
 let touchEndX = 0;
 
+// Upcoming cards, best first. Swipes are rendered from here immediately and
+// sent to the server in the background, one at a time and in order.
+let cardQueue = [];
+const seenBooks = new Set(); // Every book shown on this page (never re-queued)
+let swipeChain = Promise.resolve();
+let pendingRequests = 0;
+
 // --- Auth Listener ---
 onAuthStateChanged(auth, (user) => {
     if (user) {
@@ -49,6 +60,10 @@ onAuthStateChanged(auth, (user) => {
         const navSwipe = document.getElementById("navSwipe");
         if (navSwipe) navSwipe.href = `/recommendation?user_id=${user.uid}`;
 
+        // Prefetch the cards after the server-rendered one
+        seenBooks.add(bookCard.dataset.bookId);
+        enqueueRequest(() => fetchBatch());
+
     } else {
         console.log("User not authenticated. Redirecting to login...");
         window.location.href = "/"; // Redirect to login if not authenticated
@@ -66,46 +81,130 @@ if (logoutBtn) {
 }
 
 // --- FUNCTION: Send Swipe Data to Flask ---
-async function sendSwipe(action) {
+// Shows the next queued card as soon as the swipe animation ends and saves the
+// swipe in the background. The queue is reranked only when it runs low or the
+// swipe is a like (which changes the liked authors/series used for scoring).
+function sendSwipe(action) {
     const currentBookId = bookCard.dataset.bookId;
 
-    if (currentBookId === 'DONE') {
-        console.log("No more recommendations. Ignoring swipe.");
+    if (currentBookId === 'DONE' || currentBookId === 'LOADING') {
+        console.log("No card to swipe. Ignoring swipe.");
+        isSwiping = false;
         return;
     }
 
     if (!currentUser) {
         alert("Please log in to swipe.");
+        isSwiping = false;
         return;
     }
 
-    try {
-        const response = await fetch('/api/swipe', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                book_id: currentBookId,
-                action: action,
-                user_id: currentUser.uid
-            })
+    const rerank = action === 'like' || cardQueue.length <= LOW_WATER;
+    enqueueRequest(() => postSwipe(currentBookId, action, rerank));
+
+    setTimeout(() => {
+        showNextCard();
+        isSwiping = false; // Allow the next swipe
+    }, animationDuration);
+}
+
+// Runs server requests one after another, so swipes are saved in order and
+// every rerank sees all the earlier swipes in the user's history.
+function enqueueRequest(request) {
+    pendingRequests++;
+    swipeChain = swipeChain
+        .then(request)
+        .catch((error) => {
+            console.error('Error during swipe API call:', error);
+            if (bookCard.dataset.bookId === 'LOADING') {
+                alert('Could not connect to the server or Firebase.');
+            }
+        })
+        .finally(() => {
+            pendingRequests--;
+            if (bookCard.dataset.bookId === 'LOADING') showNextCard();
         });
+}
 
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
+// Ids the server should skip: the card on screen, plus the queue when appending to it
+function excludedIds(replace) {
+    const ids = [bookCard.dataset.bookId];
+    if (!replace) cardQueue.forEach((book) => ids.push(book.book_id));
+    return ids;
+}
 
-        const data = await response.json();
-        updateBookCard(data);
+async function postJson(url, body) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
 
-    } catch (error) {
-        console.error('Error during swipe API call:', error);
-        alert('Could not connect to the server or Firebase.');
-    } finally {
-        isSwiping = false; // Allow the next swipe
-        console.log("Swipe complete. isSwiping reset to false.");
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return response.json();
+}
+
+async function postSwipe(bookId, action, rerank) {
+    const replace = action === 'like';
+    const data = await postJson('/api/swipe', {
+        book_id: bookId,
+        action: action,
+        user_id: currentUser.uid,
+        recommend: rerank,
+        count: rerank ? BATCH_SIZE : 0,
+        exclude: rerank ? excludedIds(replace) : []
+    });
+
+    if (rerank) refillQueue(data.books, replace);
+}
+
+async function fetchBatch() {
+    const data = await postJson('/api/next_batch', {
+        book_id: bookCard.dataset.bookId,
+        user_id: currentUser.uid,
+        count: BATCH_SIZE,
+        exclude: excludedIds(false)
+    });
+    refillQueue(data.books, false);
+}
+
+// Replaces the queue with a fresh ranking (after a like) or appends to it
+function refillQueue(books, replace) {
+    const fresh = (books || []).filter((book) => !seenBooks.has(book.book_id));
+    if (replace) {
+        cardQueue = fresh;
+    } else {
+        const queued = new Set(cardQueue.map((book) => book.book_id));
+        cardQueue.push(...fresh.filter((book) => !queued.has(book.book_id)));
+    }
+
+    if (bookCard.dataset.bookId === 'LOADING') showNextCard();
+}
+
+// Renders the next queued card; waits for in-flight requests before giving up
+function showNextCard() {
+    const next = cardQueue.shift();
+    if (next) {
+        updateBookCard(next);
+    } else if (pendingRequests > 0) {
+        showLoadingCard();
+    } else {
+        updateBookCard({ book_id: 'DONE', title: 'No More Recommendations!', description: 'You have swiped all related books.' });
     }
 }
 
+function showLoadingCard() {
+    bookCard.dataset.bookId = 'LOADING';
+    titleEl.textContent = 'Loading...';
+    descriptionEl.textContent = '';
+    scoreEl.textContent = '';
+    authorEl.textContent = '';
+    imageEl.src = '';
+    if (likedByEl) likedByEl.textContent = '';
+}
+
 
 // --- FUNCTION: Update the card with the next book's details ---
 function updateBookCard(data) {
@@ -123,6 +222,7 @@ function updateBookCard(data) {
 
     // 2. Update the card with the new book's details
     bookCard.dataset.bookId = data.book_id; // Set the next book ID
+    seenBooks.add(data.book_id);
     titleEl.textContent = data.title;
     descriptionEl.textContent = data.description;
     authorEl.textContent = data.author || 'Unknown Author';
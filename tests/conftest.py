@@ -0,0 +1,13 @@
+# tests/conftest.py
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Tests never talk to Firebase: importing firebase_dal (e.g. via app) uses the local stand-in
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+os.environ.setdefault('LOCAL_STORE_USERS', '5')
+os.environ.setdefault('LOCAL_STORE_BOOKS', '50')
@@ -0,0 +1,159 @@
+# tests/test_cache_manager.py
+"""
+CacheManager.get_or_load: coalescing of concurrent misses, loads that race a write,
+and (on a fake clock) stale-while-revalidate and negative caching.
+"""
+
+import threading
+import time
+
+import pytest
+
+import cache_manager
+from cache_manager import CacheManager
+from shared_cache import SharedCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Loader:
+    """Returns the queued results in turn (raising exceptions), counting calls."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_manager, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # One refresh thread, so wait_for_refreshes() waits for every queued refresh
+    monkeypatch.setattr(cache_manager, 'REFRESH_WORKERS', 1)
+    cache = CacheManager(shards=2)
+    yield cache
+    cache.refresher.shutdown(wait=True)
+
+
+def wait_for_refreshes(cache):
+    cache.refresher.submit(lambda: None).result(timeout=5)
+
+
+def test_stale_hit_refreshes_once_in_background(cache, clock):
+    loader = Loader('v1', 'v2')
+    assert cache.get_or_load('k', loader, ttl=60, stale_after=10) == 'v1'
+
+    clock.now += 11
+    loader.release.clear()
+    # Stale hits return the old value at once; only one reload runs
+    assert [cache.get_or_load('k', loader, ttl=60, stale_after=10) for _ in range(5)] == ['v1'] * 5
+    loader.release.set()
+    wait_for_refreshes(cache)
+
+    assert loader.calls == 2
+    assert cache.get_or_load('k', loader, ttl=60, stale_after=10) == 'v2'
+    assert loader.calls == 2
+
+
+def test_failed_refresh_keeps_old_value(cache, clock):
+    loader = Loader('v1', RuntimeError('unavailable'))
+    assert cache.get_or_load('k', loader, ttl=60, stale_after=10) == 'v1'
+
+    clock.now += 11
+    assert cache.get_or_load('k', loader, ttl=60, stale_after=10) == 'v1'
+    wait_for_refreshes(cache)
+
+    assert loader.calls == 2
+    assert cache.get('k') == 'v1'
+    # Until the hard TTL
+    clock.now += 50
+    assert cache.get('k') is None
+
+
+def test_none_result_cached_for_negative_ttl(cache, clock):
+    loader = Loader(None, 'created')
+    assert cache.get_or_load('k', loader, ttl=60, negative_ttl=5) is None
+    assert cache.get_or_load('k', loader, ttl=60, negative_ttl=5) is None
+    assert loader.calls == 1
+
+    clock.now += 6
+    assert cache.get_or_load('k', loader, ttl=60, negative_ttl=5) == 'created'
+    assert loader.calls == 2
+    # The real value gets the full TTL
+    clock.now += 30
+    assert cache.get_or_load('k', loader, ttl=60, negative_ttl=5) == 'created'
+    assert loader.calls == 2
+
+
+def test_concurrent_misses_load_once(cache):
+    loader = Loader('v1')
+    loader.release.clear()
+    barrier = threading.Barrier(17)
+    results = []
+
+    def miss():
+        barrier.wait(5)
+        # ttl=0 caches nothing, so a thread arriving after the load would load again
+        results.append(cache.get_or_load('k', loader, ttl=0))
+
+    threads = [threading.Thread(target=miss) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    barrier.wait(5)
+    # Let every thread join the load in progress before it finishes
+    time.sleep(0.2)
+    loader.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['v1'] * 16
+    assert loader.calls == 1
+
+
+def test_delete_during_load_is_not_overwritten(tmp_path):
+    shared = SharedCache(str(tmp_path / 'cache.sqlite'), poll_interval=0)
+    cache = CacheManager(shards=2, shared=shared)
+    writes = []
+    shared_set = shared.set
+
+    def record_set(*args, **kwargs):
+        stored = shared_set(*args, **kwargs)
+        writes.append((kwargs.get('since'), stored))
+        return stored
+
+    shared.set = record_set
+
+    def loader():
+        # The key is written (here: deleted) after the load read its data
+        cache.delete('user:u1:swipes')
+        return 'old'
+
+    assert cache.get_or_load('user:u1:swipes', loader, ttl=60) == 'old'
+
+    # The shared write was made conditional and skipped, and nothing is kept locally
+    assert len(writes) == 1 and writes[0][0] is not None and writes[0][1] is False
+    assert cache._shard('user:u1:swipes').get('user:u1:swipes') is None
+    assert shared.get('user:u1:swipes') is None
+    assert cache.get('user:u1:swipes') is None
+    cache.refresher.shutdown()
@@ -0,0 +1,45 @@
+# tests/test_genre_index.py
+"""
+split_genres / GenreIndex on the shapes a book's 'genres' field comes in, against the
+original substring check of the preference score (kept below as `reference_score`).
+"""
+
+import numpy as np
+import pytest
+
+from book_index import GenreIndex, split_genres
+
+GENRE_VALUES = [
+    ['Fantasy', 'Fiction'],
+    'Fantasy, Fiction',
+    "['Fantasy', 'Fiction']",
+    '["Fantasy", "Fiction"]',
+    "['Fantasy']",
+    'Fantasy; Fiction | Young Adult',
+]
+
+
+def reference_score(value, user_genres):
+    """The original check: the fraction of user genres contained in the lowercased genres string."""
+    genres_str = str(value).lower()
+    return sum(genre.lower() in genres_str for genre in user_genres) / len(user_genres)
+
+
+@pytest.mark.parametrize('value', GENRE_VALUES)
+def test_list_shapes_split_into_clean_terms(value):
+    terms = split_genres(value)
+    assert terms[0] == 'fantasy'
+    assert all(term.strip('[]\'" ') == term for term in terms)
+
+
+def test_stringified_list_matches_like_reference():
+    user_genres = ['fantasy', 'fiction', 'romance']
+    index = GenreIndex(GENRE_VALUES)
+    expected = [reference_score(value, user_genres) for value in GENRE_VALUES]
+    assert index.scores(user_genres).tolist() == pytest.approx(expected)
+
+
+def test_stringified_and_real_lists_share_terms():
+    index = GenreIndex([['Science Fiction', 'Classics'], "['Science Fiction', 'Classics']"])
+    assert index.vocabulary == ['science fiction', 'classics']
+    assert np.array_equal(index.matrix[0].toarray(), index.matrix[1].toarray())
@@ -0,0 +1,266 @@
+# tests/test_migrate_swipe_ids.py
+"""
+migrate_swipe_ids against a fake Firestore collection (with update times and write
+preconditions), and the auto-id fallback of remove_user_swipe on the local store.
+"""
+
+import itertools
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import firebase_dal
+import migrate_swipe_ids
+from firebase_dal import SWIPE_MIGRATION_MARKER, swipe_doc_id
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+# --- Fake Firestore ---
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeRef:
+    def __init__(self, db, collection, doc_id):
+        self.db = db
+        self.collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self):
+        return self.db.snapshot(self)
+
+    def set(self, data):
+        self.db.write(self, data)
+
+
+class FakeQuery:
+    def __init__(self, db, collection, limit=None, after=None):
+        self.db = db
+        self.collection = collection
+        self._limit = limit
+        self.after = after
+
+    def order_by(self, field_path):
+        return self
+
+    def limit(self, count):
+        return FakeQuery(self.db, self.collection, count, self.after)
+
+    def start_after(self, snapshot):
+        return FakeQuery(self.db, self.collection, self._limit, snapshot.id)
+
+    def stream(self):
+        ids = sorted(doc_id for (collection, doc_id) in self.db.docs if collection == self.collection)
+        ids = [doc_id for doc_id in ids if self.after is None or doc_id > self.after][:self._limit]
+        return iter([self.db.snapshot(FakeRef(self.db, self.collection, doc_id)) for doc_id in ids])
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id):
+        return FakeRef(self.db, self.collection, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def create(self, reference, data):
+        self.writes.append(('create', reference, data, None))
+
+    def update(self, reference, data, option=None):
+        self.writes.append(('update', reference, data, option))
+
+    def delete(self, reference, option=None):
+        self.writes.append(('delete', reference, None, option))
+
+    def commit(self):
+        if self.db.before_commit:
+            self.db.before_commit.pop(0)()
+        # All or nothing, like a WriteBatch
+        for op, ref, _, option in self.writes:
+            current = self.db.docs.get((ref.collection, ref.id))
+            if op == 'create' and current is not None:
+                raise google_exceptions.AlreadyExists(ref.path)
+            if op == 'update' and current is None:
+                raise google_exceptions.NotFound(ref.path)
+            if option is not None and (current is None or current[1] != option['last_update_time']):
+                raise google_exceptions.FailedPrecondition(ref.path)
+        for op, ref, data, _ in self.writes:
+            if op == 'delete':
+                del self.db.docs[(ref.collection, ref.id)]
+            else:
+                self.db.write(ref, data)
+        self.db.commits += 1
+
+
+class FakeDb:
+    def __init__(self):
+        # (collection, id) -> (data, update_time)
+        self.docs = {}
+        self.clock = itertools.count(1)
+        self.commits = 0
+        # Callables run (once each) just before the next commits, to simulate app writes
+        self.before_commit = []
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def snapshot(self, reference):
+        data, update_time = self.docs.get((reference.collection, reference.id), (None, None))
+        return FakeSnapshot(reference, data, update_time)
+
+    def get_all(self, references):
+        return [self.snapshot(ref) for ref in references]
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time):
+        return {'last_update_time': last_update_time}
+
+    def write(self, reference, data):
+        self.docs[(reference.collection, reference.id)] = (dict(data), next(self.clock))
+
+    def data(self, collection='swipes'):
+        return {doc_id: data for (c, doc_id), (data, _) in self.docs.items() if c == collection}
+
+
+def swipe(user_id, book_id, minutes, liked=True):
+    return {'user_id': user_id, 'book_id': book_id, 'action': 'like' if liked else 'dislike',
+            'timestamp': T0 + timedelta(minutes=minutes)}
+
+
+@pytest.fixture
+def db():
+    db = FakeDb()
+    swipes = db.collection('swipes')
+    # Three auto-id duplicates of one swipe, newest in the middle
+    swipes.document('auto1').set(swipe('u1', 'b1', 1))
+    swipes.document('auto2').set(swipe('u1', 'b1', 3, liked=False))
+    swipes.document('auto3').set(swipe('u1', 'b1', 2))
+    # An auto-id swipe older than the deterministic doc saved since the deploy
+    swipes.document('auto4').set(swipe('u1', 'b2', 1))
+    swipes.document(swipe_doc_id('u1', 'b2')).set(swipe('u1', 'b2', 5))
+    # A single auto-id swipe, and one already migrated
+    swipes.document('auto5').set(swipe('u2', 'b1', 1))
+    swipes.document(swipe_doc_id('u2', 'b3')).set(swipe('u2', 'b3', 1))
+    return db
+
+
+# --- Migration ---
+
+def test_collapses_duplicates_to_the_newest(db):
+    stats = migrate_swipe_ids.migrate_swipes(db, page_size=2)
+
+    assert db.data() == {
+        swipe_doc_id('u1', 'b1'): swipe('u1', 'b1', 3, liked=False),
+        swipe_doc_id('u1', 'b2'): swipe('u1', 'b2', 5),
+        swipe_doc_id('u2', 'b1'): swipe('u2', 'b1', 1),
+        swipe_doc_id('u2', 'b3'): swipe('u2', 'b3', 1),
+    }
+    assert stats['migrated'] == 5
+    assert stats['duplicates'] == 3
+
+
+def test_rerun_is_idempotent(db):
+    migrate_swipe_ids.migrate_swipes(db)
+    migrated = db.data()
+    commits = db.commits
+
+    stats = migrate_swipe_ids.migrate_swipes(db)
+
+    assert db.data() == migrated
+    assert db.commits == commits
+    assert stats['migrated'] == 0
+
+
+def test_writes_marker_when_done(db):
+    collection, doc_id = SWIPE_MIGRATION_MARKER
+    migrate_swipe_ids.migrate_swipes(db, dry_run=True)
+    assert doc_id not in db.data(collection)
+
+    stats = migrate_swipe_ids.migrate_swipes(db)
+
+    marker = db.data(collection)[doc_id]
+    assert marker['migrated'] == stats['migrated'] == 5
+    assert isinstance(marker['completed_at'], datetime)
+
+
+def test_dry_run_writes_nothing_and_counts_the_same(db):
+    before = dict(db.docs)
+    dry = migrate_swipe_ids.migrate_swipes(db, dry_run=True, page_size=2)
+    assert db.docs == before
+
+    stats = migrate_swipe_ids.migrate_swipes(db, page_size=2)
+    assert {k: dry[k] for k in ('migrated', 'duplicates')} == {k: stats[k] for k in ('migrated', 'duplicates')}
+
+
+def test_live_swipe_during_migration_is_kept(db):
+    # The app saves a newer swipe for u1/b1 after the migration read the deterministic doc
+    live = swipe('u1', 'b1', 10)
+    db.before_commit.append(lambda: db.collection('swipes').document(swipe_doc_id('u1', 'b1')).set(live))
+
+    migrate_swipe_ids.migrate_swipes(db)
+
+    assert db.data()[swipe_doc_id('u1', 'b1')] == live
+    assert not [doc_id for doc_id in db.data() if doc_id.startswith('auto')]
+
+
+def test_unlike_during_migration_is_not_undone(db):
+    # The app removes u2/b1 (the auto-id doc) after the migration read it
+    db.before_commit.append(lambda: db.docs.pop(('swipes', 'auto5')))
+
+    migrate_swipe_ids.migrate_swipes(db)
+
+    assert swipe_doc_id('u2', 'b1') not in db.data()
+    assert swipe_doc_id('u1', 'b1') in db.data()
+
+
+# --- Unlike fallback ---
+
+@pytest.fixture
+def dal(monkeypatch):
+    monkeypatch.setattr(firebase_dal, 'swipe_buffer', None)
+    monkeypatch.setattr(firebase_dal, '_swipe_migration', {'done': False, 'checked_at': None})
+    return firebase_dal
+
+
+def test_unlike_deletes_auto_id_duplicates(dal):
+    swipes = dal.db.collection('swipes')
+    dal._swipe_ref('t1', 'b1').set(swipe('t1', 'b1', 5))
+    swipes.add(swipe('t1', 'b1', 1))
+    swipes.add(swipe('t1', 'b1', 2))
+    swipes.add(swipe('t1', 'b2', 2))
+
+    assert dal.remove_user_swipe('t1', 'b1')
+
+    remaining = [s.to_dict()['book_id'] for s in swipes.where('user_id', '==', 't1').stream()]
+    assert remaining == ['b2']
+
+
+def test_unlike_skips_legacy_query_after_migration(dal):
+    collection, doc_id = SWIPE_MIGRATION_MARKER
+    dal.db.collection(collection).document(doc_id).set({'completed_at': T0})
+    swipes = dal.db.collection('swipes')
+    dal._swipe_ref('t2', 'b1').set(swipe('t2', 'b1', 5))
+    legacy = swipes.add(swipe('t2', 'b1', 1))[1]
+
+    assert dal.remove_user_swipe('t2', 'b1')
+
+    assert not dal._swipe_ref('t2', 'b1').get().exists
+    # Left alone: after the migration there are no auto-id swipes to look for
+    assert legacy.get().exists
+    dal.db.collection(collection).document(doc_id).delete()
@@ -0,0 +1,217 @@
+# tests/test_scoring_parity.py
+"""
+Parity of the vectorized score_candidates / get_recommendations_from_model with the
+original per-row loop (kept below as `reference_scores`) on a small fixture catalog.
+The neighbor graph keeps every book (K >= catalog size), so both see the same candidates.
+"""
+
+import importlib
+
+import numpy as np
+import pytest
+
+import train_model
+
+# (book_id, title, author, genres, description)
+FIXTURE_BOOKS = [
+    ('1', "Harry Potter and the Sorcerer's Stone", 'J.K. Rowling', 'Fantasy, Young Adult', 'A boy wizard goes to a school of magic.'),
+    ('2', 'Harry Potter and the Chamber of Secrets', 'J.K. Rowling', 'Fantasy, Young Adult', 'The wizard returns to school and a hidden chamber.'),
+    ('3', 'Harry Potter and the Prisoner of Azkaban', 'J.K. Rowling', 'Fantasy, Young Adult', 'An escaped prisoner hunts the young wizard.'),
+    ('4', 'Harry Potter', 'Someone Else', 'Biography', 'A biography of a man who shares a famous name.'),
+    ('5', 'Dune', 'Frank Herbert', 'Science Fiction, Classics', 'A desert planet, spice and a noble family.'),
+    ('6', 'Dune Messiah', 'Frank Herbert', 'Science Fiction', 'The emperor of the desert planet faces a conspiracy.'),
+    ('7', 'Children of Dune', 'Frank Herbert', 'Science Fiction', 'The twins of the emperor inherit the desert planet.'),
+    ('8', 'The Hobbit', 'J.R.R. Tolkien', 'Fantasy, Classics, Adventure', 'A hobbit joins dwarves on a quest for a dragon hoard.'),
+    ('9', 'The Fellowship of the Ring', 'J.R.R. Tolkien', 'Fantasy, Classics, Adventure', 'A hobbit carries the ring out of the shire.'),
+    ('10', 'The Two Towers', 'J.R.R. Tolkien', 'Fantasy, Classics', 'The fellowship is broken and war comes to the kingdom.'),
+    ('11', 'The Return of the King', 'J.R.R. Tolkien', 'Fantasy, Classics', 'The ring is destroyed and the king returns.'),
+    ('12', 'Mistborn: The Final Empire', 'Brandon Sanderson', 'Fantasy, Epic Fantasy', 'A thief learns to burn metals against an immortal emperor.'),
+    ('13', 'The Well of Ascension', 'Brandon Sanderson', 'Fantasy, Epic Fantasy', 'The empire falls and mists grow deadly.'),
+    ('14', 'The Way of Kings', 'Brandon Sanderson', 'Fantasy, Epic Fantasy', 'Storms, shardblades and a war on shattered plains.'),
+    ('15', 'Pride and Prejudice', 'Jane Austen', 'Romance, Classics', 'Elizabeth Bennet and the proud Mr. Darcy.'),
+    ('16', 'Sense and Sensibility', 'Jane Austen', 'Romance, Classics', 'Two sisters, love and money in Regency England.'),
+    ('17', 'Emma', 'Jane Austen', 'Romance, Classics', 'A young matchmaker meddles in the love lives of her friends.'),
+    ('18', 'Outlander', 'Diana Gabaldon', 'Romance, Historical Fiction, Fantasy', 'A nurse falls through time into the Scottish highlands.'),
+    ('19', 'Dragonfly in Amber', 'Diana Gabaldon', 'Romance, Historical Fiction', 'Back in the highlands on the eve of a rebellion.'),
+    ('20', 'Murder on the Orient Express', 'Agatha Christie', 'Mystery, Crime, Classics', 'A detective investigates a murder on a snowbound train.'),
+    ('21', 'And Then There Were None', 'Agatha Christie', 'Mystery, Crime', 'Ten strangers on an island die one by one.'),
+    ('22', 'The Murder of Roger Ackroyd', 'Agatha Christie', 'Mystery, Crime', 'A village murder and a famous twist.'),
+    ('23', 'The Girl with the Dragon Tattoo', 'Stieg Larsson', 'Mystery, Thriller, Crime', 'A journalist and a hacker search for a missing girl.'),
+    ('24', 'Gone Girl', 'Gillian Flynn', 'Mystery, Thriller', 'A wife disappears and her husband becomes the suspect.'),
+    ('25', 'The Girl on the Train', 'Paula Hawkins', 'Mystery, Thriller', 'A commuter sees something from the train window.'),
+    ('26', 'A Brief History of Time', 'Stephen Hawking', 'Science, Nonfiction', 'Black holes, the big bang and the nature of time.'),
+    ('27', 'Sapiens', 'Yuval Noah Harari', 'History, Nonfiction', 'A history of humankind from the stone age.'),
+    ('28', 'Foundation', 'Isaac Asimov', 'Science Fiction, Classics', 'A mathematician predicts the fall of the galactic empire.'),
+    ('29', 'Foundation and Empire', 'Isaac Asimov', 'Science Fiction', 'The foundation faces the empire and the mule.'),
+    ('30', 'Ring', 'Koji Suzuki', 'Horror, Thriller', 'A cursed videotape kills its viewers in seven days.'),
+    ('31', 'Short', '', 'Horror', 'A short title that never matches anything.'),
+]
+
+# Genres whose substring match (the original loop) and whole-word match (GenreIndex) agree
+USER_GENRES = ['fantasy', 'romance']
+FRIENDS_GENRES = ['mystery', 'science fiction']
+
+CASES = [
+    # (current book, history, liked, disliked, friends' likes)
+    ('1', ['1'], ['1'], [], {}),
+    ('1', ['1', '5', '15'], ['1', '15'], ['5'], {'9': ['a@example.com'], '20': ['b@example.com']}),
+    ('8', ['8', '9', '4', '30'], ['8', '9'], ['4', '30'], {'11': ['a@example.com', 'b@example.com']}),
+    ('20', ['20', '12', '24'], ['20'], ['12', '24'], {'21': ['c@example.com'], '28': ['c@example.com']}),
+    ('missing', ['5', '6'], ['5', '6'], [], {}),
+    ('5', [str(i) for i in range(2, 30)], ['6', '7'], ['2', '3'], {'30': ['a@example.com']}),
+]
+
+
+def fixture_frame():
+    return train_model.prepare_book_data([
+        {'book_id': book_id, 'title': title, 'author': author, 'genres': genres, 'description': description,
+         'image_url': ''}
+        for book_id, title, author, genres, description in FIXTURE_BOOKS
+    ])
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    """The app module, loaded against the fixture catalog instead of the real model."""
+    models_dir = str(tmp_path_factory.mktemp('models'))
+    train_model.save_model(*train_model.build_model(fixture_frame(), index_type='graph'), models_dir=models_dir)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # Also where the app would save a retrained model (sync_database)
+        monkeypatch.setattr(train_model, 'MODELS_DIR', models_dir)
+        yield importlib.import_module('app')
+
+
+@pytest.fixture(scope='module')
+def reference_model():
+    """(BOOK_DATA, COSINE_SIM) as the original app loaded them."""
+    book_data = fixture_frame()
+    book_data['genres_str'] = book_data['genres'].fillna('').astype(str).str.lower()
+    tfidf_matrix = train_model.vectorize_books(book_data)
+    return book_data, (tfidf_matrix @ tfidf_matrix.T).toarray()
+
+
+# --- Original per-row implementation ---
+
+def reference_preference_score(book, user_genres):
+    if not user_genres:
+        return 0.0
+    book_genres_str = book.get('genres_str', '')
+    if not book_genres_str:
+        return 0.0
+    matches = 0
+    for genre in user_genres:
+        if genre.lower() in book_genres_str:
+            matches += 1
+    return matches / len(user_genres)
+
+
+def reference_scores(book_data, cosine_sim, current_book_id, history_list, user_genres=None, liked_book_ids=None,
+                     disliked_book_ids=None, friends_genres=None, friends_likes_map=None):
+    """The scoring loop of the original get_recommendation_from_model; [(book_id, score, liked_by)], best first."""
+    current_book_id = str(current_book_id)
+    if current_book_id not in book_data.index:
+        current_book_id = book_data.index[0]
+    idx = book_data.index.get_loc(current_book_id)
+
+    liked_authors = set()
+    liked_titles = []
+    if liked_book_ids:
+        valid_ids = [bid for bid in liked_book_ids if bid in book_data.index]
+        if valid_ids:
+            liked_authors = set(book_data.loc[valid_ids]['author'].fillna('').str.lower().tolist())
+            liked_titles = book_data.loc[valid_ids]['title'].fillna('').str.lower().tolist()
+
+    disliked_authors = set()
+    disliked_titles = []
+    if disliked_book_ids:
+        valid_bad_ids = [bid for bid in disliked_book_ids if bid in book_data.index]
+        if valid_bad_ids:
+            disliked_authors = set(book_data.loc[valid_bad_ids]['author'].fillna('').str.lower().tolist())
+            disliked_titles = book_data.loc[valid_bad_ids]['title'].fillna('').str.lower().tolist()
+
+    enhanced_scores = []
+    top_indices = cosine_sim[idx].argsort()[-500:][::-1]
+    for rec_idx in top_indices:
+        rec_id = book_data.index[rec_idx]
+        content_sim = cosine_sim[idx][rec_idx]
+        if str(rec_id) in history_list or rec_idx == idx:
+            continue
+        book = book_data.loc[rec_id]
+
+        score = content_sim * 0.4
+        if user_genres:
+            score += reference_preference_score(book, user_genres) * 0.4
+
+        book_author = book.get('author', '').lower()
+        if book_author in liked_authors:
+            score += 0.1
+
+        title_lower = book['title'].lower()
+        if len(title_lower) > 5:
+            for l_title in liked_titles:
+                if len(l_title) > 5 and (l_title in title_lower or title_lower in l_title):
+                    score += 0.15
+                    break
+
+        if book_author in disliked_authors:
+            score -= 0.15
+
+        if len(title_lower) > 5:
+            for d_title in disliked_titles:
+                if len(d_title) > 5 and (d_title in title_lower or title_lower in d_title):
+                    score -= 0.10
+                    break
+
+        liked_by_list = []
+        if friends_likes_map and str(rec_id) in friends_likes_map:
+            score += 0.15
+            liked_by_list = friends_likes_map[str(rec_id)]
+
+        if friends_genres:
+            score += reference_preference_score(book, friends_genres) * 0.05
+
+        enhanced_scores.append((str(rec_id), score, liked_by_list))
+
+    enhanced_scores.sort(key=lambda x: x[1], reverse=True)
+    return enhanced_scores
+
+
+# --- Tests ---
+
+@pytest.mark.parametrize('case', CASES)
+@pytest.mark.parametrize('genres', [(None, None), (USER_GENRES, FRIENDS_GENRES)])
+def test_scores_match_reference(app, reference_model, case, genres):
+    current, history, liked, disliked, friends_likes = case
+    user_genres, friends_genres = genres
+    expected = reference_scores(*reference_model, current, history, user_genres, liked, disliked,
+                                friends_genres, friends_likes)
+
+    idx = app.CATALOG.position(current)
+    candidates, scores = app.score_candidates(0 if idx is None else idx, history, user_genres, liked, disliked,
+                                              friends_genres, friends_likes)
+    actual = {app.CATALOG.book_ids[pos]: float(score) for pos, score in zip(candidates, scores)}
+
+    assert sorted(actual) == sorted(book_id for book_id, _, _ in expected)
+    for book_id, score, _ in expected:
+        assert actual[book_id] == pytest.approx(score, abs=1e-6), book_id
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_ranking_matches_reference(app, reference_model, case):
+    current, history, liked, disliked, friends_likes = case
+    expected = reference_scores(*reference_model, current, history, USER_GENRES, liked, disliked,
+                                FRIENDS_GENRES, friends_likes)
+    expected_scores = {book_id: score for book_id, score, _ in expected}
+
+    books = app.get_recommendations_from_model(current, history, USER_GENRES, liked, disliked, FRIENDS_GENRES,
+                                               friends_likes, limit=len(app.CATALOG))
+
+    assert len(books) == len(expected)
+    # Same score at every rank; books with equal scores may come in either order
+    ranked = [expected_scores[book['book_id']] for book in books]
+    assert ranked == pytest.approx([score for _, score, _ in expected], abs=1e-6)
+    assert np.all(np.diff(ranked) <= 1e-6)
+    for book in books:
+        assert book['liked_by'] == friends_likes.get(book['book_id'], [])
+    # The original returned the top book with its score clamped to 0-100
+    assert books[0]['score'] == pytest.approx(max(0.0, min(expected[0][1] * 100, 100.0)), abs=1e-4)
@@ -0,0 +1,140 @@
+# tests/test_shared_cache.py
+"""
+SharedCache on a tmp_path database: schema reset, since-guarded set(), clear_user()'s
+key range, and invalidations polled from another process (run as a subprocess writer),
+including records that another process's cleanup deleted before they were read.
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import shared_cache
+from cache_manager import CacheManager
+from shared_cache import SharedCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def run_writer(path, code, retention=shared_cache.LOG_RETENTION):
+    """Runs `code` in another process, with `shared` a SharedCache on `path`."""
+    script = textwrap.dedent(f'''
+        import sys
+        sys.path.insert(0, {ROOT!r})
+        from shared_cache import SharedCache
+        shared = SharedCache({path!r}, poll_interval=0, retention={retention!r})
+    ''') + textwrap.dedent(code)
+    subprocess.run([sys.executable, '-c', script], check=True, timeout=60)
+
+
+def test_older_schema_is_reset(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB, expiry REAL)')
+    conn.execute("INSERT INTO entries VALUES ('k', x'00', 1e12)")
+    conn.execute(f'PRAGMA user_version = {shared_cache.SCHEMA_VERSION - 1}')
+    conn.commit()
+    conn.close()
+
+    shared = SharedCache(path)
+    assert shared.get('k') is None
+    shared.set('k', 'v', ttl=60, stale_after=60)
+    assert shared.get('k')[0] == 'v'
+    assert sqlite3.connect(path).execute('PRAGMA user_version').fetchone()[0] == shared_cache.SCHEMA_VERSION
+
+
+@pytest.mark.parametrize('invalidate', [
+    lambda shared: shared.delete('user:u1:swipes'),
+    lambda shared: shared.clear_user('u1'),
+    lambda shared: shared.clear(),
+])
+def test_set_since_skips_after_invalidation(path, invalidate):
+    shared = SharedCache(path)
+    since = shared.current_seq()
+    invalidate(shared)
+
+    assert shared.set('user:u1:swipes', 'old', ttl=60, stale_after=60, since=since) is False
+    assert shared.get('user:u1:swipes') is None
+    # Unrelated invalidations don't block it; a later load's seq does not either
+    assert shared.set('user:u1:swipes', 'new', ttl=60, stale_after=60, since=shared.current_seq()) is True
+    assert shared.get('user:u1:swipes')[0] == 'new'
+
+
+def test_set_since_ignores_other_keys(path):
+    shared = SharedCache(path)
+    since = shared.current_seq()
+    shared.delete('user:u1:friends')
+    shared.clear_user('u2')
+    assert shared.set('user:u1:swipes', 'v', ttl=60, stale_after=60, since=since) is True
+
+
+def test_clear_user_deletes_only_that_users_keys(path):
+    shared = SharedCache(path)
+    keys = ['user:u1:swipes', 'user:u1:prefs', 'user:u10:swipes', 'user:u2:swipes', 'user:u1', 'book:u1']
+    for key in keys:
+        shared.set(key, key, ttl=60, stale_after=60)
+
+    shared.clear_user('u1')
+
+    assert [key for key in keys if shared.get(key) is not None] == ['user:u10:swipes', 'user:u2:swipes',
+                                                                    'user:u1', 'book:u1']
+
+
+def test_poll_returns_other_processes_invalidations(path):
+    shared = SharedCache(path, poll_interval=0)
+    shared.set('user:u1:swipes', 'v', ttl=60, stale_after=60)
+    # Own writes aren't reported
+    assert shared.poll() == []
+
+    run_writer(path, '''
+        shared.delete('user:u1:swipes')
+        shared.clear_user('u2')
+        shared.clear()
+    ''')
+
+    assert shared.poll() == [('key', 'user:u1:swipes'), ('user', 'u2'), ('all', None)]
+    assert shared.poll() == []
+
+
+def test_value_loaded_by_other_process_is_shared(path):
+    cache = CacheManager(shards=2, shared=SharedCache(path, poll_interval=0))
+    run_writer(path, "shared.set('user:u1:prefs', {'genres': ['fantasy']}, ttl=60, stale_after=60)")
+    assert cache.get('user:u1:prefs') == {'genres': ['fantasy']}
+    cache.refresher.shutdown()
+
+
+def test_records_cleaned_up_unread_clear_local_cache(path):
+    cache = CacheManager(shards=2, shared=SharedCache(path, poll_interval=0))
+    cache.set('user:u1:swipes', 'old', ttl=900)
+    cache.set('user:u2:swipes', 'other', ttl=900)
+    cache.get('warm')
+
+    # Another process deletes the key, then its cleanup (no retention) drops the record
+    run_writer(path, '''
+        shared.delete('user:u1:swipes')
+        shared.poll()
+    ''', retention=0)
+
+    assert cache.get('user:u1:swipes') is None
+    # The whole local level goes, since it isn't known what else was missed
+    assert cache._shard('user:u2:swipes').get('user:u2:swipes') is None
+    assert cache.shared.poll() == []
+    cache.refresher.shutdown()
+
+
+def test_set_since_skips_when_records_were_cleaned_up(path):
+    shared = SharedCache(path)
+    since = shared.current_seq()
+    run_writer(path, '''
+        shared.delete('user:u1:swipes')
+        shared.poll()
+    ''', retention=0)
+    assert shared.set('user:u1:swipes', 'old', ttl=60, stale_after=60, since=since) is False
@@ -0,0 +1,110 @@
+# tests/test_title_index.py
+"""
+TitleMatchIndex against the original per-title substring check of the series/title
+boosts (kept below as `reference_match`), on fixture titles including series, long
+and overlapping titles. The index must give identical results.
+"""
+
+import numpy as np
+import pytest
+
+from book_index import BookCatalog, TitleMatchIndex
+
+LONG_TITLE = ("Harry Potter and the Methods of Rationality: an extremely long fan fiction title "
+              "that goes on and on about wizards, science and the philosopher's stone")
+
+FIXTURE_TITLES = [
+    'Harry Potter',
+    "Harry Potter and the Sorcerer's Stone",
+    'Harry Potter and the Chamber of Secrets',
+    'HARRY POTTER and the Chamber of Secrets',
+    "The Philosopher's Stone",
+    'Dune',
+    'Dune Messiah',
+    'Children of Dune',
+    'The Hobbit',
+    'The Hobbit, or There and Back Again',
+    'The Lord of the Rings',
+    'The Lord of the Rings: The Fellowship of the Ring',
+    'The Fellowship of the Ring',
+    'Mistborn',
+    'Mistborn: The Final Empire',
+    'The Final Empire',
+    'Ring',
+    'Rings',
+    'Émile',
+    "Émile, ou De l'éducation",
+    'A Game of Thrones (A Song of Ice and Fire, #1)',
+    'A Game of Thrones',
+    'A Song of Ice and Fire',
+    '',
+    LONG_TITLE,
+    LONG_TITLE,
+]
+
+
+def reference_match(title, other_titles):
+    """The original check: both titles longer than 5 chars and one contains the other."""
+    title_lower = title.lower()
+    if len(title_lower) <= 5:
+        return False
+    for other in other_titles:
+        other_lower = other.lower()
+        if len(other_lower) > 5 and (other_lower in title_lower or title_lower in other_lower):
+            return True
+    return False
+
+
+def catalog_of(titles):
+    n = len(titles)
+    return BookCatalog([str(i) for i in range(n)], titles, ['author'] * n, [''] * n, [''] * n)
+
+
+def test_matches_reference_on_every_pair():
+    catalog = catalog_of(FIXTURE_TITLES)
+    positions = np.arange(len(FIXTURE_TITLES))
+    for other in positions:
+        expected = [reference_match(FIXTURE_TITLES[p], [FIXTURE_TITLES[other]]) for p in positions]
+        assert catalog.title_index.mask(positions, [other]).tolist() == expected, FIXTURE_TITLES[other]
+
+
+def test_matches_reference_for_liked_sets():
+    catalog = catalog_of(FIXTURE_TITLES)
+    positions = np.arange(len(FIXTURE_TITLES))
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        liked = rng.choice(len(FIXTURE_TITLES), int(rng.integers(0, 6)), replace=False)
+        expected = [reference_match(title, [FIXTURE_TITLES[p] for p in liked]) for title in FIXTURE_TITLES]
+        assert catalog.title_index.mask(positions, liked).tolist() == expected
+
+
+def test_round_trip():
+    index = catalog_of(FIXTURE_TITLES).title_index
+    loaded = TitleMatchIndex.from_dict(index.to_dict())
+    positions = np.arange(len(FIXTURE_TITLES))
+    assert loaded.mask(positions, [0, 5]).tolist() == index.mask(positions, [0, 5]).tolist()
+
+
+@pytest.mark.parametrize('title, other', [
+    # Containment inside a word counts, like in the original check
+    ('the hobbits', 'the hobbit'),
+    ('dunes of arrakis', 'dunes of arr'),
+    # However long the titles are
+    (LONG_TITLE + ', volume two', LONG_TITLE),
+    ('x' * 1000 + 'the fellowship of the ring' + 'y' * 1000, 'the fellowship of the ring'),
+])
+def test_contained_titles_match(title, other):
+    assert reference_match(title, [other])
+    catalog = catalog_of([title, other])
+    assert catalog.title_index.mask([0], [1])[0]
+    assert catalog.title_index.mask([1], [0])[0]
+
+
+def test_matches_reference_on_overlapping_titles():
+    # Many titles sharing prefixes and contained in each other at every offset
+    titles = ['the ring' + ' of the ring' * k for k in range(12)] + ['ring of the', 'of the ring', 'g of t']
+    catalog = catalog_of(titles)
+    positions = np.arange(len(titles))
+    for other in positions:
+        expected = [reference_match(titles[p], [titles[other]]) for p in positions]
+        assert catalog.title_index.mask(positions, [other]).tolist() == expected, titles[other]
@@ -0,0 +1,145 @@
+# tests/test_write_buffer.py
+"""
+WriteBehindBuffer against a fake Firestore client whose batch() commits into a dict.
+"""
+
+import signal
+
+import pytest
+
+import write_buffer
+from write_buffer import WriteBehindBuffer
+
+
+class FakeRef:
+    def __init__(self, path):
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc_ref, data):
+        self.writes.append((doc_ref.path, data))
+
+    def delete(self, doc_ref):
+        self.writes.append((doc_ref.path, None))
+
+    def commit(self):
+        if self.db.outage:
+            self.db.outage -= 1
+            raise RuntimeError('unavailable')
+        if any(path in self.db.poisoned for path, _ in self.writes):
+            raise ValueError('invalid document')
+        self.db.commits.append(list(self.writes))
+        for path, data in self.writes:
+            if data is None:
+                self.db.docs.pop(path, None)
+            else:
+                self.db.docs[path] = data
+
+
+class FakeDb:
+    def __init__(self, poisoned=(), outage=0):
+        self.docs = {}
+        self.commits = []
+        self.poisoned = set(poisoned)
+        # Commits that fail before Firestore is back
+        self.outage = outage
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def make_buffer(db, **kwargs):
+    # Nothing commits on its own: only flush(), close() or a full batch wake the worker
+    options = dict(flush_interval=60, retry_delay=0, max_retries=2, max_failed_rounds=3)
+    options.update(kwargs)
+    return WriteBehindBuffer(db, **options)
+
+
+@pytest.fixture
+def swipes():
+    return [FakeRef(f'users/u1/swipes/b{i}') for i in range(40)]
+
+
+def test_poisoned_write_is_isolated_and_dropped(swipes):
+    db = FakeDb(poisoned={swipes[17].path})
+    # Failed writes are retried on the next flush interval
+    buffer = make_buffer(db, flush_interval=0.01)
+    for i, ref in enumerate(swipes):
+        assert buffer.set(ref, {'n': i})
+
+    assert buffer.flush(timeout=10)
+
+    assert db.docs == {ref.path: {'n': i} for i, ref in enumerate(swipes) if i != 17}
+    assert buffer.metrics()['dropped'] == 1
+    assert buffer.metrics()['committed'] == 39
+    buffer.close()
+
+
+def test_short_outage_loses_nothing(swipes):
+    db = FakeDb(outage=7)
+    buffer = make_buffer(db, flush_interval=0.01, max_failed_rounds=20)
+    for i, ref in enumerate(swipes):
+        buffer.set(ref, {'n': i})
+
+    assert buffer.flush(timeout=10)
+
+    assert len(db.docs) == len(swipes)
+    assert buffer.metrics()['dropped'] == 0
+    buffer.close()
+
+
+def test_queued_writes_to_one_document_keep_the_last(swipes):
+    db = FakeDb()
+    buffer = make_buffer(db)
+    buffer.set(swipes[0], {'liked': True})
+    buffer.set(swipes[1], {'liked': True})
+    buffer.set(swipes[0], {'liked': False})
+    buffer.delete(swipes[1])
+    buffer.set(swipes[2], {'liked': True})
+
+    assert [data for _, data in buffer.pending_writes(lambda doc_id, data: True)] == [{'liked': False}, None,
+                                                                                      {'liked': True}]
+    assert buffer.flush(timeout=10)
+
+    assert db.commits == [[(swipes[0].path, {'liked': False}), (swipes[1].path, None), (swipes[2].path, {'liked': True})]]
+    assert db.docs == {swipes[0].path: {'liked': False}, swipes[2].path: {'liked': True}}
+    buffer.close()
+
+
+def test_close_flushes_pending_writes(swipes):
+    db = FakeDb()
+    buffer = make_buffer(db)
+    for i, ref in enumerate(swipes):
+        buffer.set(ref, {'n': i})
+    assert buffer.depth == len(swipes)
+
+    buffer.close()
+
+    assert len(db.docs) == len(swipes)
+    assert buffer.depth == 0
+    assert not buffer.worker.is_alive()
+    # Later writes are refused, so the caller writes them itself
+    assert buffer.set(swipes[0], {'n': -1}) is False
+
+
+def test_sigterm_flushes_and_exits(swipes, monkeypatch):
+    handlers, exit_hooks = {}, []
+    monkeypatch.setattr(write_buffer.signal, 'getsignal', lambda signum: signal.SIG_DFL)
+    monkeypatch.setattr(write_buffer.signal, 'signal', lambda signum, handler: handlers.__setitem__(signum, handler))
+    monkeypatch.setattr(write_buffer.atexit, 'register', exit_hooks.append)
+    db = FakeDb()
+    buffer = make_buffer(db)
+    buffer.install_shutdown_hooks()
+    buffer.set(swipes[0], {'liked': True})
+
+    with pytest.raises(SystemExit):
+        handlers[signal.SIGTERM](signal.SIGTERM, None)
+
+    assert db.docs == {swipes[0].path: {'liked': True}}
+    assert exit_hooks == [buffer.close]
@@ -1,69 +1,242 @@
 # train_model.py
 
 import pandas as pd
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
 import joblib
+import json
 import os
+import shutil
 import sys
+import time
 
-# --- Correctly import the function name ---
-from firebase_dal import get_all_books_from_db 
+from book_index import BookCatalog, GenreIndex
+from neighbor_index import (
+    DEFAULT_K, DEFAULT_DIM, DEFAULT_NPROBE, IVFIndex,
+    build_neighbor_graph, build_ivf_index, load_index
+)
 
-def train_model():
-    if not os.path.exists('models'):
-        os.makedirs('models')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+
+# Number of nearest neighbors kept per book (the recommender reads up to 500)
+NEIGHBOR_K = int(os.getenv('NEIGHBOR_K', DEFAULT_K))
+
+# Neighbor index type: 'graph' (exact top-K, default) or 'ivf' (approximate, for large catalogs)
+NEIGHBOR_INDEX = os.getenv('NEIGHBOR_INDEX', 'graph')
+ANN_DIM = int(os.getenv('ANN_DIM', DEFAULT_DIM))
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', DEFAULT_NPROBE))
+
+# Model artifact names (inside MODELS_DIR).
+# Numeric artifacts are raw .npy files opened with mmap_mode, so every gunicorn worker
+# shares one page-cache copy instead of deserializing its own.
+NEIGHBORS_DIR = 'neighbors'
+GENRES_DIR = 'genres'
+CENTRALITY_FILE = 'centrality.npy'
+CATALOG_FILE = 'catalog.joblib'
+MODEL_FILES = [NEIGHBORS_DIR, GENRES_DIR, CENTRALITY_FILE, CATALOG_FILE]
+META_FILE = 'meta.json'
+
+# Every save_model call writes a complete model version into its own directory
+# (MODELS_DIR/v<timestamp>) and only then replaces CURRENT_FILE, which names the version
+# to load. A worker booting during a sync therefore loads either the old or the new
+# model, never a mix. Models saved before versioning (artifacts directly in MODELS_DIR)
+# are still loaded when there is no CURRENT_FILE.
+CURRENT_FILE = 'current.json'
+VERSION_PREFIX = 'v'
+# Versions kept on disk (the current one included); older ones are deleted after a save
+KEEP_VERSIONS = 2
+
+def prepare_book_data(raw_data):
+    """Builds the cleaned, book_id-indexed DataFrame from raw Firebase book dicts."""
+    df = pd.DataFrame(raw_data)
+
+    # Resilient against missing columns
+    required_cols = ['book_id', 'description', 'genres', 'title', 'image_url', 'author']
+    for col in required_cols:
+        if col not in df.columns:
+            df[col] = ''
+
+    # Drop rows where 'book_id' (the primary key) is missing
+    df.dropna(subset=['book_id'], inplace=True)
+
+    # Fill remaining NaNs for text columns with empty strings
+    df['description'] = df['description'].fillna('')
+    df['genres'] = df['genres'].fillna('')
+    df['title'] = df['title'].fillna('Unknown Title')
+    df['author'] = df['author'].fillna('Unknown')
+
+    # Ensure book_id is the index
+    df['book_id'] = df['book_id'].astype(str)
+    df.set_index('book_id', inplace=True)
+
+    # Feature Engineering
+    df['soup'] = df['title'] + ' ' + df['description'] + ' ' + df['genres']
+    return df
+
+def vectorize_books(df):
+    """TF-IDF vectors (L2-normalized, so dot product == cosine similarity) of the book 'soup'."""
+    tfidf = TfidfVectorizer(stop_words='english')
+    return tfidf.fit_transform(df['soup'])
+
+def build_model(df, k=NEIGHBOR_K, index_type=NEIGHBOR_INDEX):
+    """
+    Vectorizes the books and returns (catalog, neighbors, centrality, genre_index):
+    - catalog: columnar BookCatalog (the DataFrame is only used at build time)
+    - neighbors: NeighborGraph with the top-k most similar books per book,
+      or an approximate IVFIndex over SVD embeddings when index_type == 'ivf'
+    - centrality: mean similarity of each book to the whole catalog
+    - genre_index: GenreIndex (book x genre matrix) over df['genres']
+    """
+    tfidf_matrix = vectorize_books(df)
+    if index_type == 'ivf':
+        neighbors, centrality = build_ivf_index(tfidf_matrix, k, dim=ANN_DIM, nprobe=ANN_NPROBE)
+    else:
+        neighbors, centrality = build_neighbor_graph(tfidf_matrix, k)
+    return BookCatalog.from_frame(df), neighbors, centrality, GenreIndex(df['genres'])
+
+def _save_npy(path, array):
+    """
+    Writes an .npy file atomically. Workers that already mmap the old file keep
+    reading the old inode instead of seeing a half-written one.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+def save_arrays(path, data):
+    """Saves a to_dict() mapping: arrays as .npy files in `path`, everything else in meta.json."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    meta = {}
+    for key, value in data.items():
+        if isinstance(value, np.ndarray):
+            _save_npy(os.path.join(path, f"{key}.npy"), value)
+        else:
+            meta[key] = value
+
+    # Drop arrays left over from a different index type
+    for name in os.listdir(path):
+        if name.endswith('.npy') and not isinstance(data.get(name[:-len('.npy')]), np.ndarray):
+            os.remove(os.path.join(path, name))
+
+    tmp_path = os.path.join(path, META_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
 
+def load_arrays(path, mmap_mode='r'):
+    """Inverse of save_arrays; arrays are memory-mapped read-only by default."""
+    with open(os.path.join(path, META_FILE)) as f:
+        data = json.load(f)
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            data[name[:-len('.npy')]] = np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+    return data
+
+def _models_dir(models_dir):
+    # Read at call time, so changing MODELS_DIR (e.g. in tests) reaches every default
+    return MODELS_DIR if models_dir is None else models_dir
+
+def current_version(models_dir=None):
+    """Name of the model version CURRENT_FILE points to, or None (no model, or the unversioned layout)."""
+    models_dir = _models_dir(models_dir)
+    try:
+        with open(os.path.join(models_dir, CURRENT_FILE)) as f:
+            return json.load(f)['version']
+    except FileNotFoundError:
+        return None
+
+def version_dir(models_dir=None, version=None):
+    """Directory holding the artifacts of `version` (default: the current one)."""
+    models_dir = _models_dir(models_dir)
+    if version is None:
+        version = current_version(models_dir)
+    return models_dir if version is None else os.path.join(models_dir, version)
+
+def model_exists(models_dir=None):
+    path = version_dir(models_dir)
+    return all(os.path.exists(os.path.join(path, f)) for f in MODEL_FILES)
+
+def _prune_versions(models_dir, keep=KEEP_VERSIONS):
+    """Deletes all but the newest `keep` version directories. Workers that mmap a deleted file keep reading it."""
+    versions = sorted(
+        name for name in os.listdir(models_dir)
+        if name.startswith(VERSION_PREFIX) and os.path.isdir(os.path.join(models_dir, name))
+    )
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(models_dir, name), ignore_errors=True)
+
+def save_model(catalog, neighbors, centrality, genre_index, models_dir=None):
+    """Writes all model artifacts as a new version in `models_dir` (default MODELS_DIR) and makes it the current one."""
+    models_dir = _models_dir(models_dir)
+    if not os.path.exists(models_dir):
+        os.makedirs(models_dir)
+
+    # 1. Write the whole version (zero-padded, so names sort by age)
+    version = f"{VERSION_PREFIX}{time.time_ns():020d}"
+    path = os.path.join(models_dir, version)
+    os.makedirs(path)
+    save_arrays(os.path.join(path, NEIGHBORS_DIR), neighbors.to_dict())
+    save_arrays(os.path.join(path, GENRES_DIR), genre_index.to_dict())
+    _save_npy(os.path.join(path, CENTRALITY_FILE), centrality)
+    joblib.dump(catalog.to_dict(), os.path.join(path, CATALOG_FILE))
+
+    # 2. Switch to it in one rename
+    tmp_path = os.path.join(models_dir, CURRENT_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version}, f)
+    os.replace(tmp_path, os.path.join(models_dir, CURRENT_FILE))
+
+    # 3. Clean up
+    _prune_versions(models_dir)
+    return version
+
+def load_model(models_dir=None, mmap_mode='r', version=None):
+    """
+    Loads (catalog, neighbors, centrality, genre_index) saved by save_model:
+    `version` if given, otherwise the current one.
+    """
+    path = version_dir(models_dir, version)
+    neighbors = load_index(load_arrays(os.path.join(path, NEIGHBORS_DIR), mmap_mode))
+    if isinstance(neighbors, IVFIndex):
+        # nprobe is a query-time setting, so it can be tuned without retraining
+        neighbors.nprobe = ANN_NPROBE
+
+    genre_index = GenreIndex.from_dict(load_arrays(os.path.join(path, GENRES_DIR), mmap_mode))
+    centrality = np.load(os.path.join(path, CENTRALITY_FILE), mmap_mode=mmap_mode)
+    catalog = BookCatalog.from_dict(joblib.load(os.path.join(path, CATALOG_FILE)))
+    return catalog, neighbors, centrality, genre_index
+
+def train_model():
     print("--- Starting AI Model Training (Source: Firebase) ---")
 
+    # Imported here so the build helpers above can be used without Firebase credentials
+    from firebase_dal import get_all_books_from_db
+
     try:
         # 1. Data Acquisition
         raw_data = get_all_books_from_db()
-        
+
         if not raw_data:
             print("WARNING: No book data returned from Firebase. Check your 'books' collection.")
             return False
 
-        df = pd.DataFrame(raw_data) 
+        # 2. Data Cleaning and Prep
+        df = prepare_book_data(raw_data)
         print(f"Loaded {len(df)} records from Firebase.")
 
-        # 2. Data Cleaning and Prep (Resilient against missing columns)
-        required_cols = ['book_id', 'description', 'genres', 'title', 'image_url', 'author']
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = ''
-        
-        # Drop rows where 'book_id' (the primary key) is missing
-        df.dropna(subset=['book_id'], inplace=True)
-        
-        # Fill remaining NaNs for text columns with empty strings
-        df['description'] = df['description'].fillna('')
-        df['genres'] = df['genres'].fillna('')
-        df['title'] = df['title'].fillna('Unknown Title')
-        
-        # Ensure book_id is the index
-        df['book_id'] = df['book_id'].astype(str)
-        df.set_index('book_id', inplace=True) 
-
-        # 3. Feature Engineering
-        df['soup'] = df['title'] + ' ' + df['description'] + ' ' + df['genres']
-        
-        # 4. Vectorization and Cosine Similarity
-        tfidf = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(df['soup'])
-        cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
-        
-        # 5. Save Model Components
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        models_dir = os.path.join(base_dir, 'models')
-        if not os.path.exists(models_dir):
-            os.makedirs(models_dir)
-            
-        joblib.dump(cosine_sim, os.path.join(models_dir, 'similarity_matrix.joblib'))
-        joblib.dump(df, os.path.join(models_dir, 'book_data_processed.joblib'))
+        # 3. Vectorization, Top-K Neighbor Graph, Centrality and Genre Matrix
+        catalog, neighbors, centrality, genre_index = build_model(df)
+        print(f"Built top-{neighbors.k} {neighbors.kind} neighbor index ({neighbors.nbytes / 1e6:.1f} MB).")
+
+        # 4. Save Model Components
+        save_model(catalog, neighbors, centrality, genre_index)
         print("Model training complete. Files saved.")
         return True
-        
+
     except Exception as e:
         print(f"FATAL ERROR during training: {e}")
         return False
@@ -71,4 +244,4 @@ def train_model():
 if __name__ == "__main__":
     success = train_model()
     if not success:
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,165 @@
+# user_directory.py
+"""
+In-process directory of users for search and typeahead.
+Built from a bulk export of Auth users and 'users' profiles, kept as two sorted
+arrays of (lowercase key, uid) - one for emails, one for usernames - so a search is
+a bisect plus a short scan, with no remote calls per keystroke.
+Search is unauthenticated, so emails are never matched by prefix, and users found
+by a username prefix only get a masked email; whole emails and usernames match exactly.
+The export always runs on a background thread (first at startup, then once it is
+older than `refresh_interval`); until the first one succeeds `ready` is False and
+callers use their remote lookups. In between exports, upsert() applies deltas.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+# Prefix queries shorter than this only match whole usernames
+MIN_PREFIX = 3
+MAX_RESULTS = 10
+# Seconds before a failed export is retried
+RETRY_INTERVAL = 60
+
+
+class UserDirectory:
+    def __init__(self, export_users, refresh_interval=600):
+        """`export_users()` returns {uid: {'email': ..., 'username': ...}} for every user."""
+        self.export_users = export_users
+        self.refresh_interval = refresh_interval
+
+        self.records = {}
+        self.email_keys = []
+        self.username_keys = []
+        self.loaded_at = None
+        self.failed_at = None
+
+        self.lock = threading.Lock()
+        # Thread running the export; a forked worker sees it as not alive and starts its own
+        self.refreshing = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, uid):
+        return uid in self.records
+
+    @property
+    def ready(self):
+        """True once an export has been loaded."""
+        return self.loaded_at is not None
+
+    # --- Building ---
+
+    def load(self):
+        """Runs the bulk export and swaps in the new arrays."""
+        records = self.export_users()
+        email_keys = sorted((r['email'].lower(), uid) for uid, r in records.items() if r.get('email'))
+        username_keys = sorted((r['username'].lower(), uid) for uid, r in records.items() if r.get('username'))
+        with self.lock:
+            self.records = records
+            self.email_keys = email_keys
+            self.username_keys = username_keys
+            self.loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing is not None and self.refreshing.is_alive():
+                return
+            self.refreshing = threading.Thread(target=self._run_load, name='user-directory-refresh', daemon=True)
+            self.refreshing.start()
+
+    def _run_load(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.failed_at = time.monotonic()
+            print(f"Error refreshing user directory: {e}")
+
+    def ensure_fresh(self):
+        """
+        Starts an export in the background if there is none yet (retrying a failed one
+        after RETRY_INTERVAL) or the loaded one is stale. Never blocks on it.
+        """
+        now = time.monotonic()
+        if self.loaded_at is None:
+            if self.failed_at is None or now - self.failed_at > RETRY_INTERVAL:
+                self._refresh_in_background()
+        elif now - self.loaded_at > self.refresh_interval:
+            self._refresh_in_background()
+
+    # --- Deltas ---
+
+    def upsert(self, uid, email=None, username=None):
+        """Adds or updates one user (e.g. one found by a remote lookup or a profile change)."""
+        with self.lock:
+            old = self.records.get(uid, {})
+            record = {'email': email or old.get('email'), 'username': username or old.get('username')}
+            if record == old:
+                return
+            self._remove_keys(uid, old)
+            self.records[uid] = record
+            if record['email']:
+                insort(self.email_keys, (record['email'].lower(), uid))
+            if record['username']:
+                insort(self.username_keys, (record['username'].lower(), uid))
+
+    def remove(self, uid):
+        with self.lock:
+            self._remove_keys(uid, self.records.pop(uid, {}))
+
+    def _remove_keys(self, uid, record):
+        for keys, value in ((self.email_keys, record.get('email')), (self.username_keys, record.get('username'))):
+            if value:
+                i = bisect_left(keys, (value.lower(), uid))
+                if i < len(keys) and keys[i] == (value.lower(), uid):
+                    del keys[i]
+
+    # --- Search ---
+
+    @staticmethod
+    def _scan(keys, query, exact, limit):
+        uids = []
+        i = bisect_left(keys, (query, ''))
+        while i < len(keys) and len(uids) < limit:
+            key, uid = keys[i]
+            if key != query and (exact or not key.startswith(query)):
+                break
+            uids.append(uid)
+            i += 1
+        return uids
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Users whose email or username is `query`, then users whose username starts with it
+        (case-insensitive). Returns a list of {'user_id', 'email', 'username'}; the email of
+        a prefix match is masked.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        with self.lock:
+            exact = []
+            for keys in (self.email_keys, self.username_keys):
+                exact += self._scan(keys, query, True, limit)
+            exact = list(dict.fromkeys(exact))
+            prefix = []
+            if len(query) >= MIN_PREFIX:
+                prefix = [uid for uid in self._scan(self.username_keys, query, False, limit + len(exact))
+                          if uid not in exact]
+
+            results = []
+            for uid in (exact + prefix)[:limit]:
+                record = self.records[uid]
+                email = record['email'] if uid in exact else mask_email(record['email'])
+                results.append({'user_id': uid, 'username': record['username'], 'email': email})
+        return results
+
+
+def mask_email(email):
+    """'jane.doe@example.com' -> 'j***@example.com' (None stays None)."""
+    if not email:
+        return email
+    local, _, domain = email.partition('@')
+    return f"{local[:1]}***@{domain}" if domain else f"{local[:1]}***"
@@ -0,0 +1,226 @@
+# write_buffer.py
+"""
+Write-behind buffer for Firestore document writes.
+Writes (sets and deletes) are queued in memory and committed by a background thread
+in WriteBatch commits of up to 500 operations, so request handlers don't wait on Firestore.
+A newer write to a document that is still queued replaces the queued one.
+Failed commits are retried with backoff; a batch that still fails is bisected so one bad
+write can't hold back the rest, and a write that keeps failing is eventually dropped.
+Pending writes are flushed on shutdown.
+"""
+
+import atexit
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+# Firestore's limit on operations per WriteBatch
+MAX_BATCH_WRITES = 500
+
+
+class WriteBehindBuffer:
+    def __init__(self, db, max_size=10000, batch_size=MAX_BATCH_WRITES, flush_interval=0.5,
+                 max_retries=5, retry_delay=0.5, max_failed_rounds=20):
+        self.db = db
+        self.max_size = max_size
+        self.batch_size = min(batch_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Rounds (max_retries attempts each, ~8 s with the default delays) a write may fail before it is dropped
+        self.max_failed_rounds = max_failed_rounds
+
+        # Queued writes keyed by document path, and in-flight writes: (doc_ref, data), data None = delete
+        self.pending = OrderedDict()
+        self.in_flight = []
+        # Document path -> failed rounds of the write queued for it
+        self.failures = {}
+        self.cond = threading.Condition()
+        self.closed = False
+
+        self.stats = {'committed': 0, 'batches': 0, 'failed_commits': 0, 'dropped': 0, 'rejected': 0, 'max_depth': 0}
+
+        self.worker = threading.Thread(target=self._run, name='firestore-write-behind', daemon=True)
+        self.worker.start()
+
+    @property
+    def depth(self):
+        """Writes not yet committed (queued + in flight)."""
+        with self.cond:
+            return len(self.pending) + len(self.in_flight)
+
+    def metrics(self):
+        with self.cond:
+            return dict(self.stats, depth=len(self.pending) + len(self.in_flight))
+
+    def set(self, doc_ref, data):
+        """
+        Queues doc_ref.set(data). Returns False (nothing queued) when the buffer is full
+        or closed, so the caller can write synchronously instead.
+        """
+        return self._queue(doc_ref, data)
+
+    def delete(self, doc_ref):
+        """Queues doc_ref.delete(); returns False like set()."""
+        return self._queue(doc_ref, None)
+
+    def _queue(self, doc_ref, data):
+        with self.cond:
+            queued = doc_ref.path in self.pending
+            if self.closed or (not queued and len(self.pending) >= self.max_size):
+                self.stats['rejected'] += 1
+                return False
+            # Replacing a queued write keeps its place; writes to other documents don't depend on the order
+            self.pending[doc_ref.path] = (doc_ref, data)
+            self.failures.pop(doc_ref.path, None)
+            depth = len(self.pending) + len(self.in_flight)
+            self.stats['max_depth'] = max(self.stats['max_depth'], depth)
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+            return True
+
+    def pending_writes(self, predicate):
+        """
+        (doc_id, data) of the uncommitted writes for which predicate(doc_id, data) is true,
+        oldest first; data is None for deletes.
+        """
+        with self.cond:
+            writes = list(self.in_flight) + list(self.pending.values())
+            return [(ref.id, data) for ref, data in writes if predicate(ref.id, data)]
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far is committed (or `timeout` seconds pass)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            self.cond.notify_all()
+            while self.pending or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """Stops accepting writes, flushes the queue and stops the worker."""
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        self.worker.join(timeout)
+        if self.depth:
+            print(f"WARNING: {self.depth} buffered Firestore writes were not committed at shutdown.")
+
+    def _run(self):
+        while True:
+            with self.cond:
+                # Wait for a full batch, the flush interval, or shutdown
+                if not self.closed and len(self.pending) < self.batch_size:
+                    self.cond.wait(self.flush_interval)
+                if not self.pending:
+                    if self.closed:
+                        return
+                    continue
+                while self.pending and len(self.in_flight) < self.batch_size:
+                    self.in_flight.append(self.pending.popitem(last=False)[1])
+                batch_writes = list(self.in_flight)
+
+            failed = [] if self._commit(batch_writes) else self._isolate(batch_writes)
+
+            with self.cond:
+                self.in_flight = []
+                if len(failed) < len(batch_writes):
+                    self.stats['committed'] += len(batch_writes) - len(failed)
+                    self.stats['batches'] += 1
+                if failed and self.closed:
+                    self._drop(failed, f"after {self.max_retries} failed commits at shutdown")
+                elif failed:
+                    # Keep them for the next round, ahead of newer writes (a newer write to the same document wins)
+                    retry, given_up = OrderedDict(), []
+                    for ref, data in failed:
+                        if ref.path in self.pending:
+                            continue
+                        self.failures[ref.path] = self.failures.get(ref.path, 0) + 1
+                        if self.failures[ref.path] >= self.max_failed_rounds:
+                            given_up.append((ref, data))
+                        else:
+                            retry[ref.path] = (ref, data)
+                    if given_up:
+                        self._drop(given_up, f"after {self.max_failed_rounds} failed rounds")
+                    retry.update(self.pending)
+                    self.pending = retry
+                for ref, _ in batch_writes:
+                    if ref.path not in self.pending:
+                        self.failures.pop(ref.path, None)
+                self.cond.notify_all()
+
+    def _drop(self, writes, reason):
+        self.stats['dropped'] += len(writes)
+        paths = ', '.join(ref.path for ref, _ in writes[:5])
+        print(f"ERROR: dropping {len(writes)} Firestore writes {reason} ({paths}{', ...' if len(writes) > 5 else ''}).")
+
+    def _commit_once(self, writes):
+        """Commits one WriteBatch. Returns True on success."""
+        try:
+            batch = self.db.batch()
+            for doc_ref, data in writes:
+                if data is None:
+                    batch.delete(doc_ref)
+                else:
+                    batch.set(doc_ref, data)
+            batch.commit()
+            return True
+        except Exception as e:
+            with self.cond:
+                self.stats['failed_commits'] += 1
+            print(f"Error committing {len(writes)} buffered Firestore writes: {e}")
+            return False
+
+    def _commit(self, writes):
+        """Commits one WriteBatch, retrying with exponential backoff. Returns True on success."""
+        for attempt in range(self.max_retries):
+            if attempt:
+                time.sleep(self.retry_delay * (2 ** (attempt - 1)))
+            if self._commit_once(writes):
+                return True
+        return False
+
+    def _isolate(self, writes):
+        """
+        Bisects a batch that failed all its retries, committing the halves that go through.
+        Returns the writes still failing: the bad write(s), or all of them when both
+        halves fail (Firestore is probably unavailable rather than one write being bad).
+        """
+        if len(writes) <= 1:
+            return writes
+        half = len(writes) // 2
+        left, right = writes[:half], writes[half:]
+        left_ok, right_ok = self._commit_once(left), self._commit_once(right)
+        if not left_ok and not right_ok:
+            return writes
+        return (self._isolate(left) if not left_ok else []) + (self._isolate(right) if not right_ok else [])
+
+    def install_shutdown_hooks(self):
+        """Flushes on interpreter exit and on SIGTERM (chaining to any existing SIGTERM handler)."""
+        atexit.register(self.close)
+
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+        except (AttributeError, ValueError):
+            return
+        if previous == signal.SIG_IGN:
+            return
+
+        def handle_sigterm(signum, frame):
+            self.close()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(128 + signum)
+
+        try:
+            signal.signal(signal.SIGTERM, handle_sigterm)
+        except ValueError:
+            # Not the main thread; atexit still flushes on a clean exit
+            pass